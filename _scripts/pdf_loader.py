@@ -15,6 +15,7 @@ from msgspec import Struct
 # ---------
 
 RETRIEVVY_URL = "http://0.0.0.0:7300"
+JOB_POLL_INTERVAL = 2
 
 
 # Types
@@ -143,24 +144,45 @@ async def read_docs(folder_path: str, index: str) -> list[Bundle]:
 # ---------------------------
 
 
-async def send_doc(doc: list[Bundle], url: str, token: str | None):
-    headers = {}
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-
+async def send_doc(client: httpx.AsyncClient, doc: Bundle, url: str) -> str | None:
+    # Retrievvy queues the bundle and answers with a job to poll, or asks us to
+    # come back later when its queue is full.
     doc_encoded = msgspec.json.encode(doc)
-    async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.post(
-            f"{url}/bundle",
-            content=doc_encoded,
-            headers=headers,
-        )
-    if response.status_code == 201:
-        print("Documents successfully ingested!")
-        print(response.json())
-    else:
-        print(f"Failed to ingest documents. Status code: {response.status_code}")
-        print(response.text)
+    while True:
+        response = await client.post(f"{url}/bundle", content=doc_encoded)
+        if response.status_code != 429:
+            break
+        wait = int(response.headers.get("Retry-After", "10"))
+        print(f"Queue full, retrying in {wait}s…")
+        await asyncio.sleep(wait)
+
+    if response.status_code == 202:
+        return response.json()["job"]
+    if response.status_code == 201:  # older servers ingest right away
+        print("Document successfully ingested!")
+        return None
+
+    print(f"Failed to send document. Status code: {response.status_code}")
+    print(response.text)
+    return None
+
+
+async def wait_jobs(client: httpx.AsyncClient, jobs: dict[str, str], url: str):
+    pending = dict(jobs)
+    while pending:
+        for job_id, doc_id in list(pending.items()):
+            response = await client.get(f"{url}/jobs/{job_id}")
+            job = response.json()
+            if job.get("state") == "completed":
+                print(f"Ingested {doc_id}")
+            elif job.get("state") == "failed" or response.status_code != 200:
+                print(f"Failed to ingest {doc_id}: {job.get('error', response.text)}")
+            else:
+                continue
+            del pending[job_id]
+
+        if pending:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
 
 
 #
@@ -172,10 +194,20 @@ async def main(
 ):
     documents = await read_docs(folder_path, index)
     if send_flag:
-        for i, doc in enumerate(documents, start=1):
-            print(f"Sending {i}/{len(documents)} (ID={doc.id})…")
-            await send_doc(doc, url, token)
-            print("Sent.\n")
+        headers = {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        async with httpx.AsyncClient(timeout=None, headers=headers) as client:
+            jobs: dict[str, str] = {}
+            for i, doc in enumerate(documents, start=1):
+                print(f"Sending {i}/{len(documents)} (ID={doc.id})…")
+                job_id = await send_doc(client, doc, url)
+                if job_id:
+                    jobs[job_id] = doc.id
+
+            print(f"\nWaiting for {len(jobs)} ingestion jobs…")
+            await wait_jobs(client, jobs, url)
     else:
         print_summary(documents)
 
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# Note
+# --------------------------------------------------------------------------------
+# Measures the upsert throughput of the Qdrant backend for a few batch sizes and
+# levels of parallelism. By default it runs against the in-process stand-in of
+# qdrant-client (":memory:"), pass --url to measure a real server, and --grpc to
+# use the gRPC transport. Every run creates and then drops its own collection.
+# --------------------------------------------------------------------------------
+
+
+async def run(points: int, dim: int, batch_sizes: list[int], parallels: list[int]):
+    # Imported late, the settings are read from the environment at import
+    from retrievvy.indexes.dense import qdrant
+    from retrievvy.indexes.dense.base import Vector
+
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(points, dim)).astype(np.float32)
+    vecs = [Vector(id=i + 1, vector=matrix[i]) for i in range(points)]
+
+    print(f"{'batch':>8} | {'parallel':>8} | {'seconds':>8} | {'points/s':>10}")
+    print("-" * 45)
+
+    for batch_size in batch_sizes:
+        for parallel in parallels:
+            qdrant.QDRANT_BATCH_SIZE = batch_size
+            qdrant.QDRANT_PARALLEL = parallel
+
+            name = f"bench_{batch_size}_{parallel}"
+            await qdrant.create(name, dim)
+            try:
+                started = time.perf_counter()
+                await qdrant.vec_add(name, vecs)
+                elapsed = time.perf_counter() - started
+            finally:
+                await qdrant.delete(name)
+
+            rate = points / elapsed
+            print(f"{batch_size:>8} | {parallel:>8} | {elapsed:>8.2f} | {rate:>10.0f}")
+
+
+def ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="uv run qdrant_bench.py")
+    parser.add_argument("--url", default=":memory:", help="Qdrant URL")
+    parser.add_argument("--grpc", action="store_true", help="Use the gRPC transport")
+    parser.add_argument("--wait", action="store_true", help="Wait for every batch")
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--batch-sizes", type=ints, default=[64, 256, 1024])
+    parser.add_argument("--parallel", type=ints, default=[1, 4])
+    args = parser.parse_args()
+
+    os.environ["QDRANT_URL"] = args.url
+    os.environ["QDRANT_GRPC"] = str(args.grpc)
+    os.environ["QDRANT_WAIT"] = str(args.wait)
+    os.environ.setdefault("DATA", tempfile.mkdtemp(prefix="retrievvy-bench-"))
+
+    asyncio.run(run(args.points, args.dim, args.batch_sizes, args.parallel))
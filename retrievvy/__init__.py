@@ -1,13 +1,29 @@
 import asyncio
+from typing import Annotated, Optional
 
-from msgspec import Struct
+import numpy as np
+from loguru import logger
+from msgspec import Meta, Struct
 
+from . import cache
 from . import database
+from . import metrics
 from . import rerank
 from . import stats
 
 from .indexes import dense, sparse
 from .nlp import keywords, embeddings
+from .config import (
+    QUERY_DEADLINE_MS,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    SEMANTIC_CACHE,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_THRESHOLDS,
+)
 
 # Types
 # -----
@@ -17,6 +33,11 @@ class Query(Struct):
     q: str
     index: str
     limit: int
+    deadline_ms: Optional[int] = None  # QUERY_DEADLINE_MS when not set
+    # Dense search parameters, the index options by default
+    hnsw_ef: Optional[Annotated[int, Meta(ge=1)]] = None
+    rescore: Optional[bool] = None
+    oversampling: Optional[Annotated[float, Meta(ge=1)]] = None
     # TODO: in future add filtering options
 
 
@@ -34,6 +55,25 @@ class Result(Struct):
     range: float
     avg_gap: float
     hits: list[Hit]
+    degraded: bool = False  # an engine missed the deadline
+
+
+class BatchQuery(Struct):
+    index: str
+    limit: int
+    queries: list[str]
+    deadline_ms: Optional[int] = None
+    hnsw_ef: Optional[Annotated[int, Meta(ge=1)]] = None
+    rescore: Optional[bool] = None
+    oversampling: Optional[Annotated[float, Meta(ge=1)]] = None
+
+
+# Caches
+# ------
+
+query_cache = cache.LRU("query", QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+result_cache = cache.LRU("result", RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+semantic_caches: dict[str, cache.Semantic] = {}  # by index, created on first use
 
 
 # Main
@@ -44,28 +84,201 @@ async def query(q: Query) -> Result:
     # Setup of initial conditions
     index = q.index
     limit = q.limit * 2 + 5  # Have a breathing room for the reranking process
-    query_keywords = keywords.get(q.q)
-    query_embedding = (await embeddings.get_async([q.q]))[0]
 
-    # Query the indexes
-    task_sparse = asyncio.to_thread(
-        sparse.query, index, " ".join(query_keywords), limit
-    )
-    task_dense = dense.query(index, query_embedding, limit)
-    hits_sparse, hits_dense = await asyncio.gather(task_sparse, task_dense)
+    # Served from cache while the index is unchanged. The generation is
+    # taken before searching, so a result that raced with an update is
+    # stored as stale already.
+    params = _search_params(q)
+    key = (index, _normalize(q.q), q.limit, params)
+    generation = cache.generation(index)
+    cached = result_cache.get(key, version=generation)
+    if cached is not None:
+        return cached
+
+    # Keyword extraction (in a thread) overlaps with the embedding round
+    # trip, and the sparse lookup starts as soon as the keywords are ready.
+    deadline = _deadline(q.deadline_ms)
+    task_keywords, task_embedding = _analyze(q.q)
+    task_sparse = asyncio.create_task(_search_sparse(index, task_keywords, limit))
+    task_dense = None
+
+    try:
+        # Without the embedding in time there is no dense lookup, the
+        # embedding is left running so it still lands in the query cache.
+        await asyncio.wait([task_embedding], timeout=_remaining(deadline))
+        query_embedding = _outcome(task_embedding, "query embedding")
+
+        # A paraphrase of a recent query reuses its result
+        semantic = _semantic_cache(index, params)
+        if semantic is not None and query_embedding is not None:
+            cached = semantic.get(query_embedding, q.limit, generation)
+            if cached is not None:
+                task_sparse.cancel()
+                result = _result(cached.hits[: q.limit])
+                result_cache.put(key, result, version=generation)
+                return result
+
+        if query_embedding is not None:
+            task_dense = asyncio.create_task(
+                _search_dense(index, query_embedding, limit, params)
+            )
+
+        hits_sparse, hits_dense = await _race(task_sparse, task_dense, deadline)
+    except BaseException:
+        task_sparse.cancel()
+        if task_dense is not None:
+            task_dense.cancel()
+        raise
+
+    degraded = hits_sparse is None or hits_dense is None
+    if degraded:
+        logger.warning(f"Degraded query on {index!r}: an engine failed or was late")
 
-    # Fuse the results
-    fused = rerank.adaptive_fusion(hits_dense, hits_sparse)
-    ids, scores = zip(*fused)
-    ids = list(ids)
-    scores = list(scores)
+    # Fuse the results, without any hit the result stays empty
+    with metrics.stage("query", "fusion"):
+        fused = (
+            rerank.adaptive_fusion(hits_dense or [], hits_sparse or [])
+            if hits_dense or hits_sparse
+            else []
+        )
+        ids = [id for id, _ in fused]
 
     # Fetch chunk data and build a lookup to preserve the fused order
-    chunks_raw = database.chunks_get(ids)
-    chunk_map = {c["id"]: c for c in chunks_raw}
+    with metrics.stage("query", "hydration"):
+        chunk_map = await database.chunks_get(ids)
+        hits = _hits(fused, chunk_map)[: q.limit]  # original requested limit
+    result = _result(hits, degraded)
+
+    # A degraded result is not worth serving again
+    if not degraded:
+        result_cache.put(key, result, version=generation)
+        if semantic is not None:
+            semantic.put(query_embedding, q.limit, result, generation)
+
+    return result
+
+
+async def query_batch(q: BatchQuery) -> list[Result]:
+    """
+    Many queries against the same index at once: one embedding request,
+    one Qdrant batch request, one Xapian handle and one chunk fetch.
+    Returns one result per query, in the same order.
+    """
+    index = q.index
+    limit = q.limit * 2 + 5  # Have a breathing room for the reranking process
+    generation = cache.generation(index)
+
+    params = _search_params(q)
+    keys = [(index, _normalize(text), q.limit, params) for text in q.queries]
+    results = [result_cache.get(key, version=generation) for key in keys]
+    todo = [i for i, result in enumerate(results) if result is None]
+    semantic = _semantic_cache(index, params)
+
+    deadline = _deadline(q.deadline_ms)
+    misses: list[int] = []  # positions in `todo` left to search
+    if todo:
+        # Like a single query: the sparse lookup starts as soon as the
+        # keywords are ready, and without the embeddings in time there is no
+        # dense lookup. Late analysis is left running so it still lands in
+        # the query cache.
+        task_keywords, task_embeddings = _analyze_batch([q.queries[i] for i in todo])
 
+        async def search_sparse():
+            query_keywords = await task_keywords
+            with metrics.stage("batch", "sparse"):
+                return await asyncio.to_thread(
+                    sparse.query_batch,
+                    index,
+                    [" ".join(kws) for kws in query_keywords],
+                    limit,
+                )
+
+        async def search_dense(vecs: list[np.ndarray]):
+            with metrics.stage("batch", "dense"):
+                return await dense.query_batch(
+                    index, np.stack(vecs), limit, params=params
+                )
+
+        task_sparse = asyncio.create_task(search_sparse())
+        task_dense = None
+        try:
+            await asyncio.wait([task_embeddings], timeout=_remaining(deadline))
+            query_embeddings = _outcome(task_embeddings, "query embeddings")
+
+            # Paraphrases of recent queries reuse their results
+            misses = list(range(len(todo)))
+            if semantic is not None and query_embeddings is not None:
+                misses = []
+                for j, vec in enumerate(query_embeddings):
+                    cached = semantic.get(vec, q.limit, generation)
+                    if cached is not None:
+                        results[todo[j]] = _result(cached.hits[: q.limit])
+                    else:
+                        misses.append(j)
+
+            if not misses:
+                task_sparse.cancel()
+            else:
+                if query_embeddings is not None:
+                    task_dense = asyncio.create_task(
+                        search_dense([query_embeddings[j] for j in misses])
+                    )
+                all_sparse, all_dense = await _race(task_sparse, task_dense, deadline)
+        except BaseException:
+            task_sparse.cancel()
+            if task_dense is not None:
+                task_dense.cancel()
+            raise
+
+    if misses:
+        degraded = all_sparse is None or all_dense is None
+        if degraded:
+            logger.warning(f"Degraded batch on {index!r}: an engine failed or was late")
+        all_sparse = (
+            [all_sparse[j] for j in misses]
+            if all_sparse is not None
+            else [[] for _ in misses]
+        )
+        all_dense = all_dense if all_dense is not None else [[] for _ in misses]
+
+        # Fuse the results, queries without any hit stay empty
+        with metrics.stage("batch", "fusion"):
+            all_fused = [
+                rerank.adaptive_fusion(hits_dense, hits_sparse)
+                if hits_dense or hits_sparse
+                else []
+                for hits_sparse, hits_dense in zip(all_sparse, all_dense)
+            ]
+
+        # Fetch the chunks of all queries together
+        with metrics.stage("batch", "hydration"):
+            ids = list({id for fused in all_fused for id, _ in fused})
+            chunk_map = await database.chunks_get(ids)
+
+        for j, fused in zip(misses, all_fused):
+            hits = _hits(fused, chunk_map)[: q.limit]
+            result = _result(hits, degraded)
+
+            results[todo[j]] = result
+            if semantic is not None and not degraded:
+                semantic.put(query_embeddings[j], q.limit, result, generation)
+
+    for key, result in zip(keys, results):
+        if not result.degraded:
+            result_cache.put(key, result, version=generation)
+
+    return results
+
+
+# Helpers
+# -------
+
+
+def _hits(
+    fused: list[tuple[int, float]], chunk_map: dict[int, database.ChunkRecord]
+) -> list[Hit]:
     hits: list[Hit] = []
-    for id, score in zip(ids, scores):
+    for id, score in fused:
         c = chunk_map.get(id)
         if not c:
             continue
@@ -73,15 +286,22 @@ async def query(q: Query) -> Result:
         hits.append(
             Hit(
                 id=id,
-                bundle_id=c["bundle_id"],
-                content=c["content"],
-                ref=c["ref"],
-                chunk_order=c["chunk_order"],
+                bundle_id=c.bundle_id,
+                content=c.content,
+                ref=c.ref,
+                chunk_order=c.chunk_order,
                 score=score,
             )
         )
 
-    hits = hits[: q.limit]  # original requested limit
+    return hits
+
+
+def _result(hits: list[Hit], degraded: bool = False) -> Result:
+    # Nothing to measure without hits
+    if not hits:
+        return Result(0.0, 0.0, 0.0, hits=[], degraded=degraded)
+
     final_scores = [h.score for h in hits]
 
     # Measure ranking quality -----------------------------------------
@@ -92,4 +312,191 @@ async def query(q: Query) -> Result:
     range_ = stats.range(final_scores)
     avg_gap = stats.avg_gap(final_scores)
 
-    return Result(gini=gini, range=range_, avg_gap=avg_gap, hits=hits)
+    return Result(
+        gini=gini, range=range_, avg_gap=avg_gap, hits=hits, degraded=degraded
+    )
+
+
+def _semantic_cache(index: str, params: dense.SearchParams) -> cache.Semantic | None:
+    # Only for the default search parameters of the index
+    if not SEMANTIC_CACHE or params != dense.SearchParams():
+        return None
+
+    semantic = semantic_caches.get(index)
+    if semantic is None:
+        threshold = SEMANTIC_CACHE_THRESHOLDS.get(index, SEMANTIC_CACHE_THRESHOLD)
+        semantic = cache.Semantic(f"semantic:{index}", SEMANTIC_CACHE_SIZE, threshold)
+        semantic_caches[index] = semantic
+
+    return semantic
+
+
+def _analyze(text: str) -> tuple[asyncio.Future, asyncio.Future]:
+    """
+    Keywords and embedding of the text, as two concurrently running tasks.
+    Both depend only on the text, so popular queries skip YAKE/NLTK and
+    the embedding round trip altogether.
+    """
+    key = _normalize(text)
+    cached = query_cache.get(key)
+    if cached is not None:
+        return _resolved(cached[0]), _resolved(cached[1])
+
+    task_keywords = asyncio.ensure_future(_keywords(text))
+    task_embedding = asyncio.ensure_future(_embed(text))
+
+    def store(_):
+        tasks = (task_keywords, task_embedding)
+        if all(t.done() and not t.cancelled() and not t.exception() for t in tasks):
+            query_cache.put(key, (task_keywords.result(), task_embedding.result()))
+
+    task_keywords.add_done_callback(store)
+    task_embedding.add_done_callback(store)
+    return task_keywords, task_embedding
+
+
+def _analyze_batch(texts: list[str]) -> tuple[asyncio.Future, asyncio.Future]:
+    """
+    Like _analyze, for many texts: the keywords of all of them in a single
+    thread hop and their embeddings in a single request, skipping the texts
+    cached already.
+    """
+    keys = [_normalize(text) for text in texts]
+    cached = [query_cache.get(key) for key in keys]
+    missing = [i for i, entry in enumerate(cached) if entry is None]
+    texts_missing = [texts[i] for i in missing]
+
+    async def extract():
+        if not missing:
+            return []
+        with metrics.stage("batch", "keywords"):
+            return await asyncio.to_thread(
+                lambda: [keywords.get(text) for text in texts_missing]
+            )
+
+    async def embed():
+        if not missing:
+            return []
+        with metrics.stage("batch", "embedding"):
+            return await embeddings.get_async(texts_missing)
+
+    task_extract = asyncio.ensure_future(extract())
+    task_embed = asyncio.ensure_future(embed())
+
+    async def merge(task: asyncio.Future, part: int) -> list:
+        found = dict(zip(missing, await task))
+        return [entry[part] if entry else found[i] for i, entry in enumerate(cached)]
+
+    def store(_):
+        tasks = (task_extract, task_embed)
+        if all(t.done() and not t.cancelled() and not t.exception() for t in tasks):
+            for i, kws, vec in zip(missing, task_extract.result(), task_embed.result()):
+                query_cache.put(keys[i], (kws, vec))
+
+    task_extract.add_done_callback(store)
+    task_embed.add_done_callback(store)
+    return (
+        asyncio.ensure_future(merge(task_extract, 0)),
+        asyncio.ensure_future(merge(task_embed, 1)),
+    )
+
+
+async def _keywords(text: str) -> list[str]:
+    with metrics.stage("query", "keywords"):
+        return await asyncio.to_thread(keywords.get, text)
+
+
+async def _embed(text: str) -> np.ndarray:
+    with metrics.stage("query", "embedding"):
+        return (await embeddings.get_async([text]))[0]
+
+
+async def _search_sparse(index: str, task_keywords: asyncio.Future, limit: int):
+    query_keywords = await task_keywords
+    with metrics.stage("query", "sparse"):
+        return await asyncio.to_thread(
+            sparse.query, index, " ".join(query_keywords), limit
+        )
+
+
+async def _search_dense(
+    index: str,
+    query_embedding: np.ndarray,
+    limit: int,
+    params: dense.SearchParams,
+):
+    with metrics.stage("query", "dense"):
+        return await dense.query(index, query_embedding, limit, params=params)
+
+
+def _search_params(q: Query | BatchQuery) -> dense.SearchParams:
+    return dense.SearchParams(
+        hnsw_ef=q.hnsw_ef, rescore=q.rescore, oversampling=q.oversampling
+    )
+
+
+async def _race(
+    task_sparse: asyncio.Task, task_dense: Optional[asyncio.Task], deadline
+) -> tuple:
+    """
+    Hits of both engines, None for an engine that failed, missed the
+    deadline or never started. Late engines are cancelled, their Xapian
+    thread or Qdrant request is abandoned. Without hits of any engine there
+    is nothing to fuse: the error of an engine is raised then, or a timeout.
+    """
+    tasks = [t for t in (task_sparse, task_dense) if t is not None]
+    _, pending = await asyncio.wait(tasks, timeout=_remaining(deadline))
+    for t in pending:
+        t.cancel()
+
+    errors = [t.exception() for t in tasks if t not in pending and t.exception()]
+    if len(pending) + len(errors) == len(tasks):
+        if errors:
+            raise errors[0]
+        raise TimeoutError("Both search engines missed the deadline")
+
+    engines = ("sparse search", "dense search")
+    return tuple(
+        _outcome(t, engine) if t is not None and t not in pending else None
+        for t, engine in zip((task_sparse, task_dense), engines)
+    )
+
+
+def _outcome(task: asyncio.Future, what: str):
+    # Result of a task, None when it isn't done or failed
+    if not task.done():
+        return None
+    if task.exception() is not None:
+        logger.opt(exception=task.exception()).warning(f"The {what} failed")
+        return None
+
+    return task.result()
+
+
+def _deadline(deadline_ms: Optional[int]) -> Optional[float]:
+    # Absolute loop time, or None without a deadline
+    if deadline_ms is None:
+        deadline_ms = QUERY_DEADLINE_MS
+    if deadline_ms <= 0:
+        return None
+
+    return asyncio.get_running_loop().time() + deadline_ms / 1000
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+def _resolved(value) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+def _normalize(text: str) -> str:
+    # Spacing doesn't change the outcome. Case does: keyword extraction and
+    # stemming are case-sensitive, so "Docker" and "docker" are kept apart.
+    return " ".join(text.split())
@@ -3,13 +3,14 @@ import atexit
 
 from loguru import logger
 from retrievvy import database, webserver
-from retrievvy.nlp import embeddings
+from retrievvy.nlp import embeddings, embcache
 
 if __name__ == "__main__":
     from retrievvy import config  # has side-effects
 
     # Initialize resources
     database.init()
+    embcache.init()
     embeddings.start_worker()
 
     if config.DEBUG:
@@ -0,0 +1,318 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import numpy as np
+
+# In-memory caches. They are only ever touched from the event loop,
+# so no locking is needed. Every cache registers itself by name, so
+# its stats can be reported without wiring it anywhere else.
+
+_registry: dict[str, "LRU | Semantic | Records"] = {}
+
+# Every index has a generation that is bumped whenever its content
+# changes. Entries stored with an older generation are never served.
+_generations: dict[str, int] = {}
+
+
+class LRU:
+    """
+    Bounded least-recently-used cache with an optional time to live.
+
+    Parameters
+    ----------
+    name : str
+        Name the cache is reported under.
+    capacity : int
+        Maximum number of entries. 0 disables the cache.
+    ttl : float
+        Seconds an entry stays valid. 0 means entries never expire.
+
+    Notes
+    -----
+    Entries can be stored with a version (e.g. an index generation).
+    Looking them up with a different version counts as a miss.
+    """
+
+    def __init__(self, name: str, capacity: int, ttl: float = 0):
+        self.name = name
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any, Any]] = OrderedDict()
+
+        _registry[name] = self
+
+    def get(self, key: Hashable, version: Any = None) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, entry_version, value = entry
+        if (expires and expires < time.monotonic()) or entry_version != version:
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, version: Any = None) -> None:
+        if self.capacity <= 0:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expires, version, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._data),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class Semantic:
+    """
+    Cache of results by query embedding, for near-duplicate queries
+    (paraphrases) that an exact text cache misses.
+
+    Keeps the most recent query vectors in a small matrix. A lookup is a
+    hit when the cosine similarity to a stored vector of the same version
+    reaches the threshold, and that vector was stored for at least the
+    requested limit.
+
+    Parameters
+    ----------
+    name : str
+        Name the cache is reported under.
+    capacity : int
+        Number of query vectors kept. Older ones are overwritten.
+    threshold : float
+        Minimum cosine similarity for a hit.
+    """
+
+    def __init__(self, name: str, capacity: int, threshold: float):
+        self.name = name
+        self.capacity = capacity
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+        # Allocated on first put, when the dimension is known
+        self._vectors: np.ndarray | None = None
+        self._limits = np.zeros(capacity, dtype=np.int64)
+        self._versions = np.full(capacity, -1, dtype=np.int64)
+        self._values: list[Any] = [None] * capacity
+        self._next = 0
+
+        _registry[name] = self
+
+    def get(self, vec: np.ndarray, limit: int, version: int) -> Any | None:
+        if self._vectors is None:
+            self.misses += 1
+            return None
+
+        usable = (self._versions == version) & (self._limits >= limit)
+        if not usable.any():
+            self.misses += 1
+            return None
+
+        sims = np.where(usable, self._vectors @ _unit(vec), -1.0)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._values[best]
+
+    def put(self, vec: np.ndarray, limit: int, value: Any, version: int) -> None:
+        if self.capacity <= 0:
+            return
+
+        if self._vectors is None:
+            self._vectors = np.zeros((self.capacity, len(vec)), dtype=np.float32)
+
+        slot = self._next
+        self._vectors[slot] = _unit(vec)
+        self._limits[slot] = limit
+        self._versions[slot] = version
+        self._values[slot] = value
+        self._next = (slot + 1) % self.capacity
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "items": int((self._versions >= 0).sum()),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class Records:
+    """
+    Records by id (e.g. chunks), least recently used first out, bounded by
+    the size of their text rather than by their number.
+
+    Parameters
+    ----------
+    name : str
+        Name the cache is reported under.
+    budget : int
+        Maximum size of the cached records, in bytes. 0 disables the cache.
+    size : Callable
+        Approximate size in bytes of a record.
+    group : Callable
+        Key grouping records that are dropped together (e.g. their bundle).
+
+    Notes
+    -----
+    A fetch that was running while a group was dropped may hold records
+    of it. Records are stored with the token taken before fetching them,
+    and discarded when a drop happened since.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        budget: int,
+        size: Callable[[Any], int],
+        group: Callable[[Any], Hashable],
+    ):
+        self.name = name
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._size = size
+        self._group = group
+        self._bytes = 0
+        self._drops = 0
+        self._data: OrderedDict[int, tuple[int, Any]] = OrderedDict()
+        self._groups: dict[Hashable, set[int]] = {}
+
+        _registry[name] = self
+
+    def get_many(self, ids: list[int]) -> tuple[dict[int, Any], list[int]]:
+        found: dict[int, Any] = {}
+        missing: list[int] = []
+        for id_ in ids:
+            entry = self._data.get(id_)
+            if entry is None:
+                missing.append(id_)
+                continue
+
+            self._data.move_to_end(id_)
+            found[id_] = entry[1]
+
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def token(self) -> int:
+        return self._drops
+
+    def put_many(self, records: dict[int, Any], token: int) -> None:
+        if self.budget <= 0 or token != self._drops:
+            return
+
+        for id_, record in records.items():
+            size = self._size(record)
+            if size > self.budget:
+                continue
+
+            self._remove(id_)
+            self._data[id_] = (size, record)
+            self._groups.setdefault(self._group(record), set()).add(id_)
+            self._bytes += size
+
+        while self._bytes > self.budget:
+            self._remove(next(iter(self._data)))
+
+    def drop(self, predicate: Callable[[Hashable], bool]) -> None:
+        # Every group matching the predicate, e.g. the bundles of an index
+        self._drops += 1
+        for key in [key for key in self._groups if predicate(key)]:
+            for id_ in list(self._groups.get(key, ())):
+                self._remove(id_)
+
+    def _remove(self, id_: int) -> None:
+        entry = self._data.pop(id_, None)
+        if entry is None:
+            return
+
+        size, record = entry
+        self._bytes -= size
+
+        key = self._group(record)
+        ids = self._groups[key]
+        ids.discard(id_)
+        if not ids:
+            del self._groups[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._data),
+            "bytes": self._bytes,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+# Generations
+# -----------
+
+
+def generation(index: str) -> int:
+    return _generations.get(index, 0)
+
+
+def bump(index: str) -> None:
+    _generations[index] = _generations.get(index, 0) + 1
+
+
+def drop(name: str) -> None:
+    """Unregisters a cache (e.g. of a deleted index), so it can be freed."""
+    _registry.pop(name, None)
+
+
+# Stats
+# -----
+
+
+def stats() -> dict[str, dict]:
+    return {name: c.stats() for name, c in _registry.items()}
@@ -0,0 +1,152 @@
+"""
+Compression of chunk contents, opt-in per index.
+
+Chunks of a compressed index are stored as BLOBs in `chunks.content`, in
+place of the text:
+
+    codec (1 byte) | dictionary id (4 bytes, 0 for none) | payload
+
+Every blob names the dictionary it was compressed with, so chunks written
+before and after a dictionary is (re)trained can be read side by side, as
+well as plain text rows of the same index.
+
+Codecs:
+
+- `zlib`: deflate with a preset dictionary of the most valuable words of
+  sample chunks (deflate only looks back 32 KiB, that's its size limit).
+- `zstd`: zstandard with a dictionary trained on sample chunks. Needs the
+  optional `zstandard` package (the `zstd` extra).
+
+Compressed contents can't be indexed by the `fts5` sparse backend, which
+reads the text of the `chunks` table itself.
+"""
+
+import struct
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional, the zstd extra
+    zstandard = None
+
+CODECS = ("none", "zlib", "zstd")
+
+ZLIB_LEVEL = 6
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_LEVEL = 3
+
+_HEADER = struct.Struct(">BI")
+_IDS = {"zlib": 1, "zstd": 2}
+_NAMES = {v: k for k, v in _IDS.items()}
+
+# Compressors and decompressors are not thread-safe, every thread keeps
+# its own per dictionary.
+_local = threading.local()
+
+
+def available(codec: str) -> bool:
+    return codec in ("none", "zlib") or (codec == "zstd" and zstandard is not None)
+
+
+def check(codec: str) -> None:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    if not available(codec):
+        raise ValueError(f"Compression codec '{codec}' needs the zstandard package")
+
+
+# Dictionaries
+# ------------
+
+
+def train(codec: str, samples: list[str], size: int = 64 * 1024) -> bytes:
+    check(codec)
+    if codec == "zstd":
+        data = [s.encode() for s in samples if s]
+        return zstandard.train_dictionary(size, data, level=ZSTD_LEVEL).as_bytes()
+
+    # The words worth the most bytes, best last: deflate matches closer
+    # positions with shorter codes.
+    counts = Counter(word for s in samples for word in s.split() if len(word) > 3)
+    ranked = sorted(counts, key=lambda w: counts[w] * len(w), reverse=True)
+
+    words: list[str] = []
+    used = 0
+    for word in ranked:
+        if counts[word] < 2:
+            break
+        used += len(word.encode()) + 1
+        if used > min(size, ZLIB_DICT_SIZE):
+            break
+        words.append(word)
+
+    return " ".join(reversed(words)).encode()
+
+
+# Contents
+# --------
+
+
+def compress(
+    text: str, codec: str, dict_id: int = 0, data: Optional[bytes] = None
+) -> bytes:
+    raw = text.encode()
+    if codec == "zlib":
+        c = (
+            zlib.compressobj(ZLIB_LEVEL, zdict=data)
+            if data
+            else zlib.compressobj(ZLIB_LEVEL)
+        )
+        payload = c.compress(raw) + c.flush()
+    elif codec == "zstd":
+        payload = _zstd(dict_id, data, compress=True).compress(raw)
+    else:
+        raise ValueError(f"Unknown compression codec: {codec}")
+
+    return _HEADER.pack(_IDS[codec], dict_id) + payload
+
+
+def decompress(blob: bytes, dictionary: Callable[[int], bytes]) -> str:
+    """Text of a compressed blob, `dictionary` returns the data of an id."""
+    codec, dict_id = _HEADER.unpack_from(blob)
+    payload = memoryview(blob)[_HEADER.size :]
+    data = dictionary(dict_id) if dict_id else None
+
+    if _NAMES.get(codec) == "zlib":
+        d = zlib.decompressobj(zdict=data) if data else zlib.decompressobj()
+        raw = d.decompress(payload) + d.flush()
+    elif _NAMES.get(codec) == "zstd":
+        raw = _zstd(dict_id, data, compress=False).decompress(payload)
+    else:
+        raise ValueError(f"Unknown compression codec id: {codec}")
+
+    return raw.decode()
+
+
+def codec_of(blob: bytes) -> tuple[str, int]:
+    codec, dict_id = _HEADER.unpack_from(blob)
+    return _NAMES[codec], dict_id
+
+
+def _zstd(dict_id: int, data: Optional[bytes], compress: bool):
+    if zstandard is None:
+        raise RuntimeError("Zstandard compressed contents need the zstandard package")
+
+    cache = getattr(_local, "zstd", None)
+    if cache is None:
+        cache = _local.zstd = {}
+
+    key = (dict_id, compress)
+    obj = cache.get(key)
+    if obj is None:
+        zdict = zstandard.ZstdCompressionDict(data) if data else None
+        obj = cache[key] = (
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict)
+            if compress
+            else zstandard.ZstdDecompressor(dict_data=zdict)
+        )
+
+    return obj
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import struct
+import sys
+import time
+
+from retrievvy import compression, database
+
+# Note
+# --------------------------------------------------------------------------------
+# Compression of the chunk contents of an index, from the command line:
+#
+#   python -m retrievvy.compression migrate my_index --codec zstd
+#   python -m retrievvy.compression report [my_index ...]
+#
+# `migrate` sets the codec of the index, trains a dictionary on a sample of its
+# chunks and rewrites every chunk with it (`--codec none` stores them as plain text
+# again). It can run while the server is up: chunks added meanwhile use the new
+# dictionary as soon as it is registered, and rows are rewritten a page at a time.
+# Unused dictionaries are dropped afterwards, except the two latest of the index,
+# which writes started before the migration may still be compressing with.
+# `report` compares the stored size of the chunks with the size of their text, and
+# measures how long they take to decompress.
+# --------------------------------------------------------------------------------
+
+PAGE = 500
+
+# Below this much sample text a dictionary isn't worth it
+MIN_SAMPLE_BYTES = 8 * 1024
+
+
+async def migrate(name: str, codec: str, samples: int, dict_size: int) -> None:
+    try:
+        compression.check(codec)
+    except ValueError as exc:
+        sys.exit(str(exc))
+
+    index = await database.index_get(name)
+    if index is None:
+        sys.exit(f"Index '{name}' not found")
+    if codec != "none" and index["sparse_backend"] == "fts5":
+        sys.exit("The fts5 sparse backend can't index compressed contents")
+
+    data = None
+    if codec != "none":
+        texts = await database.read(lambda db: _samples(db, name, samples))
+        size = sum(len(t.encode()) for t in texts)
+        if size >= MIN_SAMPLE_BYTES:
+            # A dictionary much larger than a tenth of its samples is mostly noise
+            dict_size = min(dict_size, size // 10)
+            data = await asyncio.to_thread(compression.train, codec, texts, dict_size)
+        print(f"Sampled {len(texts)} chunks ({size} bytes)")
+
+    def register(db) -> int:
+        dict_id = 0
+        if data:
+            dict_id = db.execute(
+                "INSERT INTO dictionaries (idx, codec, data) VALUES (?, ?, ?)",
+                (name, codec, data),
+            ).lastrowid
+        db.execute("UPDATE indexes SET compression = ? WHERE name = ?", (codec, name))
+        return dict_id
+
+    dict_id = await database.write(register)
+    print(f"Codec {codec}, dictionary {dict_id or '-'} ({len(data or b'')} bytes)")
+
+    after, rewritten = 0, 0
+    while True:
+        page = await database.read(lambda db: _page(db, name, after))
+        if not page:
+            break
+
+        rows = [
+            (
+                compression.compress(text, codec, dict_id, data)
+                if codec != "none"
+                else text,
+                id_,
+            )
+            for id_, text in page
+        ]
+        await database.write(
+            lambda db: db.executemany(
+                "UPDATE chunks SET content = ? WHERE id = ?", rows
+            )
+        )
+
+        after = page[-1][0]
+        rewritten += len(rows)
+        print(f"\rRewritten {rewritten} chunks", end="", flush=True)
+
+    print()
+    pruned = await database.write(lambda db: _prune(db, name, dict_id))
+    print(f"Dropped {pruned} unused dictionaries")
+
+
+async def report(names: list[str]) -> None:
+    if not names:
+        names = [index["name"] for index in await database.index_list()]
+
+    print(
+        f"{'index':>16} | {'codec':>5} | {'chunks':>8} | {'text MB':>8} | "
+        f"{'stored MB':>9} | {'saved':>6} | {'µs/chunk':>8}"
+    )
+    print("-" * 80)
+
+    for name in names:
+        index = await database.index_get(name)
+        if index is None:
+            print(f"{name:>16} | not found")
+            continue
+
+        chunks, text, stored, elapsed = await database.read(lambda db: _scan(db, name))
+        saved = 1 - stored / text if text else 0.0
+        micros = elapsed / chunks * 1e6 if chunks else 0.0
+        print(
+            f"{name:>16} | {index['compression']:>5} | {chunks:>8} | "
+            f"{text / 1e6:>8.2f} | {stored / 1e6:>9.2f} | {saved:>6.1%} | {micros:>8.1f}"
+        )
+
+
+# Helpers
+# -------
+
+
+def _samples(db, name: str, n: int) -> list[str]:
+    rows = db.execute(
+        "SELECT content FROM chunks WHERE idx = ? ORDER BY random() LIMIT ?", (name, n)
+    )
+    return [database.content_decode(db, content) for (content,) in rows]
+
+
+def _page(db, name: str, after: int) -> list[tuple[int, str]]:
+    rows = db.execute(
+        "SELECT id, content FROM chunks WHERE idx = ? AND id > ? ORDER BY id LIMIT ?",
+        (name, after, PAGE),
+    )
+    return [(id_, database.content_decode(db, content)) for id_, content in rows]
+
+
+def _scan(db, name: str) -> tuple[int, int, int, float]:
+    chunks, text, stored, elapsed = 0, 0, 0, 0.0
+    rows = db.execute("SELECT content FROM chunks WHERE idx = ?", (name,))
+    for (content,) in rows:
+        if not isinstance(content, bytes):
+            plain = content
+        else:
+            # The dictionary is loaded once and kept, as on the read path
+            _, dict_id = compression.codec_of(content)
+            data = database.dictionary_get(db, dict_id) if dict_id else None
+            started = time.perf_counter()
+            plain = compression.decompress(content, lambda _: data)
+            elapsed += time.perf_counter() - started
+
+        chunks += 1
+        text += len(plain.encode())
+        stored += len(content) if isinstance(content, bytes) else len(plain.encode())
+
+    return chunks, text, stored, elapsed
+
+
+def _prune(db, name: str, keep: int) -> int:
+    # Dictionaries of the index that no chunk was compressed with anymore. The
+    # two latest are kept: a write that started before the new one was
+    # registered may still commit chunks compressed with the previous one.
+    ids = [
+        id_
+        for (id_,) in db.execute(
+            "SELECT id FROM dictionaries WHERE idx = ? ORDER BY id DESC", (name,)
+        )
+    ][2:]
+    ids = [id_ for id_ in ids if id_ != keep]
+    unused = [
+        id_
+        for id_ in ids
+        if not db.execute(
+            """
+            SELECT 1 FROM chunks
+            WHERE idx = ? AND typeof(content) = 'blob' AND substr(content, 2, 4) = ?
+            LIMIT 1
+            """,
+            (name, struct.pack(">I", id_)),
+        ).fetchone()
+    ]
+    db.executemany("DELETE FROM dictionaries WHERE id = ?", [(id_,) for id_ in unused])
+    return len(unused)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m retrievvy.compression")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_migrate = commands.add_parser("migrate", help="Change the codec of an index")
+    parser_migrate.add_argument("index")
+    parser_migrate.add_argument("--codec", choices=compression.CODECS, required=True)
+    parser_migrate.add_argument("--samples", type=int, default=2000)
+    parser_migrate.add_argument("--dict-size", type=int, default=64 * 1024)
+
+    parser_report = commands.add_parser("report", help="Size savings and costs")
+    parser_report.add_argument("indexes", nargs="*")
+
+    args = parser.parse_args()
+    database.init()
+
+    if args.command == "migrate":
+        asyncio.run(migrate(args.index, args.codec, args.samples, args.dict_size))
+    else:
+        asyncio.run(report(args.indexes))
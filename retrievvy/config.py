@@ -8,15 +8,164 @@ ENV_PATH = Path(".env")
 config = Config(ENV_PATH if ENV_PATH.exists() else None)
 
 
+# Per index settings, e.g. "docs=0.95,faq=0.9"
+def _mapping(value: str) -> dict[str, str]:
+    pairs = (item.rsplit("=", 1) for item in value.split(",") if item.strip())
+    return {name.strip(): setting.strip() for name, setting in pairs}
+
+
+def _thresholds(value: str) -> dict[str, float]:
+    return {name: float(threshold) for name, threshold in _mapping(value).items()}
+
+
 # Data
 # ----
 DATA = Path(config("DATA", default="/app/data"))
 DATABASE = DATA / "database.sqlite"
 DIR_SPARSE = DATA / "sparse"
+DIR_DENSE = DATA / "dense"
+EMBED_CACHE = DATA / "embeddings.sqlite"
+
+# Database
+# --------
+# Reads run on a pool of read-only connections, writes are queued to a
+# single writer thread that applies up to DB_WRITE_BATCH of them per
+# transaction.
+DB_READERS = config("DB_READERS", cast=int, default=4)
+DB_WRITE_BATCH = config("DB_WRITE_BATCH", cast=int, default=64)
+
+# Dense index
+# -----------
+# Backend of new indexes, "qdrant" or "memmap" (exact search in process over
+# memory-mapped vectors). It can be set per index, e.g. DENSE_BACKENDS="docs=memmap"
+DENSE_BACKEND = config("DENSE_BACKEND", default="qdrant")
+DENSE_BACKENDS = config("DENSE_BACKENDS", cast=_mapping, default="")
+
+# Rows scored at once by the memmap backend
+DENSE_MEMMAP_BLOCK = config("DENSE_MEMMAP_BLOCK", cast=int, default=65536)
 
 # Qdrant
 # ------
+# ":memory:" runs an in-process stand-in instead of a server (tests, benchmarks)
 QDRANT_URL = config("QDRANT_URL", default="http://qdrant:6333")
+QDRANT_GRPC = config("QDRANT_GRPC", cast=bool, default=False)
+QDRANT_GRPC_PORT = config("QDRANT_GRPC_PORT", cast=int, default=6334)
+
+# Upserts are split in batches, a few of them in flight at once. Without
+# waiting, Qdrant acknowledges batches once queued and only the last one
+# waits for everything to be applied.
+QDRANT_BATCH_SIZE = config("QDRANT_BATCH_SIZE", cast=int, default=256)
+QDRANT_PARALLEL = config("QDRANT_PARALLEL", cast=int, default=4)
+QDRANT_WAIT = config("QDRANT_WAIT", cast=bool, default=False)
+
+# Sparse index
+# ------------
+# Backend of new indexes, "xapian" or "fts5" (SQLite full text search over
+# the chunks table). It can be set per index, e.g. SPARSE_BACKENDS="docs=fts5"
+SPARSE_BACKEND = config("SPARSE_BACKEND", default="xapian")
+SPARSE_BACKENDS = config("SPARSE_BACKENDS", cast=_mapping, default="")
+
+# Writes to an index go through a single writer thread that commits once
+# enough documents are pending or the oldest pending write is old enough.
+# An idle writer closes the index and stops after the idle timeout.
+SPARSE_COMMIT_DOCS = config("SPARSE_COMMIT_DOCS", cast=int, default=1000)
+SPARSE_COMMIT_MS = config("SPARSE_COMMIT_MS", cast=float, default=50.0)
+SPARSE_WRITER_IDLE = config("SPARSE_WRITER_IDLE", cast=float, default=60.0)
+
+# Bulk ingestion
+# --------------
+# Bundles streamed to /bundles:bulk go through chunking, embedding and
+# indexing as a pipeline, in groups: one database transaction and one
+# sparse and dense batch per index and group. A group closes at
+# BULK_GROUP_BUNDLES bundles, or once no bundle arrived for BULK_GROUP_MS.
+# Up to BULK_PIPELINE_DEPTH groups wait between two stages.
+BULK_GROUP_BUNDLES = config("BULK_GROUP_BUNDLES", cast=int, default=64)
+BULK_GROUP_MS = config("BULK_GROUP_MS", cast=float, default=200.0)
+BULK_PIPELINE_DEPTH = config("BULK_PIPELINE_DEPTH", cast=int, default=2)
+
+# Ingestion jobs
+# --------------
+# Bundles posted to /bundle are queued as jobs in the database, and
+# ingested by JOBS_WORKERS background workers. Beyond JOBS_QUEUE_MAX
+# queued jobs, new bundles are refused until the queue drains. Finished
+# jobs are kept for JOBS_KEEP_HOURS.
+# A running job is leased to its process, which renews the lease while it
+# works. Jobs whose lease is older than JOBS_LEASE_SECONDS are taken to
+# belong to a process that's gone, and are queued again.
+JOBS_WORKERS = config("JOBS_WORKERS", cast=int, default=2)
+JOBS_QUEUE_MAX = config("JOBS_QUEUE_MAX", cast=int, default=1000)
+JOBS_KEEP_HOURS = config("JOBS_KEEP_HOURS", cast=float, default=168)
+JOBS_LEASE_SECONDS = config("JOBS_LEASE_SECONDS", cast=float, default=60)
+
+# Embeddings
+# ----------
+# Pool of worker processes. Threads are the ONNX threads of each
+# worker (0 lets onnxruntime decide), pinning gives each worker its
+# own set of CPUs.
+EMBED_WORKERS = config("EMBED_WORKERS", cast=int, default=1)
+EMBED_THREADS = config("EMBED_THREADS", cast=int, default=0)
+EMBED_PIN_CPUS = config("EMBED_PIN_CPUS", cast=bool, default=False)
+
+# Bulk (ingestion) requests are split into slices, so queries can cut in
+# between, and are kept to the last workers of the pool. By default one
+# worker is left for queries alone when the pool has more than one.
+EMBED_BULK_SLICE = config("EMBED_BULK_SLICE", cast=int, default=64)
+EMBED_BULK_WORKERS = config(
+    "EMBED_BULK_WORKERS", cast=int, default=max(1, EMBED_WORKERS - 1)
+)
+if not 1 <= EMBED_BULK_WORKERS <= EMBED_WORKERS:
+    raise ValueError(
+        f"EMBED_BULK_WORKERS must be between 1 and EMBED_WORKERS ({EMBED_WORKERS}),"
+        f" got {EMBED_BULK_WORKERS}"
+    )
+
+# Requests reaching the worker within the window are embedded together,
+# as long as they don't exceed the max batch size (in sentences).
+EMBED_BATCH_WINDOW_MS = config("EMBED_BATCH_WINDOW_MS", cast=float, default=2.0)
+EMBED_BATCH_MAX = config("EMBED_BATCH_MAX", cast=int, default=64)
+
+# Persistent cache of chunk embeddings, keyed by model and content.
+# The least recently used vectors are evicted above the max items.
+EMBED_CACHE_ENABLED = config("EMBED_CACHE_ENABLED", cast=bool, default=True)
+EMBED_CACHE_MAX_ITEMS = config("EMBED_CACHE_MAX_ITEMS", cast=int, default=200_000)
+
+# Results at least this big are handed over through shared memory
+# instead of being pickled through the result queue.
+EMBED_SHM_MIN_BYTES = config("EMBED_SHM_MIN_BYTES", cast=int, default=256 * 1024)
+
+# Deadlines
+# ---------
+# Time budget of a search, unless the query sets its own. An engine that
+# doesn't answer in time is abandoned and the result is fused from the
+# other one, flagged as degraded. 0 disables the deadline.
+QUERY_DEADLINE_MS = config("QUERY_DEADLINE_MS", cast=int, default=5000)
+
+# Query caches
+# ------------
+# Keywords and embedding of recent queries, by normalized query text.
+# A TTL of 0 keeps entries until they are evicted.
+QUERY_CACHE_SIZE = config("QUERY_CACHE_SIZE", cast=int, default=10_000)
+QUERY_CACHE_TTL = config("QUERY_CACHE_TTL", cast=float, default=3600)
+
+# Full results by (index, query, limit). They are invalidated as soon as
+# the index changes, so by default they don't expire.
+RESULT_CACHE_SIZE = config("RESULT_CACHE_SIZE", cast=int, default=10_000)
+RESULT_CACHE_TTL = config("RESULT_CACHE_TTL", cast=float, default=0)
+
+# Chunks fetched to hydrate results, by id, within a budget in bytes of
+# text. Entries of a bundle are dropped when the bundle or its index is
+# deleted. 0 disables the cache.
+CHUNK_CACHE_BYTES = config("CHUNK_CACHE_BYTES", cast=int, default=64 * 1024 * 1024)
+
+# Semantic cache, off by default. Reuses the result of a recent query
+# whose embedding is close enough to the new one. The threshold can
+# be set per index, e.g. SEMANTIC_CACHE_THRESHOLDS="docs=0.95,faq=0.9"
+SEMANTIC_CACHE = config("SEMANTIC_CACHE", cast=bool, default=False)
+SEMANTIC_CACHE_SIZE = config("SEMANTIC_CACHE_SIZE", cast=int, default=256)
+SEMANTIC_CACHE_THRESHOLD = config("SEMANTIC_CACHE_THRESHOLD", cast=float, default=0.97)
+SEMANTIC_CACHE_THRESHOLDS = config(
+    "SEMANTIC_CACHE_THRESHOLDS", cast=_thresholds, default=""
+)
 
 # Webserver
 # ---------
@@ -41,3 +190,7 @@ if not DATA.exists():
 if not DIR_SPARSE.exists():
     DIR_SPARSE.mkdir(parents=True, exist_ok=True)
     logger.info(f"Created directory at {DIR_SPARSE} to store keyword indexes")
+
+if not DIR_DENSE.exists():
+    DIR_DENSE.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Created directory at {DIR_DENSE} to store vector indexes")
@@ -1,25 +1,61 @@
+import asyncio
+import json
+import queue
 import sqlite3
-from typing import Callable, Optional
+import sys
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
 
-from retrievvy.config import DATABASE
+from msgspec import Struct
 
-# Init
+from retrievvy import cache, compression
+from retrievvy.config import CHUNK_CACHE_BYTES, DATABASE, DB_READERS, DB_WRITE_BATCH
+
+# Types
 # -----
 
-db = sqlite3.connect(DATABASE)
-db.row_factory = sqlite3.Row
 
-db.executescript("""
+class ChunkRecord(Struct, frozen=True, gc=False):
+    id: int
+    idx: str
+    bundle_id: str
+    content: str
+    ref: str
+    chunk_order: int
+
+
+# Init
+# -----
+
+PRAGMAS = """
     PRAGMA foreign_keys = ON;
     PRAGMA journal_mode = WAL;
     PRAGMA synchronous = NORMAL;
     PRAGMA cache_size = -20000;
     PRAGMA temp_store = MEMORY;
-""")
+"""
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS indexes (
-    name TEXT PRIMARY KEY
+    name            TEXT PRIMARY KEY,
+    sparse_backend  TEXT NOT NULL DEFAULT 'xapian',
+    dense_backend   TEXT NOT NULL DEFAULT 'qdrant',
+    options         TEXT NOT NULL DEFAULT '{}',  -- JSON, dense IndexOptions
+    compression     TEXT NOT NULL DEFAULT 'none'  -- codec of new chunk contents
+);
+
+-- Compression dictionaries, the latest one of an index is used for new chunks
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    idx             TEXT NOT NULL,
+    codec           TEXT NOT NULL,
+    data            BLOB NOT NULL,
+    created         DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (idx) REFERENCES indexes (name) ON DELETE CASCADE
 );
 
 CREATE TABLE IF NOT EXISTS bundles (
@@ -38,26 +74,201 @@ CREATE TABLE IF NOT EXISTS chunks (
     id              INTEGER PRIMARY KEY AUTOINCREMENT,
     idx             TEXT NOT NULL,
     bundle_id       TEXT NOT NULL,
-    content         TEXT NOT NULL,
+    content         TEXT NOT NULL,  -- BLOB when compressed, see `compression`
     ref             TEXT NOT NULL,
     chunk_order     INTEGER NOT NULL,
 
     FOREIGN KEY (bundle_id, idx) REFERENCES bundles (id, idx) ON DELETE CASCADE
 );
 
+CREATE TABLE IF NOT EXISTS jobs (
+    id              TEXT PRIMARY KEY,
+    bundle_id       TEXT NOT NULL,
+    idx             TEXT NOT NULL,
+    payload         BLOB,  -- the bundle as JSON, dropped once the job is over
+    state           TEXT NOT NULL DEFAULT 'queued' CHECK(state IN ('queued', 'running', 'completed', 'failed')),
+    error           TEXT,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    owner           TEXT,  -- process running the job, it renews `updated` meanwhile
+    created         DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated         DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Enforce unique chunk ordering per bundle
 CREATE UNIQUE INDEX IF NOT EXISTS ux_chunks_bundle_order ON chunks(bundle_id, idx, "chunk_order");
 
 CREATE INDEX IF NOT EXISTS idx_chunks_bundle ON chunks(bundle_id);
 CREATE INDEX IF NOT EXISTS ix_bundles_idx ON bundles(idx);
 CREATE INDEX IF NOT EXISTS ix_chunks_idx_bundle ON chunks(idx, bundle_id);
+CREATE INDEX IF NOT EXISTS ix_dictionaries_idx ON dictionaries(idx);
+CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs(state, created);
+CREATE INDEX IF NOT EXISTS ix_jobs_bundle ON jobs(bundle_id, idx);
 """
 
 
 def init():
-    # Schema initialize
-    with db:
-        db.executescript(SCHEMA)
+    # Schema initialize, before any reader or the writer is around
+    db = _connect()
+    try:
+        with db:
+            db.executescript(SCHEMA)
+
+        # Columns added after the first release
+        _add_column(db, "indexes", "sparse_backend", "TEXT NOT NULL DEFAULT 'xapian'")
+        _add_column(db, "indexes", "dense_backend", "TEXT NOT NULL DEFAULT 'qdrant'")
+        _add_column(db, "indexes", "options", "TEXT NOT NULL DEFAULT '{}'")
+        _add_column(db, "indexes", "compression", "TEXT NOT NULL DEFAULT 'none'")
+    finally:
+        db.close()
+
+
+def _add_column(db: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    columns = [row["name"] for row in db.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        with db:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _connect(readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        uri = DATABASE.resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+    else:
+        # Transactions are opened explicitly by the writer
+        conn = sqlite3.connect(DATABASE, isolation_level=None)
+
+    conn.row_factory = sqlite3.Row
+    conn.executescript(PRAGMAS)
+    return conn
+
+
+# Connections
+# -----------
+# Reads run on a pool of threads, each with its own read-only connection.
+# Under WAL they never wait for writes, and see what was committed when
+# their statement started.
+#
+# Writes are queued to a single writer thread, the only one holding a
+# writable connection. It takes whatever is queued (up to DB_WRITE_BATCH)
+# and applies it in one transaction, every write in its own savepoint: a
+# failing write is rolled back alone, and the others are acknowledged
+# once the transaction is committed.
+
+_readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+_local = threading.local()
+
+
+def connection() -> sqlite3.Connection:
+    """
+    Read-only connection of the calling thread, for reads off the event
+    loop (e.g. in the reader pool or through asyncio.to_thread). Writes go
+    through `submit` or `write`.
+    """
+    conn = getattr(_local, "db", None)
+    if conn is None:
+        conn = _local.db = _connect(readonly=True)
+
+    return conn
+
+
+async def read(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Runs `fn` with a read-only connection, in the reader pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_readers, lambda: fn(connection()))
+
+
+def submit(fn: Callable[[sqlite3.Connection], Any]) -> Future:
+    """
+    Queues `fn` to the writer, which runs it with the writable connection
+    inside a transaction. The future resolves to its result once committed.
+    `fn` must not commit, nor wait for other writes (it runs on the writer).
+    """
+    future: Future = Future()
+    with _writer_lock:
+        global _writer
+        if _writer is None:
+            _writer = _Writer()
+        _writer.jobs.put(_Job(fn, future))
+
+    return future
+
+
+async def write(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    return await asyncio.wrap_future(submit(fn))
+
+
+@dataclass
+class _Job:
+    fn: Callable[[sqlite3.Connection], Any]
+    future: Future
+
+
+class _Writer:
+    def __init__(self):
+        self.jobs: queue.Queue[_Job] = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        db = _connect()
+        while True:
+            batch = self._gather(self.jobs.get())
+            try:
+                self._write(db, batch)
+            except Exception as exc:
+                # Commit failed (or the transaction was lost), nothing landed
+                if db.in_transaction:
+                    db.rollback()
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(exc)
+
+    def _gather(self, first: _Job) -> list[_Job]:
+        # Whatever is queued already, writes are never held back
+        batch = [first]
+        while len(batch) < DB_WRITE_BATCH:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, db: sqlite3.Connection, batch: list[_Job]) -> None:
+        applied: list[tuple[_Job, Any]] = []
+        db.execute("BEGIN IMMEDIATE")
+
+        for job in batch:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            db.execute("SAVEPOINT job")
+            try:
+                result = job.fn(db)
+            except Exception as exc:
+                db.execute("ROLLBACK TO job")
+                db.execute("RELEASE job")
+                job.future.set_exception(exc)
+                continue
+
+            db.execute("RELEASE job")
+            applied.append((job, result))
+
+        db.execute("COMMIT")
+        for job, result in applied:
+            job.future.set_result(result)
+
+
+_writer: Optional[_Writer] = None
+_writer_lock = threading.Lock()
+
+
+async def _one(sql: str, args=()) -> Optional[sqlite3.Row]:
+    return await read(lambda db: db.execute(sql, args).fetchone())
+
+
+async def _all(sql: str, args=()) -> list[sqlite3.Row]:
+    return await read(lambda db: db.execute(sql, args).fetchall())
 
 
 # In many cases I use the pattern of passing an optional callback
@@ -67,36 +278,55 @@ def init():
 # wrong, the transaction is rolled back. One such example is the
 # deletion of an index, which requires also the deletion of data
 # in many other places including the file system.
+#
+# The callbacks run on the writer thread, inside the savepoint of
+# their write: if they raise, the write is rolled back with them.
 
 
 # Indexes
 # -------
 
 
-def index_add(name: str, cb: Optional[Callable] = None) -> None:
-    with db:
-        db.execute("INSERT INTO indexes (name) VALUES (?)", (name,))
+async def index_add(
+    name: str,
+    sparse_backend: str = "xapian",
+    dense_backend: str = "qdrant",
+    options: str = "{}",
+    compression: str = "none",
+    cb: Optional[Callable] = None,
+) -> None:
+    def apply(db: sqlite3.Connection):
+        db.execute(
+            """
+            INSERT INTO indexes (name, sparse_backend, dense_backend, options, compression)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (name, sparse_backend, dense_backend, options, compression),
+        )
 
         if cb:
             cb()
 
+    await write(apply)
 
-def index_del(name: str, cb: Optional[Callable] = None) -> None:
-    with db:
+
+async def index_del(name: str, cb: Optional[Callable] = None) -> None:
+    def apply(db: sqlite3.Connection):
         db.execute("DELETE FROM indexes WHERE name = ?", (name,))
 
         if cb:
             cb()
 
+    await write(apply)
+    _chunk_cache.drop(lambda key: key[0] == name)
+
 
-def index_get(name: str):
-    cur = db.cursor()
-    cur.execute("SELECT * FROM indexes WHERE name = ?", (name,))
-    row = cur.fetchone()
+async def index_get(name: str):
+    row = await _one("SELECT * FROM indexes WHERE name = ?", (name,))
     return dict(row) if row else None
 
 
-def index_list(page: int = 0, items: int = 0):
+async def index_list(page: int = 0, items: int = 0):
     sql = "SELECT name FROM indexes ORDER BY name ASC"
     args = []  # happily avoid sql injection :)
 
@@ -105,10 +335,7 @@ def index_list(page: int = 0, items: int = 0):
         offset = max(0, page - 1) * items
         args.extend([items, offset])
 
-    cur = db.cursor()
-    cur.execute(sql, args)
-    rows = cur.fetchall()
-
+    rows = await _all(sql, args)
     return [dict(row) for row in rows]
 
 
@@ -116,10 +343,10 @@ def index_list(page: int = 0, items: int = 0):
 # -------
 
 
-def bundle_add(
+async def bundle_add(
     bundle_id: str, index: str, source: str, name: str, cb: Optional[Callable] = None
 ) -> None:
-    with db:
+    def apply(db: sqlite3.Connection):
         db.execute(
             """
             INSERT INTO bundles (id, idx, source, name) 
@@ -132,23 +359,28 @@ def bundle_add(
         if cb:
             cb()
 
+    await write(apply)
 
-def bundle_del(bundle_id: str, index: str, cb: Optional[Callable] = None) -> None:
-    with db:
+
+async def bundle_del(bundle_id: str, index: str, cb: Optional[Callable] = None) -> None:
+    def apply(db: sqlite3.Connection):
         db.execute("DELETE FROM bundles WHERE id = ? AND idx = ?", (bundle_id, index))
 
         if cb:
             cb()
 
+    await write(apply)
+    _chunk_cache.drop(lambda key: key == (index, bundle_id))
+
 
-def bundle_get(bundle_id: str, index: str):
-    cur = db.cursor()
-    cur.execute("SELECT * FROM bundles WHERE id = ? AND idx = ?", (bundle_id, index))
-    row = cur.fetchone()
+async def bundle_get(bundle_id: str, index: str):
+    row = await _one(
+        "SELECT * FROM bundles WHERE id = ? AND idx = ?", (bundle_id, index)
+    )
     return dict(row) if row else None
 
 
-def bundle_list(index: str, page: int = 0, items: int = 0):
+async def bundle_list(index: str, page: int = 0, items: int = 0):
     sql = "SELECT * FROM bundles WHERE idx = ?"
     args = [index]
 
@@ -157,35 +389,109 @@ def bundle_list(index: str, page: int = 0, items: int = 0):
         offset = max(0, page - 1) * items
         args.extend([items, offset])
 
-    cur = db.cursor()
-    cur.execute(sql, args)
-    rows = cur.fetchall()
-
+    rows = await _all(sql, args)
     return [dict(row) for row in rows]
 
 
-def bundle_status_get(bundle_id: str, index: str):
-    cur = db.cursor()
-    cur.execute(
+async def bundle_status_get(bundle_id: str, index: str):
+    row = await _one(
         "SELECT status FROM bundles WHERE id = ? AND idx = ?", (bundle_id, index)
     )
-    row = cur.fetchone()
     return row["status"] if row else None
 
 
-def bundle_status_set(bundle_id: str, index: str, status: str):
-    with db:
-        db.execute(
+async def bundle_status_set(bundle_id: str, index: str, status: str):
+    await write(
+        lambda db: db.execute(
             "UPDATE bundles SET status = ? WHERE id = ? AND idx = ?",
             (status, bundle_id, index),
         )
+    )
+
+
+# Bundles in groups, keyed by (bundle id, index). A group is written in one
+# transaction, e.g. during bulk ingestion.
+
+
+async def bundles_status_get(keys: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+    rows = await _all(
+        """
+        SELECT id, idx, status FROM bundles
+        WHERE (id, idx) IN (
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+            FROM json_each(?)
+        )
+        """,
+        (json.dumps(keys),),
+    )
+    return {(row["id"], row["idx"]): row["status"] for row in rows}
+
+
+async def bundles_status_set(keys: list[tuple[str, str]], status: str):
+    await write(
+        lambda db: db.executemany(
+            "UPDATE bundles SET status = ? WHERE id = ? AND idx = ?",
+            [(status, bundle_id, index) for bundle_id, index in keys],
+        )
+    )
+
+
+async def bundles_chunked(
+    bundles: list[tuple[str, str, str, str]],
+    chunks: list[tuple[str, str, str, str, int]],
+    cb: Optional[Callable] = None,
+) -> None:
+    """
+    Bundles (id, index, source, name) along with their chunks, marked as
+    chunked, in one transaction. Chunks left by an earlier attempt at a
+    pending bundle are replaced. `cb(db, keys)` runs last, in the same
+    transaction, with the (id, index) of the bundles.
+    """
+    contents = await read(lambda db: _pack(db, [(c[0], c[2]) for c in chunks]))
+    chunks = [
+        (idx, bundle_id, content, ref, order)
+        for (idx, bundle_id, _, ref, order), (_, content) in zip(chunks, contents)
+    ]
+    keys = [(bundle_id, index) for bundle_id, index, _, _ in bundles]
+
+    def apply(db: sqlite3.Connection):
+        db.executemany(
+            """
+            INSERT INTO bundles (id, idx, source, name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(id, idx) DO NOTHING
+            """,
+            bundles,
+        )
+        db.executemany(
+            """
+            DELETE FROM chunks WHERE bundle_id = ? AND idx = ? AND EXISTS (
+                SELECT 1 FROM bundles b
+                WHERE b.id = chunks.bundle_id AND b.idx = chunks.idx
+                AND b.status = 'pending'
+            )
+            """,
+            keys,
+        )
+        db.executemany(
+            "INSERT INTO chunks (idx, bundle_id, content, ref, chunk_order) VALUES (?, ?, ?, ?, ?)",
+            chunks,
+        )
+        db.executemany(
+            "UPDATE bundles SET status = 'chunked' WHERE id = ? AND idx = ?", keys
+        )
+
+        if cb:
+            cb(db, keys)
+
+    await write(apply)
 
 
 # Chunks
 # ------
 
 
-def chunk_add(
+async def chunk_add(
     index: str,
     bundle_id: str,
     content: str,
@@ -193,82 +499,370 @@ def chunk_add(
     chunk_order: int,
     cb: Optional[Callable] = None,
 ) -> None:
-    with db:
+    stored = await read(lambda db: _pack(db, [(index, content)])[0][1])
+
+    def apply(db: sqlite3.Connection):
         db.execute(
             "INSERT INTO chunks (idx, bundle_id, content, ref, chunk_order) VALUES (?, ?, ?, ?, ?)",
-            (index, bundle_id, content, ref, chunk_order),
+            (index, bundle_id, stored, ref, chunk_order),
         )
 
         if cb:
             cb()
 
+    await write(apply)
 
-def chunks_add(
+
+async def chunks_add(
     chunks: list[tuple[str, str, str, str, int]],
 ) -> None:
-    with db:
-        db.executemany(
+    # Contents of compressed indexes are compressed on a reader, not the writer
+    contents = await read(lambda db: _pack(db, [(c[0], c[2]) for c in chunks]))
+    chunks = [
+        (idx, bundle_id, content, ref, order)
+        for (idx, bundle_id, _, ref, order), (_, content) in zip(chunks, contents)
+    ]
+
+    await write(
+        lambda db: db.executemany(
             "INSERT INTO chunks (idx, bundle_id, content, ref, chunk_order) VALUES (?, ?, ?, ?, ?)",
             chunks,
         )
+    )
 
 
-def chunk_get(chunk_id: int):
-    cur = db.cursor()
-    cur.execute("SELECT * FROM chunks WHERE id = ?", (chunk_id,))
-    row = cur.fetchone()
-    return dict(row) if row else None
+async def chunk_get(chunk_id: int):
+    def fetch(db: sqlite3.Connection):
+        row = db.execute("SELECT * FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+        return _unpack(db, dict(row)) if row else None
 
+    return await read(fetch)
 
-def chunks_get(chunk_ids: list[int]):
-    if len(chunk_ids) <= 900:
-        placeholders = ",".join("?" for _ in chunk_ids)
-        sql = f"SELECT * FROM chunks WHERE id IN ({placeholders})"
-        cur = db.cursor()
-        cur.execute(sql, chunk_ids)
-        return [dict(row) for row in cur.fetchall()]
 
-    # Fallback for >900 IDs
-    with db:
-        db.execute("CREATE TEMP TABLE IF NOT EXISTS temp_ids (id INTEGER PRIMARY KEY)")
-        db.execute("DELETE FROM temp_ids")
+async def chunks_get(chunk_ids: list[int]) -> dict[int, ChunkRecord]:
+    """
+    Chunks by id, for the ids that exist. Recently fetched chunks are
+    served from memory, the others are fetched in one statement.
+    """
+    found, missing = _chunk_cache.get_many(chunk_ids)
+    if missing:
+        token = _chunk_cache.token()
+        fetched = await read(lambda db: _chunks_fetch(db, missing))
+        _chunk_cache.put_many(fetched, token)
+        found.update(fetched)
 
-        db.executemany(
-            "INSERT INTO temp_ids (id) VALUES (?)", [(cid,) for cid in chunk_ids]
+    return found
+
+
+def _chunks_fetch(
+    db: sqlite3.Connection, chunk_ids: list[int]
+) -> dict[int, ChunkRecord]:
+    # Ids as a JSON array, no limit on their number and nothing to write
+    rows = db.execute(
+        """
+        SELECT id, idx, bundle_id, content, ref, chunk_order
+        FROM chunks
+        WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps(chunk_ids),),
+    )
+    return {
+        id_: ChunkRecord(id_, idx, bundle_id, content_decode(db, content), ref, order)
+        for id_, idx, bundle_id, content, ref, order in rows
+    }
+
+
+def _chunk_size(chunk: ChunkRecord) -> int:
+    # The strings dominate, plus the struct and the entry around it
+    strings = (chunk.idx, chunk.bundle_id, chunk.content, chunk.ref)
+    return sum(sys.getsizeof(s) for s in strings) + 128
+
+
+# Chunk ids are never reused, only deleted chunks must go
+_chunk_cache = cache.Records(
+    "chunks",
+    CHUNK_CACHE_BYTES,
+    size=_chunk_size,
+    group=lambda chunk: (chunk.idx, chunk.bundle_id),
+)
+
+
+async def chunks_get_by_bundle_id(index: str, bundle_id: str):
+    def fetch(db: sqlite3.Connection):
+        rows = db.execute(
+            """
+            SELECT id, idx, bundle_id, content, ref, chunk_order 
+            FROM chunks 
+            WHERE idx = ? AND bundle_id = ? 
+            ORDER BY chunk_order ASC
+            """,
+            (index, bundle_id),
         )
+        return [_unpack(db, dict(row)) for row in rows]
+
+    return await read(fetch)
+
 
-        cur = db.cursor()
-        cur.execute("""
-            SELECT c.* FROM chunks c
-            JOIN temp_ids t ON c.id = t.id
-        """)
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
+async def chunks_get_by_bundles(keys: list[tuple[str, str]]):
+    def fetch(db: sqlite3.Connection):
+        rows = db.execute(
+            """
+            SELECT id, idx, bundle_id, content, ref, chunk_order
+            FROM chunks
+            WHERE (bundle_id, idx) IN (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+                FROM json_each(?)
+            )
+            ORDER BY idx, bundle_id, chunk_order ASC
+            """,
+            (json.dumps(keys),),
+        )
+        return [_unpack(db, dict(row)) for row in rows]
 
+    return await read(fetch)
 
-def chunks_get_by_bundle_id(index: str, bundle_id: str):
-    cur = db.cursor()
-    cur.execute(
+
+async def chunks_get_by_index(index: str):
+    def fetch(db: sqlite3.Connection):
+        rows = db.execute(
+            """
+            SELECT id, idx, bundle_id, content, ref, chunk_order 
+            FROM chunks 
+            WHERE idx = ? 
+            ORDER BY chunk_order ASC
+            """,
+            (index,),
+        )
+        return [_unpack(db, dict(row)) for row in rows]
+
+    return await read(fetch)
+
+
+# Jobs
+# ----
+# Ingestion of a bundle, queued by POST /bundle and run by the workers of
+# `jobs`. The status of the bundle tells where a job left off.
+
+
+async def job_add(bundle_id: str, index: str, payload: bytes) -> tuple[str, str]:
+    """
+    Queues a job, returns its id and what became of the payload:
+    - `queued`: a new job.
+    - `replaced`: the bundle had a job queued already, it gets the payload.
+    - `running`: the bundle has a job running, the payload is dropped.
+    """
+
+    def apply(db: sqlite3.Connection) -> tuple[str, str]:
+        row = db.execute(
+            """
+            SELECT id, state FROM jobs
+            WHERE bundle_id = ? AND idx = ? AND state IN ('queued', 'running')
+            """,
+            (bundle_id, index),
+        ).fetchone()
+        if row and row["state"] == "running":
+            return row["id"], "running"
+        if row:
+            db.execute(
+                """
+                UPDATE jobs SET payload = ?, updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (payload, row["id"]),
+            )
+            return row["id"], "replaced"
+
+        job_id = uuid.uuid4().hex
+        db.execute(
+            "INSERT INTO jobs (id, bundle_id, idx, payload) VALUES (?, ?, ?, ?)",
+            (job_id, bundle_id, index, payload),
+        )
+        return job_id, "queued"
+
+    return await write(apply)
+
+
+async def job_get(job_id: str):
+    row = await _one(
         """
-        SELECT id, idx, bundle_id, content, ref, chunk_order 
-        FROM chunks 
-        WHERE idx = ? AND bundle_id = ? 
-        ORDER BY chunk_order ASC
+        SELECT j.id, j.bundle_id, j.idx, j.state, b.status, j.error, j.attempts,
+               j.created, j.updated
+        FROM jobs j LEFT JOIN bundles b ON b.id = j.bundle_id AND b.idx = j.idx
+        WHERE j.id = ?
         """,
-        (index, bundle_id),
+        (job_id,),
     )
-    return [dict(row) for row in cur.fetchall()]
+    return dict(row) if row else None
+
+
+async def jobs_queued() -> int:
+    row = await _one("SELECT count(*) FROM jobs WHERE state = 'queued'")
+    return row[0]
 
 
-def chunks_get_by_index(index: str):
-    cur = db.cursor()
-    cur.execute(
+async def job_claim(owner: str):
+    # The oldest queued job, marked as running. Claims go through the
+    # writer one at a time, a job is never claimed twice.
+    rows = await write(
+        lambda db: db.execute(
+            """
+            UPDATE jobs SET state = 'running', attempts = attempts + 1, owner = ?,
+                updated = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs WHERE state = 'queued'
+                ORDER BY created, rowid LIMIT 1
+            )
+            RETURNING id, bundle_id, idx, payload
+            """,
+            (owner,),
+        ).fetchall()  # to the end, the statement must be done before the commit
+    )
+    return dict(rows[0]) if rows else None
+
+
+async def job_renew(job_id: str, owner: str) -> bool:
+    """Extends the lease of a running job, False once it isn't ours anymore."""
+    renewed = await write(
+        lambda db: (
+            db.execute(
+                """
+            UPDATE jobs SET updated = CURRENT_TIMESTAMP
+            WHERE id = ? AND owner = ? AND state = 'running'
+            """,
+                (job_id, owner),
+            ).rowcount
+        )
+    )
+    return renewed > 0
+
+
+async def job_finish(
+    job_id: str, owner: str, state: str, error: Optional[str] = None
+) -> None:
+    # A job requeued since, by an expired lease, is left to its new run
+    await write(
+        lambda db: db.execute(
+            """
+            UPDATE jobs SET state = ?, error = ?, payload = NULL,
+                updated = CURRENT_TIMESTAMP
+            WHERE id = ? AND owner = ? AND state = 'running'
+            """,
+            (state, error, job_id, owner),
+        )
+    )
+
+
+async def jobs_recover(lease_seconds: float) -> int:
+    """
+    Requeues the running jobs whose lease expired: their process is gone,
+    they resume from the status of their bundle. Jobs of live processes
+    renew their lease and are left alone.
+    """
+    return await write(
+        lambda db: (
+            db.execute(
+                """
+            UPDATE jobs SET state = 'queued', owner = NULL
+            WHERE state = 'running' AND updated < datetime('now', ?)
+            """,
+                (f"-{lease_seconds} seconds",),
+            ).rowcount
+        )
+    )
+
+
+async def jobs_prune(keep_hours: float) -> int:
+    return await write(
+        lambda db: (
+            db.execute(
+                """
+            DELETE FROM jobs WHERE state IN ('completed', 'failed')
+            AND updated < datetime('now', ?)
+            """,
+                (f"-{keep_hours} hours",),
+            ).rowcount
+        )
+    )
+
+
+# Compression
+# -----------
+# Contents of indexes with a compression codec are stored compressed, with
+# the latest dictionary of the index. Reads decompress them transparently.
+
+
+async def dictionary_add(index: str, codec: str, data: bytes) -> int:
+    def apply(db: sqlite3.Connection) -> int:
+        cur = db.execute(
+            "INSERT INTO dictionaries (idx, codec, data) VALUES (?, ?, ?)",
+            (index, codec, data),
+        )
+        return cur.lastrowid
+
+    return await write(apply)
+
+
+def content_decode(db: sqlite3.Connection, content) -> str:
+    """Text of a stored chunk content, decompressed if need be."""
+    if isinstance(content, bytes):
+        return compression.decompress(content, lambda id_: dictionary_get(db, id_))
+    return content
+
+
+def dictionary_get(db: sqlite3.Connection, dict_id: int) -> bytes:
+    """Data of a compression dictionary, kept once loaded."""
+    # Dictionaries never change, and ids are never reused
+    data = _dictionaries.get(dict_id)
+    if data is None:
+        row = db.execute(
+            "SELECT data FROM dictionaries WHERE id = ?", (dict_id,)
+        ).fetchone()
+        if row is None:
+            raise LookupError(f"Compression dictionary {dict_id} not found")
+        data = _dictionaries[dict_id] = row[0]
+
+    return data
+
+
+def _pack(db: sqlite3.Connection, contents: list[tuple[str, str]]) -> list:
+    # (index, text) pairs to (index, stored content)
+    packed = []
+    settings: dict[str, tuple] = {}
+    for index, text in contents:
+        setting = settings.get(index)
+        if setting is None:
+            setting = settings[index] = _compression(db, index)
+
+        codec, dict_id, data = setting
+        if codec != "none":
+            text = compression.compress(text, codec, dict_id, data)
+        packed.append((index, text))
+
+    return packed
+
+
+def _compression(db: sqlite3.Connection, index: str) -> tuple:
+    # Codec of the index, with its latest dictionary of that codec if any
+    row = db.execute(
         """
-        SELECT id, idx, bundle_id, content, ref, chunk_order 
-        FROM chunks 
-        WHERE idx = ? 
-        ORDER BY chunk_order ASC
+        SELECT i.compression, (
+            SELECT max(d.id) FROM dictionaries d
+            WHERE d.idx = i.name AND d.codec = i.compression
+        )
+        FROM indexes i WHERE i.name = ?
         """,
         (index,),
-    )
-    return [dict(row) for row in cur.fetchall()]
+    ).fetchone()
+    if row is None or row[0] == "none":
+        return "none", 0, None
+
+    dict_id = row[1] or 0
+    return row[0], dict_id, dictionary_get(db, dict_id) if dict_id else None
+
+
+def _unpack(db: sqlite3.Connection, chunk: dict) -> dict:
+    chunk["content"] = content_decode(db, chunk["content"])
+    return chunk
+
+
+_dictionaries: dict[int, bytes] = {}
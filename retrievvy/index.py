@@ -1,14 +1,29 @@
 import asyncio
-from dataclasses import dataclass
-from typing import Literal
+from dataclasses import dataclass, field as dataclass_field
+from typing import AsyncIterator, Callable, Literal, Optional
 
-from msgspec import Struct
+import numpy as np
+from msgspec import Struct, field
+from msgspec.json import encode
 from loguru import logger
 
+from . import cache
 from . import chunks
+from . import compression
 from . import database
-
-from .nlp import embeddings
+from . import metrics
+
+from .config import (
+    BULK_GROUP_BUNDLES,
+    BULK_GROUP_MS,
+    BULK_PIPELINE_DEPTH,
+    DENSE_BACKEND,
+    DENSE_BACKENDS,
+    EMBED_CACHE_ENABLED,
+    SPARSE_BACKEND,
+    SPARSE_BACKENDS,
+)
+from .nlp import embeddings, embcache
 from .indexes import sparse, dense
 
 # Types
@@ -23,6 +38,16 @@ class Bundle(Struct):
     blocks: list[str]
 
 
+class NewIndex(Struct):
+    name: str
+    # By default, the backends configured for the index or for all indexes
+    dense_backend: Optional[str] = None
+    sparse_backend: Optional[str] = None
+    options: dense.IndexOptions = field(default_factory=dense.IndexOptions)
+    # Codec of the chunk contents, see `compression`
+    compression: Literal["none", "zlib", "zstd"] = "none"
+
+
 @dataclass
 class Chunk:
     content: str
@@ -34,37 +59,85 @@ class Chunk:
 # -----
 
 
+async def create(new: NewIndex) -> None:
+    name = new.name
+    dense_backend = new.dense_backend or DENSE_BACKENDS.get(name, DENSE_BACKEND)
+    sparse_backend = new.sparse_backend or SPARSE_BACKENDS.get(name, SPARSE_BACKEND)
+    if dense_backend not in dense.BACKENDS:
+        raise ValueError(f"Unknown dense backend: {dense_backend}")
+    if sparse_backend not in sparse.BACKENDS:
+        raise ValueError(f"Unknown sparse backend: {sparse_backend}")
+    compression.check(new.compression)
+    if new.compression != "none" and sparse_backend == "fts5":
+        raise ValueError("The fts5 sparse backend can't index compressed contents")
+
+    logger.info(
+        f"Creating a new index with name '{name}' ({dense_backend}, {sparse_backend})"
+    )
+
+    # Dense and sparse indexes first, the index only exists once registered
+    task_dense = dense.create(name, embeddings.dim(), dense_backend, new.options)
+    task_sparse = asyncio.to_thread(sparse.create, name, sparse_backend)
+    res_dense, res_sparse = await asyncio.gather(
+        task_dense, task_sparse, return_exceptions=True
+    )
+
+    # Whichever backend did create its index drops it when the other
+    # failed, so that creating the index again can succeed.
+    failed = [res for res in (res_dense, res_sparse) if isinstance(res, BaseException)]
+    if failed:
+        if not isinstance(res_dense, BaseException):
+            await dense.delete(name)
+        if not isinstance(res_sparse, BaseException):
+            await asyncio.to_thread(sparse.delete, name)
+        raise failed[0]
+
+    await database.index_add(
+        name,
+        sparse_backend,
+        dense_backend,
+        encode(new.options).decode(),
+        new.compression,
+    )
+
+
+async def ensure(name: str) -> None:
+    """Creates the index with the default settings, unless it exists."""
+    async with _creating:
+        if await database.index_get(name) is None:
+            await create(NewIndex(name))
+
+
+# Bundles of concurrent requests or jobs may need the same new index
+_creating = asyncio.Lock()
+
+
 async def run(bundle: Bundle) -> Literal["pending", "chunked", "completed"]:
-    status = database.bundle_status_get(bundle.id, bundle.index)
-
-    # Initial database entry
-    if status is None:
-        logger.info(f"Inserting a new bundle with id {bundle.id} in the database")
-        database.bundle_add(bundle.id, bundle.index, bundle.source, bundle.name)
-        status = "pending"
-
-    # Chunking process
-    if status == "pending":
-        chunk_objects = _chunk(bundle)
-        logger.info(f"Inserting {len(chunk_objects)} chunks in the database")
-
-        # TODO: in future, group database calls that are related in transaction
-        database.chunks_add(
-            [
-                (bundle.index, bundle.id, chunk.content, chunk.ref, chunk.chunk_order)
-                for chunk in chunk_objects
-            ]
+    status = await database.bundle_status_get(bundle.id, bundle.index)
+
+    # Chunking process, the bundle is written along with its chunks
+    if status is None or status == "pending":
+        with metrics.stage("ingest", "chunking"):
+            chunk_objects = await asyncio.to_thread(_chunk, bundle)
+        logger.info(
+            f"Inserting bundle {bundle.id} with {len(chunk_objects)} chunks in the database"
         )
 
-        database.bundle_status_set(bundle.id, bundle.index, "chunked")
+        with metrics.stage("ingest", "database"):
+            await database.bundles_chunked(
+                [(bundle.id, bundle.index, bundle.source, bundle.name)],
+                _chunk_rows(bundle, chunk_objects),
+                cb=sparse.chunked,
+            )
         status = "chunked"
 
     # Indexing phase
     if status != "completed":
-        chunk_data = database.chunks_get_by_bundle_id(bundle.index, bundle.id)
+        chunk_data = await database.chunks_get_by_bundle_id(bundle.index, bundle.id)
 
         logger.info(f"Starting indexing phase for {len(chunk_data)} chunks")
-        embs = await embeddings.get_async([chunk["content"] for chunk in chunk_data])
+        with metrics.stage("ingest", "embedding"):
+            embs = await _embed([chunk["content"] for chunk in chunk_data])
 
         data_to_sparse = [
             sparse.Doc(chunk["id"], chunk["content"]) for chunk in chunk_data
@@ -73,9 +146,12 @@ async def run(bundle: Bundle) -> Literal["pending", "chunked", "completed"]:
             dense.Vector(chunk["id"], emb) for chunk, emb in zip(chunk_data, embs)
         ]
         try:
-            await asyncio.to_thread(sparse.doc_add, bundle.index, data_to_sparse)
-            await dense.vec_add(bundle.index, data_to_dense)
+            with metrics.stage("ingest", "sparse"):
+                await asyncio.to_thread(sparse.doc_add, bundle.index, data_to_sparse)
+            with metrics.stage("ingest", "dense"):
+                await dense.vec_add(bundle.index, data_to_dense)
 
+            await database.bundle_status_set(bundle.id, bundle.index, "completed")
             status = "completed"
         except Exception as e:
             logger.exception(f"Indexing failed for bundle {bundle.id}: {e}")
@@ -85,14 +161,246 @@ async def run(bundle: Bundle) -> Literal["pending", "chunked", "completed"]:
             await dense.vec_del(bundle.index, ids)
 
             raise e
+        finally:
+            cache.bump(bundle.index)  # cached results are outdated either way
 
     return status
 
 
+# Bulk
+# ----
+# Bundles of a stream go through the same steps as `run`, in groups and as
+# a pipeline: a group is chunked and written while the previous one is
+# embedded, and the one before it indexed. Each group is written to the
+# database in one transaction and indexed with one sparse and one dense
+# batch per index. Every bundle is reported once, as completed or failed.
+
+
+class Progress(Struct, omit_defaults=True):
+    line: int  # of the bundle in the stream
+    status: Literal["completed", "failed"]
+    id: Optional[str] = None
+    index: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _Group:
+    items: list[tuple[int, Bundle]]  # (line, bundle)
+    chunks: list[dict] = dataclass_field(default_factory=list)
+    embs: Optional[np.ndarray] = None
+
+
+async def run_bulk(
+    bundles: AsyncIterator[tuple[int, Bundle]], report: Callable[[Progress], None]
+) -> None:
+    """Ingests (line, bundle) pairs from the stream, reporting every bundle."""
+    incoming: asyncio.Queue = asyncio.Queue(maxsize=BULK_GROUP_BUNDLES)
+    chunked: asyncio.Queue = asyncio.Queue(maxsize=BULK_PIPELINE_DEPTH)
+    embedded: asyncio.Queue = asyncio.Queue(maxsize=BULK_PIPELINE_DEPTH)
+
+    # A stage ends the next one once done. One failing cancels them all,
+    # waiting to end the next one then could block on a full queue.
+    async def receive():
+        async for item in bundles:
+            await incoming.put(item)
+        await incoming.put(None)
+
+    async def chunk():
+        indexes: set[str] = set()
+        async for group in _groups(incoming):
+            await _bulk_indexes(group, indexes, report)
+            await _bulk_chunk(group, report)
+            await chunked.put(group)
+        await chunked.put(None)
+
+    async def embed():
+        while (group := await chunked.get()) is not None:
+            await _bulk_embed(group, report)
+            await embedded.put(group)
+        await embedded.put(None)
+
+    async def index():
+        while (group := await embedded.get()) is not None:
+            await _bulk_index(group, report)
+
+    # A stage failing (e.g. the client going away) stops the others, the
+    # bundles in flight are resumed from their status when sent again.
+    async with asyncio.TaskGroup() as tg:
+        for stage in (receive, chunk, embed, index):
+            tg.create_task(stage())
+
+
+async def _groups(incoming: asyncio.Queue) -> AsyncIterator[_Group]:
+    # Up to BULK_GROUP_BUNDLES bundles, fewer when the stream slows down. A
+    # bundle sent twice goes to the next group, it would clash with itself.
+    item = await incoming.get()
+    while item is not None:
+        group, keys, idle = _Group([]), set(), False
+        while (
+            item is not None
+            and len(group.items) < BULK_GROUP_BUNDLES
+            and (item[1].id, item[1].index) not in keys
+        ):
+            group.items.append(item)
+            keys.add((item[1].id, item[1].index))
+            try:
+                item = await asyncio.wait_for(incoming.get(), BULK_GROUP_MS / 1000)
+            except TimeoutError:
+                idle = True
+                break
+
+        yield group
+        if idle:
+            item = await incoming.get()
+
+
+async def _bulk_indexes(group: _Group, indexes: set[str], report) -> None:
+    # Indexes are created on their first bundle, like with POST /bundle
+    kept = []
+    for line, bundle in group.items:
+        if bundle.index not in indexes:
+            try:
+                await ensure(bundle.index)
+                indexes.add(bundle.index)
+            except Exception as e:
+                report(_failed(line, bundle, e))
+                continue
+
+        kept.append((line, bundle))
+
+    group.items = kept
+
+
+async def _bulk_chunk(group: _Group, report) -> None:
+    keys = [(bundle.id, bundle.index) for _, bundle in group.items]
+    statuses = await database.bundles_status_get(keys)
+
+    todo, rows, chunk_rows = [], [], []
+    for line, bundle in group.items:
+        status = statuses.get((bundle.id, bundle.index))
+        if status == "completed":
+            report(Progress(line, "completed", bundle.id, bundle.index))
+            continue
+
+        todo.append((line, bundle))
+        if status is not None and status != "pending":
+            continue
+
+        try:
+            with metrics.stage("ingest", "chunking"):
+                chunk_objects = await asyncio.to_thread(_chunk, bundle)
+        except Exception as e:
+            todo.pop()
+            report(_failed(line, bundle, e))
+            continue
+
+        rows.append((bundle.id, bundle.index, bundle.source, bundle.name))
+        chunk_rows.extend(_chunk_rows(bundle, chunk_objects))
+
+    group.items = todo
+    if not todo:
+        return
+
+    try:
+        with metrics.stage("ingest", "database"):
+            if rows:
+                await database.bundles_chunked(rows, chunk_rows, cb=sparse.chunked)
+            keys = [(bundle.id, bundle.index) for _, bundle in todo]
+            group.chunks = await database.chunks_get_by_bundles(keys)
+    except Exception as e:
+        _fail(group, report, e)
+
+
+async def _bulk_embed(group: _Group, report) -> None:
+    if not group.items:
+        return
+
+    try:
+        with metrics.stage("ingest", "embedding"):
+            group.embs = await _embed([chunk["content"] for chunk in group.chunks])
+    except Exception as e:
+        _fail(group, report, e)
+
+
+async def _bulk_index(group: _Group, report) -> None:
+    if not group.items:
+        return
+
+    # One batch per index of the group
+    by_index: dict[str, list[tuple[dict, np.ndarray]]] = {}
+    for chunk, emb in zip(group.chunks, group.embs):
+        by_index.setdefault(chunk["idx"], []).append((chunk, emb))
+
+    for name in {bundle.index for _, bundle in group.items}:
+        items = [(line, b) for line, b in group.items if b.index == name]
+        pairs = by_index.get(name, [])
+        ids = [chunk["id"] for chunk, _ in pairs]
+
+        try:
+            docs = [sparse.Doc(chunk["id"], chunk["content"]) for chunk, _ in pairs]
+            vecs = [dense.Vector(chunk["id"], emb) for chunk, emb in pairs]
+            with metrics.stage("ingest", "sparse"):
+                await asyncio.to_thread(sparse.doc_add, name, docs)
+            with metrics.stage("ingest", "dense"):
+                await dense.vec_add(name, vecs)
+
+            keys = [(bundle.id, bundle.index) for _, bundle in items]
+            await database.bundles_status_set(keys, "completed")
+        except Exception as e:
+            logger.exception(f"Bulk indexing failed for {len(items)} bundles: {e}")
+            await asyncio.to_thread(sparse.doc_del, name, ids)
+            await dense.vec_del(name, ids)
+            _fail(_Group(items), report, e)
+            continue
+        finally:
+            cache.bump(name)  # cached results are outdated either way
+
+        for line, bundle in items:
+            report(Progress(line, "completed", bundle.id, bundle.index))
+
+
+def _fail(group: _Group, report, e: Exception) -> None:
+    for line, bundle in group.items:
+        report(_failed(line, bundle, e))
+    group.items = []
+
+
+def _failed(line: int, bundle: Bundle, e: Exception) -> Progress:
+    return Progress(line, "failed", bundle.id, bundle.index, error=str(e))
+
+
 # Helpers
 # --------
 
 
+async def _embed(texts: list[str]) -> np.ndarray:
+    if not EMBED_CACHE_ENABLED:
+        return await embeddings.get_async(texts, lane="bulk")
+
+    # Only the texts that were never embedded before go to the workers
+    model = embeddings.MODEL
+    cached = await asyncio.to_thread(embcache.get_many, model, texts)
+    missing = [i for i, vec in enumerate(cached) if vec is None]
+    logger.info(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits")
+
+    if missing:
+        texts_missing = [texts[i] for i in missing]
+        fresh = await embeddings.get_async(texts_missing, lane="bulk")
+        await asyncio.to_thread(embcache.put_many, model, texts_missing, fresh)
+        for i, vec in zip(missing, fresh):
+            cached[i] = vec
+
+    return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+
+
+def _chunk_rows(bundle: Bundle, chunk_objects: list[Chunk]) -> list[tuple]:
+    return [
+        (bundle.index, bundle.id, chunk.content, chunk.ref, chunk.chunk_order)
+        for chunk in chunk_objects
+    ]
+
+
 def _chunk(bundle: Bundle) -> list[Chunk]:
     combined = "\n ".join(bundle.blocks)
 
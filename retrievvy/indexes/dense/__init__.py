@@ -0,0 +1,123 @@
+"""
+Dense (vector) indexes, behind one interface with pluggable backends:
+
+- `qdrant`: a Qdrant collection per index.
+- `memmap`: memory-mapped vectors under DIR_DENSE searched in process, for
+  small and mid-sized indexes.
+
+The backend is chosen when the index is created and stored with it in the
+`indexes` table, the functions below dispatch on it.
+"""
+
+from typing import Optional
+
+import numpy as np
+from msgspec.json import decode
+
+from retrievvy import database
+
+from . import memmap, qdrant
+from .base import Hit, IndexOptions, SearchParams, Vector
+
+__all__ = ["Hit", "IndexOptions", "SearchParams", "Vector", "BACKENDS"]
+
+BACKENDS = {"qdrant": qdrant, "memmap": memmap}
+
+# Backend and options of each index, as stored in the database
+_indexes: dict[str, tuple[str, IndexOptions]] = {}
+
+
+# Index Management
+# ----------------
+
+
+async def create(
+    name: str,
+    emb_size: int,
+    backend: str = "qdrant",
+    options: IndexOptions = IndexOptions(),
+) -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown dense backend: {backend}")
+
+    await BACKENDS[backend].create(name, emb_size, options)
+    _indexes[name] = (backend, options)
+
+
+async def delete(name: str) -> None:
+    # The index row may be gone already, the files tell the backend apart
+    backend = memmap if memmap.exists(name) else qdrant
+    await backend.delete(name)
+    _indexes.pop(name, None)
+
+
+# Vectors
+# -------
+
+
+async def vec_add(idx_name: str, vecs: list[Vector]) -> None:
+    backend, _ = await _index(idx_name)
+    await backend.vec_add(idx_name, vecs)
+
+
+async def vec_del(idx_name: str, ids: list[int]) -> None:
+    backend, _ = await _index(idx_name)
+    await backend.vec_del(idx_name, ids)
+
+
+async def vec_list(
+    idx_name: str, offset: int, limit: int
+) -> tuple[list[Vector], Optional[int]]:
+    backend, _ = await _index(idx_name)
+    return await backend.vec_list(idx_name, offset, limit)
+
+
+# Query
+# -----
+
+
+async def query(
+    idx_name: str,
+    vec: np.ndarray | list[float],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[Hit]:
+    # Parameters left unset in the query come from the index options
+    backend, options = await _index(idx_name)
+    params = params.merge(options.search)
+    return await backend.query(idx_name, vec, limit, filter_ids, params, with_vectors)
+
+
+async def query_batch(
+    idx_name: str,
+    vecs: np.ndarray | list[list[float]],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[list[Hit]]:
+    backend, options = await _index(idx_name)
+    params = params.merge(options.search)
+    return await backend.query_batch(
+        idx_name, vecs, limit, filter_ids, params, with_vectors
+    )
+
+
+# Helpers
+# -------
+
+
+async def _index(idx_name: str) -> tuple:
+    cached = _indexes.get(idx_name)
+    if cached is None:
+        index = await database.index_get(idx_name)
+        if index is None:
+            raise LookupError(f"Index '{idx_name}' does not exist")
+
+        options = decode(index["options"], type=IndexOptions)
+        cached = _indexes[idx_name] = (index["dense_backend"], options)
+
+    name, options = cached
+    return BACKENDS[name], options
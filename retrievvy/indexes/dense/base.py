@@ -0,0 +1,55 @@
+from dataclasses import dataclass
+from typing import Annotated, Any, Literal, Optional
+
+import numpy as np
+from msgspec import Meta, Struct
+
+
+# Type definitions
+# ----------------
+
+
+@dataclass
+class Vector:
+    id: int
+    vector: np.ndarray | list[float]
+    payload: Optional[dict[str, Any]] = None
+
+
+@dataclass
+class Hit:
+    id: int
+    vector: Optional[list[float]]  # only when requested with `with_vectors`
+    score: float
+
+
+class SearchParams(Struct, frozen=True, omit_defaults=True):
+    # Unset values fall back to the options of the index, then to Qdrant
+    hnsw_ef: Optional[Annotated[int, Meta(ge=1)]] = None  # candidates explored
+    rescore: Optional[bool] = None  # rescore quantized hits with the originals
+    oversampling: Optional[Annotated[float, Meta(ge=1)]] = None  # per hit wanted
+
+    def merge(self, defaults: "SearchParams") -> "SearchParams":
+        return SearchParams(
+            hnsw_ef=self.hnsw_ef if self.hnsw_ef is not None else defaults.hnsw_ef,
+            rescore=self.rescore if self.rescore is not None else defaults.rescore,
+            oversampling=self.oversampling
+            if self.oversampling is not None
+            else defaults.oversampling,
+        )
+
+
+class IndexOptions(Struct, omit_defaults=True):
+    """
+    Storage and search settings of a dense index, set at creation. The
+    memmap backend searches exactly, so only Qdrant makes use of them.
+    """
+
+    # Storage
+    quantization: Literal["none", "scalar", "binary"] = "none"
+    on_disk: bool = False  # original vectors on disk, quantized ones in RAM
+    hnsw_m: Optional[Annotated[int, Meta(ge=0)]] = None  # 0 disables the graph
+    hnsw_ef_construct: Optional[Annotated[int, Meta(ge=4)]] = None
+
+    # Search defaults
+    search: SearchParams = SearchParams()
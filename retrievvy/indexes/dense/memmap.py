@@ -0,0 +1,428 @@
+"""
+In-process dense backend: exact search over memory-mapped float32 vectors,
+for indexes small enough that a brute force scan beats a round trip to
+Qdrant.
+
+Every index is a directory under DIR_DENSE holding append-only files:
+
+- `vectors.f32`: the vectors, normalized, one row after the other.
+- `ids.i64`: the point id of every row.
+- `dead.u8`: one byte per row, set when the row is deleted or replaced.
+
+Queries are matrix products over blocks of rows, keeping the best rows of
+each block with `argpartition`. Deleted rows are compacted away once they
+make up most of the files.
+
+Compaction writes a new generation of the files (`vectors.<n>.f32`, ...)
+and then switches `meta.json` to it, a single atomic rename. A crash on
+the way leaves the previous generation in use, never a mix of both.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from retrievvy.config import DIR_DENSE, DENSE_MEMMAP_BLOCK
+
+from .base import Hit, IndexOptions, SearchParams, Vector
+
+
+# Type definitions
+# ----------------
+
+
+@dataclass
+class _Store:
+    dim: int
+    ids: np.ndarray  # int64 per row
+    dead: np.ndarray  # bool per row
+    rows: dict[int, int]  # live id -> row
+    vectors: np.ndarray  # memory-mapped (rows, dim)
+    lock: threading.Lock
+    generation: int = 0  # of the files, see `_files`
+    order: Optional[np.ndarray] = None  # live ids sorted, until the next write
+
+
+_stores: dict[str, _Store] = {}
+_stores_lock = threading.Lock()
+
+
+# Index Management
+# ----------------
+
+
+def exists(name: str) -> bool:
+    return (DIR_DENSE / name / "meta.json").exists()
+
+
+async def create(
+    name: str, emb_size: int, options: IndexOptions = IndexOptions()
+) -> None:
+    # Search is exact, the storage and HNSW options don't apply
+    path = DIR_DENSE / name
+    if path.exists():
+        raise FileExistsError(f"Dense index '{name}' already exists at {path}")
+
+    path.mkdir(parents=True)
+    for file in _files(0).values():
+        (path / file).touch()
+    (path / "meta.json").write_text(json.dumps({"dim": emb_size}))
+
+
+async def delete(name: str) -> None:
+    with _stores_lock:
+        _stores.pop(name, None)
+
+    path = DIR_DENSE / name
+    if path.exists():
+        await asyncio.to_thread(shutil.rmtree, path)
+
+
+# Vectors
+# -------
+
+
+async def vec_add(idx_name: str, vecs: list[Vector]) -> None:
+    await asyncio.to_thread(_add, idx_name, vecs)
+
+
+async def vec_del(idx_name: str, ids: list[int]) -> None:
+    await asyncio.to_thread(_delete, idx_name, ids)
+
+
+async def vec_list(
+    idx_name: str, offset: int, limit: int
+) -> tuple[list[Vector], Optional[int]]:
+    return await asyncio.to_thread(_list, idx_name, offset, limit)
+
+
+# Query
+# -----
+
+
+async def query(
+    idx_name: str,
+    vec: np.ndarray | list[float],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[Hit]:
+    return (
+        await query_batch(idx_name, [vec], limit, filter_ids, params, with_vectors)
+    )[0]
+
+
+async def query_batch(
+    idx_name: str,
+    vecs: np.ndarray | list[list[float]],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[list[Hit]]:
+    return await asyncio.to_thread(
+        _search, idx_name, vecs, limit, filter_ids, with_vectors
+    )
+
+
+# Helpers
+# -------
+
+
+def _store(idx_name: str) -> _Store:
+    with _stores_lock:
+        store = _stores.get(idx_name)
+        if store is None:
+            store = _stores[idx_name] = _load(idx_name)
+
+    return store
+
+
+def _load(idx_name: str) -> _Store:
+    path = DIR_DENSE / idx_name
+    if not exists(idx_name):
+        raise FileNotFoundError(f"Dense index '{idx_name}' not found at {path}")
+
+    meta = json.loads((path / "meta.json").read_text())
+    dim, generation = meta["dim"], meta.get("generation", 0)
+    files = _files(generation)
+
+    # Files of other generations were left by a compaction cut short
+    current = set(files.values()) | {"meta.json"}
+    for stale in path.iterdir():
+        if stale.name not in current:
+            stale.unlink()
+
+    ids = np.fromfile(path / files["ids"], dtype=np.int64)
+    dead = np.fromfile(path / files["dead"], dtype=np.uint8).astype(bool)
+
+    # An append cut short leaves the files with a different number of rows
+    size = (path / files["vectors"]).stat().st_size // (4 * dim)
+    n = min(len(ids), len(dead), size)
+    ids, dead = ids[:n], dead[:n]
+
+    rows = {int(id_): row for row, id_ in enumerate(ids) if not dead[row]}
+
+    # An add cut short before its tombstones leaves replaced rows alive, the
+    # last row of an id wins
+    replaced = [row for row, id_ in enumerate(ids) if rows.get(int(id_), row) != row]
+    dead[replaced] = True
+
+    vectors = _map(path, generation, dim, n)
+    store = _Store(dim, ids, dead, rows, vectors, threading.Lock(), generation)
+    if n < max(len(ids), size) or replaced:
+        _rewrite(path, store)
+
+    return store
+
+
+def _files(generation: int) -> dict[str, str]:
+    # Generation 0 keeps the names of indexes created before generations
+    if generation == 0:
+        return {"vectors": "vectors.f32", "ids": "ids.i64", "dead": "dead.u8"}
+
+    return {
+        "vectors": f"vectors.{generation}.f32",
+        "ids": f"ids.{generation}.i64",
+        "dead": f"dead.{generation}.u8",
+    }
+
+
+def _map(path, generation: int, dim: int, n: int) -> np.ndarray:
+    if n == 0:
+        return np.empty((0, dim), dtype=np.float32)
+
+    return np.memmap(
+        path / _files(generation)["vectors"],
+        dtype=np.float32,
+        mode="r",
+        shape=(n, dim),
+    )
+
+
+def _add(idx_name: str, vecs: list[Vector]) -> None:
+    if not vecs:
+        return
+
+    store = _store(idx_name)
+    path = DIR_DENSE / idx_name
+
+    # The last vector of an id wins, within the batch too
+    vecs = list({v.id: v for v in vecs}.values())
+    matrix = np.asarray([np.asarray(v.vector, dtype=np.float32) for v in vecs])
+    if matrix.shape[1] != store.dim:
+        raise ValueError(
+            f"Vectors of size {matrix.shape[1]} in an index of size {store.dim}"
+        )
+    matrix = _normalize(matrix)
+    new_ids = np.asarray([v.id for v in vecs], dtype=np.int64)
+
+    with store.lock:
+        # Points with the same id are replaced, like a Qdrant upsert. Their
+        # rows are only dropped once the new ones are written, a failed
+        # append loses nothing.
+        replaced = [store.rows[id_] for id_ in new_ids.tolist() if id_ in store.rows]
+
+        start = len(store.ids)
+        files = _files(store.generation)
+        _append(
+            path,
+            [
+                (files["vectors"], matrix.tobytes()),
+                (files["ids"], new_ids.tobytes()),
+                (files["dead"], bytes(len(new_ids))),
+            ],
+        )
+
+        store.ids = np.concatenate([store.ids, new_ids])
+        store.dead = np.concatenate([store.dead, np.zeros(len(new_ids), dtype=bool)])
+        store.rows.update({int(id_): start + i for i, id_ in enumerate(new_ids)})
+        store.vectors = _map(path, store.generation, store.dim, len(store.ids))
+        store.order = None
+
+        _tombstone(path, store, replaced)
+
+
+def _append(path, chunks: list[tuple[str, bytes]]) -> None:
+    # All or nothing: files written already are cut back when one fails
+    sizes = {file: (path / file).stat().st_size for file, _ in chunks}
+    try:
+        for file, data in chunks:
+            with open(path / file, "ab") as f:
+                f.write(data)
+    except BaseException:
+        for file, size in sizes.items():
+            os.truncate(path / file, size)
+        raise
+
+
+def _list(idx_name: str, offset: int, limit: int) -> tuple[list[Vector], Optional[int]]:
+    # Pages through the live points by id, like a Qdrant scroll: the offset
+    # is the first id of the page, and the next offset the first id after it.
+    try:
+        store = _store(idx_name)
+    except FileNotFoundError as exc:
+        raise LookupError(str(exc))
+
+    with store.lock:
+        if store.order is None:
+            store.order = np.sort(np.fromiter(store.rows, dtype=np.int64))
+
+        start = int(np.searchsorted(store.order, offset))
+        page = store.order[start : start + limit + 1].tolist()
+        vectors = [
+            Vector(id=id_, vector=store.vectors[store.rows[id_]].tolist())
+            for id_ in page[:limit]
+        ]
+
+    next_offset = page[limit] if len(page) > limit else None
+    return vectors, next_offset
+
+
+def _delete(idx_name: str, ids: list[int]) -> None:
+    store = _store(idx_name)
+    path = DIR_DENSE / idx_name
+
+    with store.lock:
+        _kill(path, store, ids)
+
+        # Mostly tombstones, reclaim the space
+        if len(store.ids) > 1024 and store.dead.sum() > len(store.ids) / 2:
+            _rewrite(path, store)
+
+
+def _kill(path, store: _Store, ids: list[int]) -> None:
+    # Caller holds the lock of the store
+    rows = [store.rows.pop(id_) for id_ in ids if id_ in store.rows]
+    _tombstone(path, store, rows)
+
+
+def _tombstone(path, store: _Store, rows: list[int]) -> None:
+    if not rows:
+        return
+
+    with open(path / _files(store.generation)["dead"], "r+b") as f:
+        for row in sorted(rows):
+            f.seek(row)
+            f.write(b"\x01")
+
+    store.dead[rows] = True
+    store.order = None
+
+
+def _rewrite(path, store: _Store) -> None:
+    # Keeps the live rows only, in the files of the next generation. The old
+    # files are unlinked, searches running on their mapping carry on.
+    live = np.flatnonzero(~store.dead)
+    ids = store.ids[live]
+    vectors = np.ascontiguousarray(store.vectors[live])
+
+    old, generation = _files(store.generation), store.generation + 1
+    files = _files(generation)
+    for kind, data in (
+        ("vectors", vectors.tobytes()),
+        ("ids", ids.tobytes()),
+        ("dead", bytes(len(ids))),
+    ):
+        with open(path / files[kind], "wb") as f:
+            f.write(data)
+            os.fsync(f.fileno())
+
+    # The switch to the new generation
+    tmp = path / "meta.json.tmp"
+    tmp.write_text(json.dumps({"dim": store.dim, "generation": generation}))
+    os.replace(tmp, path / "meta.json")
+
+    for file in old.values():
+        (path / file).unlink(missing_ok=True)
+
+    store.generation = generation
+    store.ids = ids
+    store.dead = np.zeros(len(ids), dtype=bool)
+    store.rows = {int(id_): row for row, id_ in enumerate(ids)}
+    store.vectors = _map(path, generation, store.dim, len(ids))
+    store.order = None
+
+
+def _search(
+    idx_name: str,
+    vecs: np.ndarray | list[list[float]],
+    limit: int,
+    filter_ids: Optional[list[int]],
+    with_vectors: bool,
+) -> list[list[Hit]]:
+    store = _store(idx_name)
+    if limit <= 0:
+        return [[] for _ in vecs]
+
+    queries = _normalize(np.asarray(vecs, dtype=np.float32).reshape(-1, store.dim))
+
+    # Snapshot, appends and compactions after this point don't affect it
+    with store.lock:
+        vectors, ids, dead = store.vectors, store.ids, store.dead
+        candidates = (
+            np.asarray(
+                [store.rows[id_] for id_ in filter_ids if id_ in store.rows],
+                dtype=np.int64,
+            )
+            if filter_ids is not None
+            else None
+        )
+
+    if candidates is not None:
+        blocks = [(candidates, vectors[candidates])]
+    else:
+        blocks = (
+            (np.arange(start, min(start + DENSE_MEMMAP_BLOCK, len(ids))), None)
+            for start in range(0, len(ids), DENSE_MEMMAP_BLOCK)
+        )
+
+    # Best rows and scores so far, per query
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+    for rows, block in blocks:
+        if block is None:
+            block = vectors[rows[0] : rows[-1] + 1]
+
+        scores = queries @ block.T  # (queries, rows)
+        scores[:, dead[rows]] = -np.inf
+
+        rows = np.broadcast_to(rows, scores.shape)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+
+        if best_scores.shape[1] > limit:
+            top = np.argpartition(-best_scores, limit - 1, axis=1)[:, :limit]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+
+    results: list[list[Hit]] = []
+    for q_rows, q_scores in zip(best_rows, best_scores):
+        order = np.argsort(-q_scores)
+        results.append(
+            [
+                Hit(
+                    id=int(ids[row]),
+                    vector=vectors[row].tolist() if with_vectors else None,
+                    score=float(score),
+                )
+                for row, score in zip(q_rows[order], q_scores[order])
+                if score != -np.inf
+            ]
+        )
+
+    return results
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    # Cosine similarity as a dot product, like a Qdrant cosine collection
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
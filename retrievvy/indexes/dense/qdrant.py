@@ -0,0 +1,231 @@
+"""
+Qdrant dense backend: a collection per index.
+"""
+
+import asyncio
+from typing import Optional
+
+import numpy as np
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client import AsyncQdrantClient
+from qdrant_client import models
+from qdrant_client.models import (
+    PointStruct,
+    PointIdsList,
+    VectorParams,
+    Distance,
+    Filter,
+    HasIdCondition,
+    QueryRequest,
+)
+
+from retrievvy.config import (
+    QDRANT_BATCH_SIZE,
+    QDRANT_GRPC,
+    QDRANT_GRPC_PORT,
+    QDRANT_PARALLEL,
+    QDRANT_URL,
+    QDRANT_WAIT,
+)
+
+from .base import Hit, IndexOptions, SearchParams, Vector
+
+# Client
+# ------
+
+if QDRANT_URL == ":memory:":
+    client = AsyncQdrantClient(location=":memory:")
+else:
+    client = AsyncQdrantClient(
+        url=QDRANT_URL,
+        timeout=60,
+        prefer_grpc=QDRANT_GRPC,
+        grpc_port=QDRANT_GRPC_PORT,
+    )
+
+# Interaction funcs ------
+
+# Index Management
+# ----------------
+
+
+async def create(
+    name: str, emb_size: int, options: IndexOptions = IndexOptions()
+) -> None:
+    # Quantized vectors stay in RAM, the originals follow `on_disk`
+    match options.quantization:
+        case "scalar":
+            quantization = models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8, always_ram=True
+                )
+            )
+        case "binary":
+            quantization = models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        case _:
+            quantization = None
+
+    try:
+        await client.create_collection(
+            collection_name=name,
+            vectors_config=VectorParams(
+                size=emb_size, distance=Distance.COSINE, on_disk=options.on_disk
+            ),
+            hnsw_config=models.HnswConfigDiff(
+                m=options.hnsw_m, ef_construct=options.hnsw_ef_construct
+            ),
+            quantization_config=quantization,
+        )
+
+    except UnexpectedResponse as exc:
+        # Settings Qdrant rejects are the caller's to fix
+        if 400 <= exc.status_code < 500:
+            raise ValueError(str(exc))
+        raise
+
+
+async def delete(name: str) -> None:
+    await client.delete_collection(collection_name=name)
+
+
+# Vectors
+# -------
+
+
+async def vec_add(idx_name: str, vecs: list[Vector]) -> None:
+    batches = [
+        vecs[i : i + QDRANT_BATCH_SIZE] for i in range(0, len(vecs), QDRANT_BATCH_SIZE)
+    ]
+    if not batches:
+        return
+
+    semaphore = asyncio.Semaphore(QDRANT_PARALLEL)
+
+    async def upsert(batch: list[Vector], wait: bool) -> None:
+        async with semaphore:
+            await client.upsert(
+                collection_name=idx_name,
+                points=[
+                    PointStruct(
+                        id=vec.id, vector=_floats(vec.vector), payload=vec.payload
+                    )
+                    for vec in batch
+                ],
+                wait=wait,
+            )
+
+    # Qdrant applies the updates of a shard in order, so once the last batch
+    # is applied all the previous ones are too: it's sent alone, waiting,
+    # as a barrier.
+    await asyncio.gather(*(upsert(batch, QDRANT_WAIT) for batch in batches[:-1]))
+    await upsert(batches[-1], True)
+
+
+async def vec_del(idx_name: str, ids: list[int]) -> None:
+    await client.delete(
+        collection_name=idx_name, points_selector=PointIdsList(points=ids)
+    )
+
+
+async def vec_list(
+    idx_name: str, offset: int, limit: int
+) -> tuple[list[Vector], Optional[int]]:
+    try:
+        points, next_offset = await client.scroll(
+            collection_name=idx_name,
+            scroll_filter=None,
+            with_vectors=True,
+            with_payload=False,
+            limit=limit,
+            offset=offset,
+        )
+
+    except UnexpectedResponse as exc:
+        raise LookupError(str(exc))
+
+    return [Vector(id=point.id, vector=point.vector) for point in points], next_offset
+
+
+# Query
+# -----
+
+
+async def query(
+    idx_name: str,
+    vec: np.ndarray | list[float],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[Hit]:
+    point_id_filter = (
+        Filter(must=[HasIdCondition(has_id=filter_ids)]) if filter_ids else None
+    )
+
+    results = await client.query_points(
+        collection_name=idx_name,
+        query=vec,
+        limit=limit,
+        with_vectors=with_vectors,
+        query_filter=point_id_filter,
+        search_params=_search_params(params),
+    )
+
+    return [Hit(id=p.id, vector=p.vector, score=p.score) for p in results.points]
+
+
+async def query_batch(
+    idx_name: str,
+    vecs: np.ndarray | list[list[float]],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    params: SearchParams = SearchParams(),
+    with_vectors: bool = False,
+) -> list[list[Hit]]:
+    # One request to Qdrant for all the query vectors
+    point_id_filter = (
+        Filter(must=[HasIdCondition(has_id=filter_ids)]) if filter_ids else None
+    )
+
+    responses = await client.query_batch_points(
+        collection_name=idx_name,
+        requests=[
+            QueryRequest(
+                query=_floats(vec),
+                limit=limit,
+                with_vector=with_vectors,
+                filter=point_id_filter,
+                params=_search_params(params),
+            )
+            for vec in vecs
+        ],
+    )
+
+    return [
+        [Hit(id=p.id, vector=p.vector, score=p.score) for p in response.points]
+        for response in responses
+    ]
+
+
+# Helpers
+# -------
+
+
+def _floats(vector: np.ndarray | list[float]) -> list[float]:
+    # Python floats are only needed at the edge, for the wire format
+    return vector.tolist() if isinstance(vector, np.ndarray) else vector
+
+
+def _search_params(params: SearchParams) -> Optional[models.SearchParams]:
+    if params == SearchParams():
+        return None
+
+    quantization = None
+    if params.rescore is not None or params.oversampling is not None:
+        quantization = models.QuantizationSearchParams(
+            rescore=params.rescore, oversampling=params.oversampling
+        )
+
+    return models.SearchParams(hnsw_ef=params.hnsw_ef, quantization=quantization)
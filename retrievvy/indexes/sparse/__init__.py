@@ -0,0 +1,129 @@
+"""
+Sparse (keyword) indexes, behind one interface with pluggable backends:
+
+- `xapian`: a Xapian database per index under DIR_SPARSE.
+- `fts5`: an SQLite FTS5 table per index over the `chunks` table, so the
+  chunk text isn't stored twice.
+
+The backend is chosen when the index is created and stored with it in the
+`indexes` table, the functions below dispatch on it. Backends implement
+`base.Backend`, and those kept in the database `base.InDatabase` as well.
+"""
+
+import threading
+from typing import Optional
+
+from retrievvy import database
+
+from . import fts, xap
+from .base import Backend, Doc, Hit, InDatabase, QueryOp
+
+__all__ = ["Doc", "Hit", "QueryOp", "BACKENDS"]
+
+BACKENDS: dict[str, Backend] = {"xapian": xap, "fts5": fts}
+
+# Backend of each index, as stored in the database
+_backends: dict[str, str] = {}
+_backends_lock = threading.Lock()
+
+
+# Index management
+# ----------------
+
+
+def create(name: str, backend: str = "xapian") -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sparse backend: {backend}")
+
+    BACKENDS[backend].create(name)
+    with _backends_lock:
+        _backends[name] = backend
+
+
+def delete(name: str) -> None:
+    # The index row may be gone already, deleting is a no-op for the
+    # backends that don't hold the index.
+    for backend in BACKENDS.values():
+        backend.delete(name)
+
+    with _backends_lock:
+        _backends.pop(name, None)
+
+
+# Document management
+# -------------------
+
+
+def doc_add(idx_name: str, docs: list[Doc], lang: str = "en") -> None:
+    _backend(idx_name).doc_add(idx_name, docs, lang)
+
+
+def chunked(db, keys: list[tuple[str, str]]) -> None:
+    """
+    Indexes the chunks of the bundles (id, index) in the transaction that
+    writes them, for the backends kept in the database. The other backends
+    index them with `doc_add`, which skips what's indexed already.
+    """
+    by_index: dict[str, list[str]] = {}
+    for bundle_id, idx_name in keys:
+        by_index.setdefault(idx_name, []).append(bundle_id)
+
+    for idx_name, bundle_ids in by_index.items():
+        backend = _backend(idx_name, db)
+        if isinstance(backend, InDatabase):
+            backend.bundles_add(db, idx_name, bundle_ids)
+
+
+def doc_del(idx_name: str, ids: list[int]) -> None:
+    _backend(idx_name).doc_del(idx_name, ids)
+
+
+# Query
+# -----
+
+
+def query(
+    idx_name: str,
+    query: str,
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    op: QueryOp = QueryOp.OR,
+    lang: str = "en",
+) -> list[Hit]:
+    return query_batch(idx_name, [query], limit, filter_ids, op, lang)[0]
+
+
+def query_batch(
+    idx_name: str,
+    queries: list[str],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    op: QueryOp = QueryOp.OR,
+    lang: str = "en",
+) -> list[list[Hit]]:
+    backend = _backend(idx_name)
+    return backend.query_batch(idx_name, queries, limit, filter_ids, op, lang)
+
+
+# Helpers
+# -------
+
+
+def _backend(idx_name: str, db=None) -> Backend:
+    name = _backends.get(idx_name)
+    if name is None:
+        # Called from worker threads, hence the read-only connection of the
+        # thread, unless the caller is in a transaction of its own
+        row = (
+            (db or database.connection())
+            .execute("SELECT sparse_backend FROM indexes WHERE name = ?", (idx_name,))
+            .fetchone()
+        )
+        if row is None:
+            raise ValueError(f"Index '{idx_name}' does not exist")
+
+        name = row[0]
+        with _backends_lock:
+            _backends[idx_name] = name
+
+    return BACKENDS[name]
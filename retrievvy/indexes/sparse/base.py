@@ -0,0 +1,62 @@
+import sqlite3
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional, Protocol, runtime_checkable
+
+
+# Type Definitions
+# ----------------
+
+
+@dataclass
+class Doc:
+    id: int
+    content: str
+
+
+@dataclass
+class Hit:
+    id: int
+    score: float  # 0..1, relative to the best match of the query
+
+
+class QueryOp(Enum):
+    OR = "or"
+    AND = "and"
+
+
+# Backends
+# --------
+# A backend is a module with the functions below.
+
+
+class Backend(Protocol):
+    def create(self, name: str) -> None: ...
+
+    def delete(self, name: str) -> None: ...
+
+    def doc_add(self, idx_name: str, docs: list[Doc], lang: str = "en") -> None: ...
+
+    def doc_del(self, idx_name: str, ids: list[int]) -> None: ...
+
+    def query_batch(
+        self,
+        idx_name: str,
+        queries: list[str],
+        limit: int = 10,
+        filter_ids: Optional[list[int]] = None,
+        op: QueryOp = QueryOp.OR,
+        lang: str = "en",
+    ) -> list[list[Hit]]: ...
+
+
+@runtime_checkable
+class InDatabase(Backend, Protocol):
+    """
+    A backend kept in the database, which indexes chunks inside the
+    transaction that writes them.
+    """
+
+    def bundles_add(
+        self, db: sqlite3.Connection, idx_name: str, bundle_ids: list[str]
+    ) -> None: ...
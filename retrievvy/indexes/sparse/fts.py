@@ -0,0 +1,200 @@
+"""
+SQLite FTS5 sparse backend: an external content table per index over the
+`chunks` table, ranked with BM25.
+
+The FTS table only holds the inverted index, the text stays in `chunks`.
+Removing a row from an external content table needs its original text, so
+the ids in the index are kept in a side table, and a trigger takes chunks
+out of the index as they are deleted from `chunks` (e.g. by the cascade of
+a bundle deletion).
+
+Chunks are indexed in the transaction that writes them to `chunks` (see
+`bundles_add`), so a bundle is never chunked without being indexed. Other
+writes go through the database writer, so they are serialized with the
+other writes to the database. They block the calling thread until
+committed, and are called from worker threads.
+
+Tokens are stemmed with the Porter stemmer, so the language of the other
+backend doesn't apply here.
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+from retrievvy import database
+
+from .base import Doc, Hit, QueryOp
+
+TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+
+# Index management
+# ----------------
+
+
+def create(name: str) -> None:
+    fts, indexed, trigger = _tables(name)
+    index = name.replace("'", "''")
+
+    def apply(db):
+        db.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5("
+            f"content, content='chunks', content_rowid='id', tokenize='{TOKENIZER}')"
+        )
+        db.execute(f"CREATE TABLE {indexed} (id INTEGER PRIMARY KEY)")
+        db.execute(f"""
+            CREATE TRIGGER {trigger} AFTER DELETE ON chunks
+            WHEN old.idx = '{index}' AND old.id IN (SELECT id FROM {indexed})
+            BEGIN
+                INSERT INTO {fts} ({fts}, rowid, content) VALUES ('delete', old.id, old.content);
+                DELETE FROM {indexed} WHERE id = old.id;
+            END
+        """)
+
+    database.submit(apply).result()
+
+
+def delete(name: str) -> None:
+    fts, indexed, trigger = _tables(name)
+
+    def apply(db):
+        db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        db.execute(f"DROP TABLE IF EXISTS {fts}")
+        db.execute(f"DROP TABLE IF EXISTS {indexed}")
+
+    database.submit(apply).result()
+
+
+# Document management
+# -------------------
+
+
+def doc_add(idx_name: str, docs: list[Doc], lang: str = "en") -> None:
+    fts, indexed, _ = _tables(idx_name)
+
+    def apply(db):
+        # Documents already in the index are skipped, the chunk text never
+        # changes under the same id.
+        new = [
+            doc
+            for doc in docs
+            if db.execute(
+                f"INSERT OR IGNORE INTO {indexed} (id) VALUES (?)", (doc.id,)
+            ).rowcount
+        ]
+        db.executemany(
+            f"INSERT INTO {fts} (rowid, content) VALUES (?, ?)",
+            [(doc.id, doc.content) for doc in new],
+        )
+
+    database.submit(apply).result()
+
+
+def bundles_add(db, idx_name: str, bundle_ids: list[str]) -> None:
+    # Runs inside the transaction of the caller, on the writer thread
+    fts, indexed, _ = _tables(idx_name)
+    new = db.execute(
+        f"""
+        INSERT OR IGNORE INTO {indexed} (id)
+        SELECT id FROM chunks
+        WHERE idx = ? AND bundle_id IN (SELECT value FROM json_each(?))
+        RETURNING id
+        """,
+        (idx_name, json.dumps(bundle_ids)),
+    ).fetchall()  # to the end, before the next statement
+    db.execute(
+        f"""
+        INSERT INTO {fts} (rowid, content)
+        SELECT id, content FROM chunks WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps([id_ for (id_,) in new]),),
+    )
+
+
+def doc_del(idx_name: str, ids: list[int]) -> None:
+    fts, indexed, _ = _tables(idx_name)
+    args = (json.dumps(ids),)
+
+    # Chunks deleted from the database are out of the index already
+    def apply(db):
+        db.execute(
+            f"""
+            INSERT INTO {fts} ({fts}, rowid, content)
+            SELECT 'delete', c.id, c.content
+            FROM chunks c JOIN {indexed} i ON i.id = c.id
+            WHERE c.id IN (SELECT value FROM json_each(?))
+            """,
+            args,
+        )
+        db.execute(
+            f"DELETE FROM {indexed} WHERE id IN (SELECT value FROM json_each(?))", args
+        )
+
+    database.submit(apply).result()
+
+
+# Query
+# -----
+
+
+def query_batch(
+    idx_name: str,
+    queries: list[str],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    op: QueryOp = QueryOp.OR,
+    lang: str = "en",
+) -> list[list[Hit]]:
+    fts, _, _ = _tables(idx_name)
+
+    sql = f"SELECT rowid, rank FROM {fts} WHERE {fts} MATCH ?"
+    if filter_ids is not None:
+        sql += " AND rowid IN (SELECT value FROM json_each(?))"
+    sql += " ORDER BY rank LIMIT ?"
+
+    db = database.connection()  # read-only, of the calling thread
+    results: list[list[Hit]] = []
+
+    for query in queries:
+        expression = _match(query, op)
+        if not expression:
+            results.append([])
+            continue
+
+        args = [expression]
+        if filter_ids is not None:
+            args.append(json.dumps(filter_ids))
+        args.append(limit)
+
+        rows = db.execute(sql, args).fetchall()
+
+        # BM25 ranks are negative, best first. Scaled to the best match,
+        # like the percentages of Xapian, and 0 when no match ranks at all.
+        best = rows[0][1] if rows else 0.0
+        results.append(
+            [
+                Hit(id=id_, score=max(0.0, rank / best) if best < 0 else 0.0)
+                for id_, rank in rows
+            ]
+        )
+
+    return results
+
+
+# Helpers
+# -------
+
+
+def _tables(name: str) -> tuple[str, str, str]:
+    # Index names are free text, table names are derived from a hash
+    digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+    return f"fts_{digest}", f"fts_{digest}_ids", f"fts_{digest}_delete"
+
+
+def _match(query: str, op: QueryOp) -> str:
+    # Every term quoted as a string, so the query syntax of FTS5 is never
+    # triggered by user input.
+    terms = [t for t in query.split() if any(ch.isalnum() for ch in t)]
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    return f" {op.name} ".join(quoted)
@@ -0,0 +1,427 @@
+"""
+Xapian sparse backend: a database per index under DIR_SPARSE.
+"""
+
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+import xapian
+from loguru import logger
+
+from retrievvy.config import (
+    DIR_SPARSE,
+    SPARSE_COMMIT_DOCS,
+    SPARSE_COMMIT_MS,
+    SPARSE_WRITER_IDLE,
+)
+
+from .base import Doc, Hit, QueryOp
+
+
+# Type Definitions
+# ----------------
+
+
+@dataclass
+class _Reader:
+    db: xapian.Database
+    generation: int
+    epoch: int
+
+
+@dataclass
+class _Job:
+    kind: Literal["add", "del"]
+    items: list  # Doc for "add", ids for "del"
+    lang: str
+    future: Future
+
+
+# Reader handles
+# --------------
+# Every thread keeps its reader handles open, one per index, along with its
+# query parsers. Writes bump the generation of the index, and a handle
+# reopens itself on its next use when its generation is behind. Creating or
+# deleting the index bumps its epoch instead, which replaces the handle.
+
+_generations: dict[str, int] = {}
+_epochs: dict[str, int] = {}
+_counters_lock = threading.Lock()
+_local = threading.local()
+
+
+# Index management
+# ----------------
+
+
+def create(name: str) -> None:
+    path = DIR_SPARSE / name
+    if path.exists():
+        raise FileExistsError(f"Sparse index '{name}' already exists at {path}")
+
+    path.mkdir(parents=True, exist_ok=True)
+    db = xapian.WritableDatabase(str(path), xapian.DB_CREATE_OR_OPEN)
+    db.close()
+    _bump(_epochs, name)
+
+
+def delete(name: str) -> None:
+    path = DIR_SPARSE / name
+    _bump(_epochs, name)
+
+    # Pending writes still land before the writer lets go of the index
+    with _writers_lock:
+        writer = _writers.pop(name, None)
+    if writer is not None:
+        writer.stop()
+
+    if path.exists():
+        shutil.rmtree(path)
+
+
+# Document management
+# -------------------
+
+
+def doc_add(idx_name: str, docs: list[Doc], lang: str = "en") -> None:
+    # Returns once the documents are committed
+    _submit(idx_name, "add", docs, lang).result()
+
+
+def doc_del(idx_name: str, ids: list[int]) -> None:
+    path = DIR_SPARSE / idx_name
+    if not path.exists():
+        raise FileNotFoundError(f"Sparse index '{idx_name}' not found at {path}")
+
+    _submit(idx_name, "del", ids).result()
+
+
+# Writers
+# -------
+# One writer thread per index owns the WritableDatabase, so concurrent
+# ingestion doesn't contend for the Xapian write lock. It applies queued
+# jobs, each in its own transaction, and group commits them: callers are
+# acknowledged after the commit that made their documents durable.
+
+_writers: dict[str, "_Writer"] = {}
+_writers_lock = threading.Lock()
+
+# Attempts at the write lock held by a writer still closing
+OPEN_RETRIES = 50
+OPEN_RETRY_INTERVAL = 0.02
+
+
+class _Writer:
+    def __init__(self, idx_name: str):
+        self.idx_name = idx_name
+        self.jobs: queue.Queue[Optional[_Job]] = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run, name=f"sparse-writer-{idx_name}", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        try:
+            db = self._open()
+        except Exception as exc:
+            self._abort(exc)
+            return
+
+        generators: dict[str, xapian.TermGenerator] = {}
+        batch: list[_Job] = []
+
+        try:
+            while True:
+                try:
+                    job = self.jobs.get(timeout=SPARSE_WRITER_IDLE)
+                except queue.Empty:
+                    if self._retire(db):
+                        return
+                    continue
+
+                if job is None:
+                    return
+
+                batch, stop = self._gather(job)
+                self._write(db, generators, batch)
+                if stop:
+                    return
+        except Exception as exc:
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(exc)
+            # Failed writes must not be committed by closing the database.
+            # It lets go of the write lock before a new writer can take over.
+            _discard(db)
+            db.close()
+            self._abort(exc)
+        finally:
+            db.close()
+
+    def _open(self) -> xapian.WritableDatabase:
+        # The write lock is let go before a writer is unregistered, except by
+        # `delete`, whose writer may still be closing while a new one starts.
+        path = DIR_SPARSE / self.idx_name
+        for _ in range(OPEN_RETRIES):
+            try:
+                return xapian.WritableDatabase(str(path), xapian.DB_CREATE_OR_OPEN)
+            except xapian.DatabaseLockError:
+                time.sleep(OPEN_RETRY_INTERVAL)
+
+        return xapian.WritableDatabase(str(path), xapian.DB_CREATE_OR_OPEN)
+
+    def _gather(self, first: _Job) -> tuple[list[_Job], bool]:
+        # Jobs until the commit thresholds, and whether the writer was stopped
+        batch = [first]
+        docs = len(first.items)
+        deadline = time.monotonic() + SPARSE_COMMIT_MS / 1000
+
+        while docs < SPARSE_COMMIT_DOCS:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if job is None:
+                return batch, True
+
+            batch.append(job)
+            docs += len(job.items)
+
+        return batch, False
+
+    def _write(self, db, generators, batch: list[_Job]) -> None:
+        applied: list[_Job] = []
+        for job in batch:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            # A failing job is rolled back alone
+            db.begin_transaction(False)
+            try:
+                if job.kind == "add":
+                    _apply_add(db, _generator(generators, job.lang), job.items)
+                else:
+                    _apply_del(db, job.items)
+                db.commit_transaction()
+            except Exception as exc:
+                db.cancel_transaction()
+                job.future.set_exception(exc)
+                continue
+
+            applied.append(job)
+
+        if not applied:
+            return
+
+        try:
+            db.commit()
+        except Exception as exc:
+            # Their changes are still pending, the writer gives up so that
+            # a later commit can't make them durable after all
+            for job in applied:
+                job.future.set_exception(exc)
+            raise
+
+        _bump(_generations, self.idx_name)
+        for job in applied:
+            job.future.set_result(None)
+
+    def _abort(self, exc: Exception) -> None:
+        # Unusable writer: fail what is queued, the next write starts afresh
+        with _writers_lock:
+            if _writers.get(self.idx_name) is self:
+                del _writers[self.idx_name]
+
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job.future.set_running_or_notify_cancel():
+                job.future.set_exception(exc)
+
+    def _retire(self, db) -> bool:
+        # Idle, unless a job was queued while deciding. Closed before it's
+        # unregistered, so the next writer finds the write lock free.
+        with _writers_lock:
+            if not self.jobs.empty():
+                return False
+            db.close()
+            if _writers.get(self.idx_name) is self:
+                del _writers[self.idx_name]
+            return True
+
+
+def _submit(idx_name: str, kind: str, items: list, lang: str = "en") -> Future:
+    future: Future = Future()
+    with _writers_lock:
+        writer = _writers.get(idx_name)
+        if writer is None:
+            writer = _writers[idx_name] = _Writer(idx_name)
+        writer.jobs.put(_Job(kind, items, lang, future))
+
+    return future
+
+
+def _discard(db) -> None:
+    # Changes since the last commit. Cancelling a transaction reverts the
+    # database to its last commit, while closing it would commit them.
+    try:
+        db.begin_transaction(False)
+        db.cancel_transaction()
+    except Exception as exc:
+        logger.warning(f"Could not discard uncommitted sparse changes: {exc}")
+
+
+def _apply_add(db, term_generator: xapian.TermGenerator, docs: list[Doc]) -> None:
+    for doc in docs:
+        xap_doc = xapian.Document()
+        xap_doc.set_data(str(doc.id))
+
+        term_generator.set_document(xap_doc)
+        term_generator.index_text(doc.content)
+
+        # Prefix the id to make sure it never conflicts with any terms in the content.
+        xap_doc.add_boolean_term(f"Q{doc.id}")
+        db.replace_document(f"Q{doc.id}", xap_doc)
+
+
+def _apply_del(db, ids: list[int]) -> None:
+    for doc_id in ids:
+        db.delete_document(f"Q{doc_id}")
+
+
+def _generator(generators: dict, lang: str) -> xapian.TermGenerator:
+    term_generator = generators.get(lang)
+    if term_generator is None:
+        term_generator = xapian.TermGenerator()
+        if lang.lower() != "none":
+            term_generator.set_stemmer(xapian.Stem(lang))
+        generators[lang] = term_generator
+
+    return term_generator
+
+
+# Query
+# -----
+
+
+_OPS = {QueryOp.OR: xapian.Query.OP_OR, QueryOp.AND: xapian.Query.OP_AND}
+
+
+def query_batch(
+    idx_name: str,
+    queries: list[str],
+    limit: int = 10,
+    filter_ids: Optional[list[int]] = None,
+    op: QueryOp = QueryOp.OR,
+    lang: str = "en",
+) -> list[list[Hit]]:
+    # All queries share the reader handle and the query parser of the thread
+    try:
+        return _query_batch(_reader(idx_name), queries, limit, filter_ids, op, lang)
+    except xapian.DatabaseModifiedError:
+        # A commit outran the handle (e.g. by another process), catch up once
+        return _query_batch(
+            _reader(idx_name, reopen=True), queries, limit, filter_ids, op, lang
+        )
+
+
+def _query_batch(
+    db: xapian.Database,
+    queries: list[str],
+    limit: int,
+    filter_ids: Optional[list[int]],
+    op: QueryOp,
+    lang: str,
+) -> list[list[Hit]]:
+    qp = _parser(op, lang)
+
+    filter_query = None
+    if filter_ids is not None:
+        filter_queries = [xapian.Query(f"Q{id_}") for id_ in filter_ids]
+        filter_query = xapian.Query(xapian.Query.OP_OR, filter_queries)
+
+    enquire = xapian.Enquire(db)
+    results: list[list[Hit]] = []
+
+    for query in queries:
+        parsed_query = qp.parse_query(query)
+        if filter_query is not None:
+            parsed_query = xapian.Query(
+                xapian.Query.OP_FILTER, parsed_query, filter_query
+            )
+
+        enquire.set_query(parsed_query)
+
+        mset = enquire.get_mset(0, limit)
+        hits: list[Hit] = []
+
+        for match in mset:
+            doc_id = int(match.document.get_data())
+            score = match.percent
+            hits.append(Hit(id=doc_id, score=score / 100))
+
+        results.append(hits)
+
+    return results
+
+
+# Helpers
+# -------
+
+
+def _reader(idx_name: str, reopen: bool = False) -> xapian.Database:
+    readers: dict[str, _Reader] = _local.__dict__.setdefault("readers", {})
+    generation = _generations.get(idx_name, 0)
+    epoch = _epochs.get(idx_name, 0)
+
+    reader = readers.get(idx_name)
+    if reader is not None and reader.epoch != epoch:
+        reader.db.close()
+        reader = None
+
+    if reader is None:
+        # Opening fails here when the index doesn't exist, as before
+        db = xapian.Database(str(DIR_SPARSE / idx_name))
+        reader = readers[idx_name] = _Reader(db, generation, epoch)
+    elif reopen or reader.generation != generation:
+        reader.db.reopen()
+        reader.generation = generation
+
+    return reader.db
+
+
+def _parser(op: QueryOp, lang: str) -> xapian.QueryParser:
+    parsers: dict[tuple, xapian.QueryParser] = _local.__dict__.setdefault("parsers", {})
+
+    qp = parsers.get((op, lang))
+    if qp is None:
+        qp = xapian.QueryParser()
+        qp.set_default_op(_OPS[op])
+
+        # The parser keeps a reference to the stemmer
+        qp.set_stemmer(xapian.Stem(lang))
+        qp.set_stemming_strategy(qp.STEM_SOME)
+        parsers[(op, lang)] = qp
+
+    return qp
+
+
+def _bump(counters: dict[str, int], idx_name: str) -> None:
+    with _counters_lock:
+        counters[idx_name] = counters.get(idx_name, 0) + 1
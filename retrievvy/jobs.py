@@ -0,0 +1,151 @@
+"""
+jobs.py
+
+Background ingestion of the bundles posted to /bundle.
+
+A bundle is stored as a job in the database and acknowledged right away.
+A fixed number of workers, running on the event loop, claim queued jobs
+oldest first and run them through `index.run`, which resumes from the
+status of the bundle (pending, chunked, completed).
+
+A running job is leased to the process running it, which renews the lease
+until the job is over. Jobs whose lease expired, their process stopped or
+crashed, are queued again by the workers of any process sharing the
+database.
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Optional
+
+from loguru import logger
+from msgspec.json import Decoder, encode
+
+from . import database
+from .config import JOBS_KEEP_HOURS, JOBS_LEASE_SECONDS, JOBS_WORKERS
+from .index import Bundle, ensure, run
+
+decoder = Decoder(Bundle)
+
+# Jobs queued by other processes are picked up within this many seconds
+POLL_INTERVAL = 5.0
+
+# Pause of a worker after a failure of its own, e.g. a locked database
+BACKOFF_MAX = 60.0
+
+# Owner of the jobs claimed by this process
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_workers: list[asyncio.Task] = []
+_wake: Optional[asyncio.Event] = None
+_recovered = 0.0  # monotonic time of the last recovery
+
+
+# Lifecycle
+# ---------
+
+
+async def start() -> None:
+    global _wake
+    _wake = asyncio.Event()
+
+    pruned = await database.jobs_prune(JOBS_KEEP_HOURS)
+    if pruned:
+        logger.info(f"Dropped {pruned} finished ingestion jobs")
+    await _recover()
+
+    for i in range(JOBS_WORKERS):
+        _workers.append(asyncio.create_task(_worker(), name=f"job-worker-{i}"))
+
+
+async def stop() -> None:
+    # Running jobs are left as they are, and resumed once their lease expires
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+# Jobs
+# ----
+
+
+async def submit(bundle: Bundle) -> tuple[str, str]:
+    """Queues the bundle, see `database.job_add` for what's returned."""
+    job_id, outcome = await database.job_add(bundle.id, bundle.index, encode(bundle))
+    if _wake is not None:
+        _wake.set()
+
+    return job_id, outcome
+
+
+# Workers
+# -------
+
+
+async def _worker() -> None:
+    failures = 0
+    while True:
+        try:
+            # Cleared before claiming, a job queued meanwhile sets it again
+            _wake.clear()
+            job = await database.job_claim(OWNER)
+            if job is None:
+                try:
+                    await asyncio.wait_for(_wake.wait(), POLL_INTERVAL)
+                except TimeoutError:
+                    await _recover()
+            else:
+                await _run(job)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            backoff = min(POLL_INTERVAL * 2 ** (failures - 1), BACKOFF_MAX)
+            logger.exception(f"Job worker failed, retrying in {backoff:.0f}s: {e}")
+            await asyncio.sleep(backoff)
+
+
+async def _run(job: dict) -> None:
+    lease = asyncio.create_task(_renew(job["id"]))
+    try:
+        try:
+            bundle = decoder.decode(job["payload"])
+            await ensure(bundle.index)
+
+            logger.info(f"Job {job['id']}: ingesting bundle {bundle.id}")
+            await run(bundle)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed: {e}")
+            await database.job_finish(job["id"], OWNER, "failed", error=str(e))
+            return
+
+        await database.job_finish(job["id"], OWNER, "completed")
+    finally:
+        lease.cancel()
+
+
+async def _renew(job_id: str) -> None:
+    while True:
+        await asyncio.sleep(JOBS_LEASE_SECONDS / 3)
+        try:
+            if not await database.job_renew(job_id, OWNER):
+                logger.warning(f"Job {job_id}: lease lost, requeued meanwhile")
+                return
+        except Exception as e:
+            # Tried again on the next round, before the lease runs out
+            logger.warning(f"Job {job_id}: lease renewal failed: {e}")
+
+
+async def _recover() -> None:
+    # Once in a while, all workers share it
+    global _recovered
+    if time.monotonic() - _recovered < JOBS_LEASE_SECONDS / 2:
+        return
+    _recovered = time.monotonic()
+
+    requeued = await database.jobs_recover(JOBS_LEASE_SECONDS)
+    if requeued:
+        logger.info(f"Resuming {requeued} interrupted ingestion jobs")
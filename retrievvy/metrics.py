@@ -0,0 +1,155 @@
+"""
+metrics.py
+
+Latency histograms and gauges in the Prometheus text format, without pulling
+in a client library.
+
+- `stage` times a block of code as a stage of an operation (e.g. the "dense"
+  stage of a "query") and records it in a histogram.
+- `track` starts collecting the stage timings of the current request, so they
+  can be returned in a Server-Timing header. It relies on context variables,
+  which asyncio tasks and `asyncio.to_thread` inherit.
+- `collector` registers a function that produces gauge/counter samples at
+  scrape time, for figures that live elsewhere (queues, caches).
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+# Types
+# -----
+
+Sample = tuple[str, str, dict[str, str], float]  # name, type, labels, value
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> (per bucket counts, sum, count)
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._series.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_labels({**labels, 'le': le})} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+# Registry
+# --------
+
+STAGES = Histogram(
+    "retrievvy_stage_seconds", "Duration of the stages of queries and ingestion."
+)
+ROUTES = Histogram("retrievvy_http_request_seconds", "Duration of HTTP requests.")
+
+_histograms = [STAGES, ROUTES]
+_collectors: list[Callable[[], Iterable[Sample]]] = []
+
+# Stage timings of the request being served, if they are tracked
+_timings: ContextVar[dict[str, float] | None] = ContextVar("timings", default=None)
+
+
+def collector(fn: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+    _collectors.append(fn)
+    return fn
+
+
+# Timing
+# ------
+
+
+@contextmanager
+def stage(op: str, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGES.observe(elapsed, op=op, stage=name)
+
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def track() -> dict[str, float]:
+    timings: dict[str, float] = {}
+    _timings.set(timings)
+    return timings
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={secs * 1000:.2f}" for name, secs in timings.items())
+
+
+# Exposition
+# ----------
+
+
+def render() -> str:
+    lines: list[str] = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+
+    described = set()
+    for fn in _collectors:
+        for name, type_, labels, value in fn():
+            if name not in described:
+                lines.append(f"# TYPE {name} {type_}")
+                described.add(name)
+            lines.append(f"{name}{_labels(labels)} {float(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
@@ -0,0 +1,165 @@
+"""
+embcache.py
+
+Persistent, content-addressed cache of embeddings. Re-posting a bundle after
+a failure, rebuilding an index or ingesting documents that share boilerplate
+text would otherwise embed the same chunks again.
+
+Vectors are stored as float32 blobs in a SQLite side database, keyed by the
+sha256 of the model name and the text. Every hit refreshes the entry, and the
+least recently used entries are evicted when the cache grows over its limit.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from retrievvy.config import EMBED_CACHE, EMBED_CACHE_MAX_ITEMS
+
+# Init
+# -----
+
+db = sqlite3.connect(EMBED_CACHE, check_same_thread=False)
+db.executescript("""
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+""")
+
+# Lookups run in worker threads, one at a time on the shared connection
+_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key             BLOB PRIMARY KEY,
+    vec             BLOB NOT NULL,
+    used            INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS ix_embeddings_used ON embeddings(used);
+"""
+
+# Keys per statement, well below the SQLite variable limit
+_CHUNK = 500
+
+# Eviction removes a bit more than the excess, so it doesn't run on every put
+_EVICT_SLACK = 0.1
+
+_stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+# Entries in the cache, counted once and kept up to date by puts and evictions
+_items = 0
+
+
+def init():
+    global _items
+
+    # Schema initialize
+    with _lock, db:
+        db.executescript(SCHEMA)
+        (_items,) = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+
+# Main
+# ----
+
+
+def get_many(model: str, texts: list[str]) -> list[np.ndarray | None]:
+    """
+    Cached vectors of the texts, in the same order, None where missing.
+    """
+    keys = [_key(model, text) for text in texts]
+    found: dict[bytes, np.ndarray] = {}
+
+    with _lock, db:
+        for i in range(0, len(keys), _CHUNK):
+            chunk = keys[i : i + _CHUNK]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = db.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            found.update(
+                (key, np.frombuffer(vec, dtype=np.float32)) for key, vec in rows
+            )
+
+        if found:
+            now = time.time_ns()
+            db.executemany(
+                "UPDATE embeddings SET used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+
+    # Per text, a text repeated in the batch counts every time
+    vectors = [found.get(key) for key in keys]
+    misses = sum(1 for vec in vectors if vec is None)
+    _stats["hits"] += len(vectors) - misses
+    _stats["misses"] += misses
+    return vectors
+
+
+def put_many(model: str, texts: list[str], vectors: np.ndarray) -> None:
+    global _items
+
+    now = time.time_ns()
+    rows = [
+        (_key(model, text), np.asarray(vec, dtype=np.float32).tobytes(), now)
+        for text, vec in zip(texts, vectors)
+    ]
+
+    with _lock, db:
+        # New keys first, their number keeps the count of items
+        inserted = db.executemany(
+            """
+            INSERT INTO embeddings (key, vec, used) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO NOTHING
+            """,
+            rows,
+        ).rowcount
+        if inserted < len(rows):
+            db.executemany(
+                "UPDATE embeddings SET vec = ?, used = ? WHERE key = ?",
+                [(vec, used, key) for key, vec, used in rows],
+            )
+        _items += inserted
+        _evict()
+
+
+def stats() -> dict:
+    # From memory, scrapes don't wait for a put holding the lock
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        "items": _items,
+        "max_items": EMBED_CACHE_MAX_ITEMS,
+    }
+
+
+# Helpers
+# -------
+
+
+def _key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{text}".encode()).digest()
+
+
+def _evict() -> None:
+    # Runs inside the transaction of the caller
+    global _items
+    if _items <= EMBED_CACHE_MAX_ITEMS:
+        return
+
+    excess = _items - EMBED_CACHE_MAX_ITEMS + int(EMBED_CACHE_MAX_ITEMS * _EVICT_SLACK)
+    evicted = db.execute(
+        """
+        DELETE FROM embeddings WHERE key IN (
+            SELECT key FROM embeddings ORDER BY used ASC LIMIT ?
+        )
+        """,
+        (excess,),
+    ).rowcount
+    _items -= evicted
+    _stats["evicted"] += evicted
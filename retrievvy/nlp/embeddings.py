@@ -2,53 +2,337 @@
 embeddings.py
 
 This module handles generating text embeddings using a heavy model (SentenceTransformer)
-in a separate process. We do this to avoid blocking the main event loop, which is crucial
+in separate processes. We do this to avoid blocking the main event loop, which is crucial
 when running an asynchronous web server.
 
 Key Points:
-- The heavy embedding model is loaded once in a worker process.
-- Communication between the main process and the worker is handled via multiprocessing queues.
-- The asynchronous helper function (get_async) uses asyncio’s run_in_executor to offload the
-  blocking queue.get() call, ensuring non-blocking behavior in the main event loop.
-- This setup allows multiple modules to use the same worker without spawning multiple processes.
-- A start function is provided to initialize the worker and a shutdown function to cleanly
-  terminate the worker process when the application stops.
-
-By isolating the resource-intensive model in a separate process, we maintain responsiveness
+- The heavy embedding model is loaded once in each worker process of a small pool.
+  The pool size, the ONNX threads of every worker and optional CPU pinning are
+  configurable.
+- Communication between the main process and the workers is handled via multiprocessing
+  queues, one input queue per worker and a shared output queue.
+- Every request is tagged with an id and the worker echoes that id back with the result,
+  so concurrent callers can never receive each other's vectors.
+- A single reader thread in the main process drains the output queue and hands each
+  result to the asyncio future of the request that asked for it. Callers simply await
+  their future, no executor thread is parked on a blocking queue.get() per request.
+- Requests travel in one of two lanes. The "query" lane is for interactive searches,
+  the "bulk" lane for chunk embeddings during ingestion. Bulk requests are split into
+  small slices, can only use a subset of the workers (when there is more than one), and
+  a worker always serves queued queries before its next bulk slice. A search therefore
+  never waits behind a large bundle.
+- Requests are dispatched to the least loaded worker (outstanding sentences).
+- Vectors come back as contiguous float32 matrices. Large ones are passed through
+  shared memory, small ones as raw bytes, so no list of Python floats is ever pickled.
+- Each worker combines requests that arrive close together (within a short window, up to
+  a maximum batch size) into a single model call and splits the results back out, so the
+  cost of ONNX batching is spread across concurrent users.
+- A start function is provided to initialize the workers and a shutdown function to
+  cleanly terminate them when the application stops.
+
+By isolating the resource-intensive model in separate processes, we maintain responsiveness
 and ensure that our web server can handle other I/O tasks concurrently.
 """
 
 import asyncio
+import itertools
 import multiprocessing as mp
+import os
+import queue
+import threading
+import time
 
-from typing import Optional
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Literal, Optional
 
+import numpy as np
 from fastembed import TextEmbedding
 
 from tenacity import retry, stop_after_attempt, wait_fixed
 from loguru import logger
 
+from retrievvy.config import (
+    EMBED_BATCH_WINDOW_MS,
+    EMBED_BATCH_MAX,
+    EMBED_WORKERS,
+    EMBED_THREADS,
+    EMBED_PIN_CPUS,
+    EMBED_BULK_WORKERS,
+    EMBED_BULK_SLICE,
+    EMBED_SHM_MIN_BYTES,
+)
+
+# Constants
+# ---------
+
+MODEL = "BAAI/bge-small-en-v1.5"
+
+
+def dim() -> int:
+    # Size of the vectors of MODEL, as described by fastembed
+    for description in TextEmbedding.list_supported_models():
+        if description["model"] == MODEL:
+            return description["dim"]
+
+    raise LookupError(f"Unknown embedding model: {MODEL}")
+
+
+# Types
+# -----
+
+Lane = Literal["query", "bulk"]
+LANES: tuple[Lane, ...] = ("query", "bulk")  # in order of priority
+
+
+@dataclass
+class _Worker:
+    process: mp.Process
+    inq: mp.Queue
+    load: int = 0  # sentences sent and not answered yet
+    requests: int = 0
+    batches: int = 0
+    sentences: int = 0
+    busy: float = 0.0  # seconds spent inside the model
+    started: float = field(default_factory=time.monotonic)
 
-# Global variables for inter-process communication and process handle
-_embedding_input_queue: Optional[mp.Queue] = None
+
+# Global variables for inter-process communication and process handles
+_workers: list[_Worker] = []
 _embedding_output_queue: Optional[mp.Queue] = None
-_embedding_process: Optional[mp.Process] = None
+_embedding_reader: Optional[threading.Thread] = None
+
+# In-flight requests: request id -> (loop of the caller, future to resolve, worker, size)
+_pending: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Future, _Worker, int]] = {}
+_request_ids = itertools.count()
+
+# Counters for tuning the batching window. The deques keep only
+# the most recent observations to compute percentiles on.
+_STATS_WINDOW = 1024
+_batch_sentences: deque[int] = deque(maxlen=_STATS_WINDOW)
+_latencies: dict[Lane, deque[float]] = {
+    lane: deque(maxlen=_STATS_WINDOW) for lane in LANES
+}
 
 
 # Worker (Separate Process)
 # -------------------------
-def worker(inq: mp.Queue, outq: mp.Queue):
-    model = TextEmbedding("BAAI/bge-small-en-v1.5")  # Load the model once
+def worker(
+    number: int,
+    inq: mp.Queue,
+    outq: mp.Queue,
+    window: float,
+    max_batch: int,
+    threads: Optional[int],
+    cpus: Optional[set[int]],
+):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+    # Load the model once
+    model = TextEmbedding(MODEL, threads=threads)
+
+    lanes: dict[Lane, deque] = {lane: deque() for lane in LANES}
+    stop = False
+
+    while not stop:
+        if not any(lanes.values()):
+            # Wait for input
+            message = inq.get()
+            if message is None:
+                break  # Termination signal
+
+            lanes[message[1]].append(message)
+
+        stop = _collect(inq, lanes, window, max_batch)
+        batch = _take(lanes, max_batch)
+        outq.put(_embed(model, number, batch))
+
+    outq.put(None)  # Let the reader know that this worker is done
+
+
+def _collect(inq: mp.Queue, lanes: dict[Lane, deque], window: float, max_batch: int):
+    """
+    Micro-batching: wait up to `window` seconds for more interactive requests
+    while there are fewer than `max_batch` queued sentences, then take everything
+    else that is already in the queue, so the next batch is picked by priority.
+    Returns True when the termination signal was received.
+    """
+    deadline = time.monotonic() + window
+    queued = sum(len(message[2]) for message in lanes["query"])
 
     while True:
-        # Wait for input
-        sentences = inq.get()
-        if sentences is None:
-            break  # Termination signal
+        timeout = deadline - time.monotonic()
+        try:
+            if timeout > 0 and queued < max_batch:
+                message = inq.get(timeout=timeout)
+            else:
+                message = inq.get_nowait()
+        except queue.Empty:
+            return False
+
+        if message is None:
+            return True
+
+        lanes[message[1]].append(message)
+        if message[1] == "query":
+            queued += len(message[2])
+
+
+def _take(lanes: dict[Lane, deque], max_batch: int):
+    # Highest priority lane with work wins, bulk is never mixed with queries
+    for lane in LANES:
+        pending = lanes[lane]
+        if not pending:
+            continue
+
+        batch = [pending.popleft()]
+        size = len(batch[0][2])
+        while pending and size + len(pending[0][2]) <= max_batch:
+            size += len(pending[0][2])
+            batch.append(pending.popleft())
+
+        return batch
+
+    return []
+
+
+def _embed(model: TextEmbedding, number: int, batch: list[tuple[int, Lane, list[str]]]):
+    sentences = [
+        sentence for _, _, request_sentences in batch for sentence in request_sentences
+    ]
+    started = time.monotonic()
+    payload = None
+
+    try:
+        vectors = list(model.embed(sentences, batch_size=32))
+        payload = _pack(vectors)
+    except Exception as exc:
+        # Exceptions are not always picklable, send back only the message
+        error = f"{type(exc).__name__}: {exc}"
+        results = [(request_id, None, error) for request_id, _, _ in batch]
+    else:
+        # Every request gets its range of rows in the batch matrix
+        results = []
+        offset = 0
+        for request_id, _, request_sentences in batch:
+            end = offset + len(request_sentences)
+            results.append((request_id, (offset, end), None))
+            offset = end
+
+    meta = (number, len(batch), len(sentences), time.monotonic() - started)
+    return meta, payload, results
+
+
+def _pack(vectors: list[np.ndarray]):
+    """
+    Lay the vectors out as one contiguous float32 matrix. Large matrices are
+    placed in shared memory and only the segment name crosses the queue, small
+    ones travel as raw bytes. Never as lists of Python floats.
+    """
+    shape = (len(vectors), len(vectors[0]) if vectors else 0)
+    nbytes = shape[0] * shape[1] * 4
+
+    if nbytes < EMBED_SHM_MIN_BYTES:
+        matrix = np.stack(vectors).astype(np.float32, copy=False) if vectors else None
+        return "bytes", matrix.tobytes() if matrix is not None else b"", shape
+
+    # The reader unlinks the segment once it has the data, so
+    # there is no need for the resource tracker to watch it.
+    shm = shared_memory.SharedMemory(create=True, size=nbytes, track=False)
+    try:
+        np.stack(vectors, out=np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+    except BaseException:
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
 
-        embedding_list = [emb.tolist() for emb in model.embed(sentences, batch_size=32)]
+    return "shm", shm.name, shape
 
-        outq.put(embedding_list)
+
+def _unpack(payload) -> np.ndarray:
+    kind, data, shape = payload
+    if kind == "bytes":
+        return np.frombuffer(data, dtype=np.float32).reshape(shape)
+
+    shm = shared_memory.SharedMemory(name=data, track=False)
+    try:
+        return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# Reader (Main Process)
+# ---------------------
+
+
+def _reader(outq: mp.Queue, workers: int):
+    while workers:
+        message = outq.get()
+        if message is None:
+            workers -= 1
+            continue
+
+        meta, payload, results = message
+        _record_batch(*meta)
+
+        # A batch that can't be read back (e.g. its shared memory is gone)
+        # fails its own requests only, the reader keeps serving the others.
+        failure = None
+        try:
+            matrix = _unpack(payload) if payload is not None else None
+        except Exception as exc:
+            logger.exception(f"Could not read back a batch of embeddings: {exc}")
+            matrix, failure = None, f"Embeddings could not be read back: {exc}"
+
+        for request_id, rows, error in results:
+            waiter = _pending.pop(request_id, None)
+            if waiter is None:
+                continue  # The caller has given up on this request
+
+            loop, future, w, size = waiter
+            error = error or failure
+            embs = matrix[rows[0] : rows[1]] if error is None else None
+            loop.call_soon_threadsafe(_resolve, future, w, size, embs, error)
+
+    # Nobody is going to answer the requests that are still waiting
+    for request_id in list(_pending):
+        waiter = _pending.pop(request_id, None)
+        if waiter is not None:
+            loop, future, w, size = waiter
+            loop.call_soon_threadsafe(
+                _resolve, future, w, size, None, "Embedding workers have stopped"
+            )
+
+
+def _record_batch(number: int, requests: int, sentences: int, busy: float):
+    w = _workers[number]
+    w.requests += requests
+    w.batches += 1
+    w.sentences += sentences
+    w.busy += busy
+    _batch_sentences.append(sentences)
+
+
+def _resolve(
+    future: asyncio.Future,
+    w: _Worker,
+    size: int,
+    embs: Optional[np.ndarray],
+    error: Optional[str],
+):
+    w.load -= size  # on the event loop, like the increment
+
+    if future.done():
+        return  # e.g. cancelled by the caller
+
+    if error is not None:
+        future.set_exception(RuntimeError(error))
+    else:
+        future.set_result(embs)
 
 
 # Get embedding functions
@@ -56,43 +340,176 @@ def worker(inq: mp.Queue, outq: mp.Queue):
 
 
 @retry(wait=wait_fixed(1), stop=stop_after_attempt(3), reraise=True)
-async def get_async(sentences: list[str]) -> list[list[float]]:
+async def get_async(sentences: list[str], lane: Lane = "query") -> np.ndarray:
     """
-    Asynchronously get the embedding using asyncio and run_in_executor.
+    Asynchronously get the embeddings of the sentences, in the same order,
+    as the rows of a float32 matrix.
+    Use the "bulk" lane for ingestion so interactive queries are served first.
     """
-    if _embedding_input_queue is None or _embedding_output_queue is None:
+    if not _workers or _embedding_output_queue is None:
         raise RuntimeError("Worker not started. Call start_worker() first.")
+
+    started = time.monotonic()
+
+    if lane == "bulk" and len(sentences) > EMBED_BULK_SLICE:
+        parts = await asyncio.gather(
+            *(
+                _request(sentences[i : i + EMBED_BULK_SLICE], lane)
+                for i in range(0, len(sentences), EMBED_BULK_SLICE)
+            )
+        )
+        embeddings = np.concatenate(parts)
+    else:
+        embeddings = await _request(sentences, lane)
+
+    _latencies[lane].append(time.monotonic() - started)
+    return embeddings
+
+
+async def _request(sentences: list[str], lane: Lane) -> np.ndarray:
     loop = asyncio.get_running_loop()
-    _embedding_input_queue.put(sentences)
-    embedding = await loop.run_in_executor(None, _embedding_output_queue.get)
-    return embedding
+    future = loop.create_future()
+    request_id = next(_request_ids)
+    w = _dispatch(lane)
+    size = len(sentences)
+
+    w.load += size
+    _pending[request_id] = (loop, future, w, size)
+    try:
+        w.inq.put((request_id, lane, sentences))
+        return await future
+    finally:
+        if _pending.pop(request_id, None) is not None:
+            w.load -= size  # Not answered, e.g. the caller was cancelled
+
+
+def _dispatch(lane: Lane) -> _Worker:
+    # With more than one worker, bulk work stays off the first ones,
+    # so there is always a worker free for interactive queries.
+    if lane == "query":
+        candidates = _workers
+    else:
+        candidates = _workers[len(_workers) - EMBED_BULK_WORKERS :]
+    return min(candidates, key=lambda w: w.load)
+
+
+# Stats
+# -----
+
+
+def stats() -> dict:
+    """
+    Queue depth, batching figures and utilisation of the embedding workers, so the
+    batching window and the pool can be tuned for tail latency against throughput.
+    """
+    now = time.monotonic()
+    workers = [
+        {
+            "pid": w.process.pid,
+            "alive": w.process.is_alive(),
+            "load": w.load,
+            "requests": w.requests,
+            "batches": w.batches,
+            "sentences": w.sentences,
+            "busy_seconds": w.busy,
+            "utilisation": w.busy / (now - w.started) if now > w.started else 0.0,
+        }
+        for w in _workers
+    ]
+
+    requests = sum(w.requests for w in _workers)
+    batches = sum(w.batches for w in _workers)
+    sentences = sum(w.sentences for w in _workers)
+    return {
+        "pending": len(_pending),
+        "window_ms": EMBED_BATCH_WINDOW_MS,
+        "max_batch": EMBED_BATCH_MAX,
+        "requests": requests,
+        "batches": batches,
+        "sentences": sentences,
+        "batch_requests_avg": requests / batches if batches else 0.0,
+        "batch_sentences_avg": sentences / batches if batches else 0.0,
+        "batch_sentences_p50": _percentile(_batch_sentences, 0.5),
+        "batch_sentences_max": max(_batch_sentences, default=0),
+        "latency_ms": {
+            lane: {
+                "p50": _percentile(_latencies[lane], 0.5) * 1000,
+                "p99": _percentile(_latencies[lane], 0.99) * 1000,
+            }
+            for lane in LANES
+        },
+        "workers": workers,
+    }
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    return float(ordered[min(len(ordered) - 1, int(q * len(ordered)))])
 
 
 # Start Worker Function
 # ----------------------
 def start_worker():
     """
-    Initializes the embedding worker by creating the inter-process communication queues
-    and starting the worker process. Call this function in your server's main block.
+    Initializes the embedding workers by creating the inter-process communication queues,
+    starting the worker processes and the reader thread that dispatches their results.
+    Call this function in your server's main block.
     """
-    global _embedding_input_queue, _embedding_output_queue, _embedding_process
-    _embedding_input_queue = mp.Queue()
+    global _embedding_output_queue, _embedding_reader
     _embedding_output_queue = mp.Queue()
-    logger.info("Spawning a new process for embeddings")
-    _embedding_process = mp.Process(
-        target=worker, args=(_embedding_input_queue, _embedding_output_queue)
+
+    logger.info(f"Spawning {EMBED_WORKERS} process(es) for embeddings")
+    for number in range(EMBED_WORKERS):
+        inq = mp.Queue()
+        process = mp.Process(
+            target=worker,
+            args=(
+                number,
+                inq,
+                _embedding_output_queue,
+                EMBED_BATCH_WINDOW_MS / 1000,
+                EMBED_BATCH_MAX,
+                EMBED_THREADS or None,
+                _cpus(number) if EMBED_PIN_CPUS else None,
+            ),
+        )
+        process.daemon = True
+        process.start()
+        _workers.append(_Worker(process=process, inq=inq))
+
+    _embedding_reader = threading.Thread(
+        target=_reader,
+        args=(_embedding_output_queue, len(_workers)),
+        name="embeddings-reader",
+        daemon=True,
     )
-    _embedding_process.daemon = True
-    _embedding_process.start()
+    _embedding_reader.start()
+
+
+def _cpus(number: int) -> set[int]:
+    # Give every worker its own slice of the CPUs this process may run on
+    available = sorted(os.sched_getaffinity(0))
+    per_worker = EMBED_THREADS or max(1, len(available) // EMBED_WORKERS)
+    start = number * per_worker
+    return {available[(start + i) % len(available)] for i in range(per_worker)}
 
 
 # Shutdown
 # --------
 def shutdown_worker():
     """
-    Sends a termination signal and joins the worker process.
+    Sends a termination signal and joins the worker processes and the reader thread.
     """
-    if _embedding_input_queue is None or _embedding_process is None:
+    if not _workers:
         raise RuntimeError("Worker not started or already shut down.")
-    _embedding_input_queue.put(None)
-    _embedding_process.join()
+
+    for w in _workers:
+        w.inq.put(None)
+    for w in _workers:
+        w.process.join()
+
+    if _embedding_reader is not None:
+        _embedding_reader.join(timeout=5)
@@ -1,28 +1,39 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from starlette.applications import Starlette
 from starlette.routing import Route
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
-from retrievvy import config
-from . import middleware, hits, bundles, indexes, vectors
+from retrievvy import config, jobs as job_workers
+from . import middleware, hits, bundles, indexes, jobs, vectors, monitor
 
 routes = [
     Route("/query", hits.get, methods=["GET"]),
+    Route("/query/batch", hits.batch, methods=["POST"]),
     # Bundles
     Route("/bundle", bundles.get, methods=["GET"]),
     Route("/bundle", bundles.post, methods=["POST"]),
     Route("/bundle", bundles.delete, methods=["DELETE"]),
     Route("/bundles", bundles.list, methods=["GET"]),
+    Route("/bundles:bulk", bundles.bulk, methods=["POST"]),
+    # Jobs
+    Route("/jobs/{id}", jobs.get, methods=["GET"]),
     # Indexes
     Route("/index", indexes.get, methods=["GET"]),
+    Route("/index", indexes.post, methods=["POST"]),
     Route("/index", indexes.delete, methods=["DELETE"]),
     Route("/indexes", indexes.list, methods=["GET"]),
     # Vectors
     Route("/vectors", vectors.list, methods=["GET"]),
+    # Monitoring
+    Route("/stats", monitor.stats, methods=["GET"]),
+    Route("/metrics", monitor.prometheus, methods=["GET"]),
 ]
 
 middleware = [
+    Middleware(middleware.MetricsMiddleware),
     Middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -33,7 +44,19 @@ middleware = [
 ]
 
 
-app = Starlette(debug=config.DEBUG, routes=routes, middleware=middleware)
+@asynccontextmanager
+async def lifespan(app):
+    # Ingestion workers live as long as the server
+    await job_workers.start()
+    try:
+        yield
+    finally:
+        await job_workers.stop()
+
+
+app = Starlette(
+    debug=config.DEBUG, routes=routes, middleware=middleware, lifespan=lifespan
+)
 
 
 def run(host=config.WEB_HOST, port=config.WEB_PORT):
@@ -1,27 +1,35 @@
 import asyncio
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
-from msgspec import Struct, Meta, ValidationError, convert
+from msgspec import DecodeError, Struct, Meta, ValidationError, convert
 from msgspec.json import Decoder, encode
 
-from loguru import logger
-
-from retrievvy.index import Bundle, run
+from retrievvy.config import JOBS_QUEUE_MAX
+from retrievvy.index import Bundle, Progress, run_bulk
 from retrievvy.indexes import dense, sparse
-from retrievvy import database
+from retrievvy import cache, database, jobs
 
 # Decoder
 # -------
 decoder = Decoder(Bundle)
 
+# Seconds a refused client is asked to wait
+RETRY_AFTER = 10
+
 
 # Handlers
 # --------
 
 # Index a new bundle -----
+#
+# The bundle is queued as a job and ingested in the background, its
+# progress is at GET /jobs/{id}. Bundles are refused while too many jobs
+# are queued. A bundle with a job already gets the same job back: a queued
+# one takes the new content, a running one keeps the content it started
+# with, which `detail` tells.
 
 
 async def post(request: Request):
@@ -32,19 +40,52 @@ async def post(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
-    if database.index_get(bundle_obj.index) is None:
-        logger.info(f"Creating a new index with name '{bundle_obj.index}'")
-        task_dense = dense.create(bundle_obj.index, 384)
-        task_sparse = asyncio.to_thread(sparse.create, bundle_obj.index)
-        await asyncio.gather(task_dense, task_sparse)
-        database.index_add(bundle_obj.index)
-
-    status = await run(bundle_obj)
-    result = {"status": status}
-    return Response(encode(result), status_code=201, media_type="application/json")
-
+    if await database.jobs_queued() >= JOBS_QUEUE_MAX:
+        content = encode({"detail": "Too many bundles queued, retry later"})
+        return Response(
+            content,
+            status_code=429,
+            media_type="application/json",
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
 
-# List bundles -----
+    job_id, outcome = await jobs.submit(bundle_obj)
+    result = {
+        "job": job_id,
+        "state": "running" if outcome == "running" else "queued",
+        "existing": outcome != "queued",
+    }
+    if outcome == "replaced":
+        result["detail"] = "Bundle queued already, its job takes this content"
+    elif outcome == "running":
+        result["detail"] = "Bundle being ingested already, this content is not used"
+    return Response(
+        encode(result),
+        status_code=202,
+        media_type="application/json",
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+# Index a stream of bundles -----
+#
+# NDJSON, one bundle per line, decoded as the body comes in. Progress is
+# streamed back as NDJSON: a line per bundle once completed or failed, in
+# that order and with the line of the bundle in the request, then a line
+# with the totals.
+
+
+async def bulk(request: Request):
+    progress: asyncio.Queue = asyncio.Queue()  # unbounded, see _Streaming
+
+    async def ingest():
+        try:
+            await run_bulk(_bundles(request, progress.put_nowait), progress.put_nowait)
+        finally:
+            progress.put_nowait(None)
+
+    task = asyncio.create_task(ingest())
+    return _Streaming(_progress(task, progress), media_type="application/x-ndjson")
 
 
 class List(Struct):
@@ -60,7 +101,7 @@ async def list(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
-    bundles = database.bundle_list(params.index, params.page, params.items)
+    bundles = await database.bundle_list(params.index, params.page, params.items)
 
     return Response(encode(bundles), status_code=200, media_type="application/json")
 
@@ -80,7 +121,7 @@ async def delete(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
-    exists = database.bundle_get(params.bundle_id, params.index)
+    exists = await database.bundle_get(params.bundle_id, params.index)
     if not exists:
         content = encode(
             {
@@ -89,13 +130,16 @@ async def delete(request: Request):
         )
         return Response(content, status_code=404, media_type="application/json")
 
-    bundle_chunks = database.chunks_get_by_bundle_id(params.index, params.bundle_id)
+    bundle_chunks = await database.chunks_get_by_bundle_id(
+        params.index, params.bundle_id
+    )
     chunk_ids: list[int] = [c["id"] for c in bundle_chunks]
 
     # TODO: in future consider how to make the following operations happen atomically
 
     # First, delete the bundle synchronously
-    database.bundle_del(bundle_id=params.bundle_id, index=params.index)
+    await database.bundle_del(bundle_id=params.bundle_id, index=params.index)
+    cache.bump(params.index)
 
     # Run cleanup asynchronously
     async def cleanup_async():
@@ -124,7 +168,7 @@ async def get(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
-    bundle = database.bundle_get(params.bundle_id, params.index)
+    bundle = await database.bundle_get(params.bundle_id, params.index)
     if bundle is None:
         content = encode(
             {
@@ -134,3 +178,62 @@ async def get(request: Request):
         return Response(content, status_code=404, media_type="application/json")
 
     return Response(encode(bundle), status_code=200, media_type="application/json")
+
+
+# Helpers
+# -------
+
+
+class _Streaming(StreamingResponse):
+    # Progress is sent while the body is still being read. The disconnect
+    # listener of StreamingResponse would compete for the request messages,
+    # and the ingestion never waits for a slow reader of the progress.
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def _progress(
+    task: asyncio.Task, progress: asyncio.Queue
+) -> AsyncIterator[bytes]:
+    totals = {"bundles": 0, "completed": 0, "failed": 0}
+    try:
+        while (item := await progress.get()) is not None:
+            totals["bundles"] += 1
+            totals[item.status] += 1
+            yield encode(item) + b"\n"
+
+        try:
+            await task
+        except Exception as exc:
+            totals["error"] = str(exc)
+        yield encode(totals) + b"\n"
+    finally:
+        task.cancel()  # the client went away, in flight bundles resume later
+
+
+async def _bundles(request: Request, report) -> AsyncIterator[tuple[int, Bundle]]:
+    async for line, data in _lines(request):
+        if not data.strip():
+            continue
+
+        try:
+            yield line, decoder.decode(data)
+        except DecodeError as exc:
+            report(Progress(line, "failed", error=str(exc)))
+
+
+async def _lines(request: Request) -> AsyncIterator[tuple[int, bytes]]:
+    buffer = bytearray()
+    line = 0
+
+    async for piece in request.stream():
+        buffer.extend(piece)
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            line += 1
+            yield line, bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+
+    if buffer:
+        yield line + 1, bytes(buffer)
@@ -2,12 +2,17 @@ from starlette.requests import Request
 from starlette.responses import Response
 
 from msgspec import ValidationError, convert
-from msgspec.json import encode
+from msgspec.json import Decoder, encode
 
-from retrievvy import Query, query
+from retrievvy import BatchQuery, Query, metrics, query, query_batch
 
 # We're using msgspec json encoding capabilities because it's fast :)
 
+# Decoder
+# -------
+batch_decoder = Decoder(BatchQuery)
+
+
 # Handlers
 # --------
 
@@ -19,6 +24,9 @@ async def get(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
+    # Stage timings of this query, reported back in a Server-Timing header
+    timings = metrics.track()
+
     try:
         result = await query(query_obj)
     except ValueError as exc:
@@ -29,5 +37,39 @@ async def get(request: Request):
             }
         )
         return Response(content, status_code=400, media_type="application/json")
+    except TimeoutError as exc:
+        content = encode({"detail": "Query deadline exceeded", "errors": str(exc)})
+        return Response(content, status_code=504, media_type="application/json")
+
+    # Nothing timed, the result came out of a cache
+    server_timing = metrics.server_timing(timings) or "cache;desc=hit"
+    return Response(
+        encode(result),
+        status_code=200,
+        headers={"Server-Timing": server_timing},
+        media_type="application/json",
+    )
+
+
+async def batch(request: Request):
+    try:
+        batch_obj = batch_decoder.decode(await request.body())
+    except ValidationError as exc:
+        content = encode({"detail": "Validation error", "errors": str(exc)})
+        return Response(content, status_code=422, media_type="application/json")
+
+    try:
+        results = await query_batch(batch_obj)
+    except ValueError as exc:
+        content = encode(
+            {
+                "detail": "Value Error in querying. Check that the index exists and is not empty.",
+                "errors": str(exc),
+            }
+        )
+        return Response(content, status_code=400, media_type="application/json")
+    except TimeoutError as exc:
+        content = encode({"detail": "Query deadline exceeded", "errors": str(exc)})
+        return Response(content, status_code=504, media_type="application/json")
 
-    return Response(encode(result), status_code=200, media_type="application/json")
+    return Response(encode(results), status_code=200, media_type="application/json")
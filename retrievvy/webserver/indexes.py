@@ -5,14 +5,44 @@ from starlette.requests import Request
 from starlette.responses import Response
 
 from msgspec import Struct, Meta, ValidationError, convert
-from msgspec.json import encode
+from msgspec.json import Decoder, decode, encode
 
-from retrievvy import database
+from retrievvy import cache, database, semantic_caches
+from retrievvy.index import NewIndex, create
 from retrievvy.indexes import dense, sparse
 
+# Decoder
+# -------
+decoder = Decoder(NewIndex)
+
+
 # Handlers
 # --------
 
+# Create index -----
+
+
+async def post(request: Request):
+    try:
+        new = decoder.decode(await request.body())
+    except ValidationError as exc:
+        content = encode({"detail": "Validation error", "errors": str(exc)})
+        return Response(content, status_code=422, media_type="application/json")
+
+    if await database.index_get(new.name) is not None:
+        content = encode({"detail": f"Index with name {new.name} already exists"})
+        return Response(content, status_code=409, media_type="application/json")
+
+    try:
+        await create(new)
+    except ValueError as exc:
+        content = encode({"detail": "Invalid index settings", "errors": str(exc)})
+        return Response(content, status_code=422, media_type="application/json")
+
+    index = _index(await database.index_get(new.name))
+    return Response(encode(index), status_code=201, media_type="application/json")
+
+
 # Get index -----
 
 
@@ -22,7 +52,7 @@ async def get(request: Request):
         content = encode({"detail": "Query parameter `name` is required."})
         return Response(content, status_code=422, media_type="application/json")
 
-    index = database.index_get(name)
+    index = await database.index_get(name)
     if index is None:
         content = encode(
             {
@@ -31,7 +61,9 @@ async def get(request: Request):
         )
         return Response(content, status_code=404, media_type="application/json")
 
-    return Response(encode(index), status_code=200, media_type="application/json")
+    return Response(
+        encode(_index(index)), status_code=200, media_type="application/json"
+    )
 
 
 # List indexes ------
@@ -49,7 +81,7 @@ async def list(request: Request):
         content = encode({"detail": "Validation error", "errors": str(exc)})
         return Response(content, status_code=422, media_type="application/json")
 
-    index_list = database.index_list(params.page, params.items)
+    index_list = await database.index_list(params.page, params.items)
     return Response(encode(index_list), status_code=200, media_type="application/json")
 
 
@@ -62,7 +94,7 @@ async def delete(request: Request):
         content = encode({"detail": "Query parameter `name` is required."})
         return Response(content, status_code=422, media_type="application/json")
 
-    exists = database.index_get(name)
+    exists = await database.index_get(name)
     if not exists:
         content = encode(
             {
@@ -80,6 +112,18 @@ async def delete(request: Request):
         )
 
     asyncio.create_task(cleanup_async())
-    database.index_del(name=name)
+    await database.index_del(name=name)
+    cache.bump(name)
+    semantic_caches.pop(name, None)
+    cache.drop(f"semantic:{name}")
 
     return Response(status_code=204)
+
+
+# Helpers
+# -------
+
+
+def _index(index: dict) -> dict:
+    # Options are stored as JSON
+    return {**index, "options": decode(index["options"])}
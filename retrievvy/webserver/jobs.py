@@ -0,0 +1,31 @@
+from starlette.requests import Request
+from starlette.responses import Response
+
+from msgspec.json import encode
+
+from retrievvy import database
+
+
+# Handlers
+# --------
+
+# Get job -----
+#
+# `state` is the one of the job (queued, running, completed, failed) and
+# `status` the one of its bundle (pending, chunked, completed).
+
+
+async def get(request: Request):
+    job_id = request.path_params["id"]
+
+    job = await database.job_get(job_id)
+    if job is None:
+        content = encode(
+            {
+                "detail": f"Job with id {job_id} not found",
+            }
+        )
+        return Response(content, status_code=404, media_type="application/json")
+
+    job["index"] = job.pop("idx")
+    return Response(encode(job), status_code=200, media_type="application/json")
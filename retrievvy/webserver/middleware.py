@@ -1,7 +1,9 @@
+import time
+
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 
-from retrievvy import config
+from retrievvy import config, metrics
 
 
 class AuthMiddleware(BaseHTTPMiddleware):
@@ -21,3 +23,45 @@ def bearer_token(request):
         return False
 
     return t == config.WEB_TOKEN
+
+
+class MetricsMiddleware:
+    # Pure ASGI, so the route latency includes every other middleware and
+    # streamed responses are timed until their last chunk is sent.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            metrics.ROUTES.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=route_template(scope),
+                status=str(status),
+            )
+
+
+def route_template(scope) -> str:
+    # The router fills in the endpoint and the path params, keep the
+    # label cardinality bounded by putting the param names back.
+    if "endpoint" not in scope:
+        return "unmatched"
+
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(str(value), "{" + name + "}")
+    return path
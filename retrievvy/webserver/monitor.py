@@ -0,0 +1,86 @@
+from starlette.requests import Request
+from starlette.responses import Response
+
+from msgspec.json import encode
+
+from retrievvy import cache, metrics
+from retrievvy.nlp import embeddings, embcache
+
+# Handlers
+# --------
+
+# Runtime stats -----
+
+
+async def stats(request: Request):
+    embedding_stats = embeddings.stats()
+    cache_stats = embcache.stats()
+
+    # How much worker time the cache saved, at the average cost per sentence
+    sentences = embedding_stats["sentences"]
+    busy = sum(w["busy_seconds"] for w in embedding_stats["workers"])
+    cache_stats["saved_seconds"] = (
+        cache_stats["hits"] * busy / sentences if sentences else 0.0
+    )
+
+    content = {
+        "embeddings": embedding_stats,
+        "embedding_cache": cache_stats,
+        "caches": cache.stats(),
+    }
+    return Response(encode(content), status_code=200, media_type="application/json")
+
+
+# Prometheus -----
+
+
+async def prometheus(request: Request):
+    return Response(
+        metrics.render(),
+        status_code=200,
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+# Collectors
+# ----------
+
+
+@metrics.collector
+def _embeddings():
+    embedding_stats = embeddings.stats()
+    workers = list(enumerate(embedding_stats["workers"]))
+
+    yield "retrievvy_embed_pending", "gauge", {}, embedding_stats["pending"]
+    for i, w in workers:
+        yield "retrievvy_embed_worker_load", "gauge", {"worker": i}, w["load"]
+    for i, w in workers:
+        yield (
+            "retrievvy_embed_worker_utilisation",
+            "gauge",
+            {"worker": i},
+            w["utilisation"],
+        )
+    for i, w in workers:
+        yield (
+            "retrievvy_embed_worker_busy_seconds_total",
+            "counter",
+            {"worker": i},
+            w["busy_seconds"],
+        )
+    yield "retrievvy_embed_sentences_total", "counter", {}, embedding_stats["sentences"]
+
+
+@metrics.collector
+def _caches():
+    caches = {**cache.stats(), "embeddings": embcache.stats()}
+
+    for name, c in caches.items():
+        yield "retrievvy_cache_hits_total", "counter", {"cache": name}, c["hits"]
+    for name, c in caches.items():
+        yield "retrievvy_cache_misses_total", "counter", {"cache": name}, c["misses"]
+    for name, c in caches.items():
+        yield "retrievvy_cache_items", "gauge", {"cache": name}, c["items"]
+    for name, c in caches.items():
+        if "bytes" in c:
+            yield "retrievvy_cache_bytes", "gauge", {"cache": name}, c["bytes"]
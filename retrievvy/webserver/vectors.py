@@ -1,25 +1,45 @@
+import asyncio
 import gzip
-from typing import Annotated, Any
+import io
+import zlib
+from typing import Annotated, Any, AsyncIterator, Literal, Optional, Sequence
+
+import numpy as np
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
 from msgspec import Meta, Struct, ValidationError, convert
-from msgspec.json import encode
-
+from msgspec.json import Encoder, encode
 
 from retrievvy.indexes import dense
 
+# Encoder
+# -------
+ndjson_encoder = Encoder()
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "npy": "application/x-npy",
+}
+
 
 # Handlers
 # --------
 
 # List vectors of an index
+#
+# `json` returns one page. `ndjson` and `npy` stream every vector of the
+# index from the offset on, fetching `limit` vectors at a time:
+# - ndjson: one {"id", "vector", "payload"} object per line.
+# - npy: per page, an int64 array of ids followed by a float32 array of
+#   vectors, read back by calling `numpy.load` on the stream until it ends.
 
 
 class List(Struct):
     index: str
-    offset: Annotated[int, Meta(ge=0)]
-    limit: Annotated[int, Meta(ge=0)]
+    offset: Annotated[int, Meta(ge=0)] = 0
+    limit: Annotated[int, Meta(ge=0)] = 1000
+    format: Literal["json", "ndjson", "npy"] = "json"
 
 
 async def list(request: Request):
@@ -41,18 +61,91 @@ async def list(request: Request):
         )
         return Response(content, status_code=404, media_type="application/json")
 
-    response_data: dict[str, Any] = {
-        "fetched": len(vecs),
-        "next_offset": next_offset,
-        "vectors": vecs,
-    }
+    compress = _accepts_gzip(request)
+    headers = {"Content-Encoding": "gzip"} if compress else {}
+
+    if params.format == "json":
+        response_data: dict[str, Any] = {
+            "fetched": len(vecs),
+            "next_offset": next_offset,
+            "vectors": vecs,
+        }
+
+        # Large pages take a while to compress, not on the event loop
+        content = encode(response_data)
+        if compress:
+            content = await asyncio.to_thread(gzip.compress, content)
 
-    raw_json = encode(response_data)
-    compressed = gzip.compress(raw_json)
+        return Response(
+            content=content,
+            status_code=200,
+            media_type="application/json",
+            headers=headers,
+        )
 
-    return Response(
-        content=compressed,
+    frames = _stream(params, vecs, next_offset, compress)
+    return StreamingResponse(
+        frames,
         status_code=200,
-        media_type="application/json",
-        headers={"Content-Encoding": "gzip"},
+        media_type=MEDIA_TYPES[params.format],
+        headers=headers,
     )
+
+
+# Helpers
+# -------
+
+
+async def _stream(
+    params: List,
+    vecs: Sequence[dense.Vector],
+    next_offset: Optional[int],
+    compress: bool,
+) -> AsyncIterator[bytes]:
+    # One page in memory at a time, encoded and compressed in a thread
+    compressor = zlib.compressobj(wbits=31) if compress else None  # gzip format
+
+    while True:
+        if vecs:
+            frame = await asyncio.to_thread(_frame, vecs, params.format, compressor)
+            if frame:
+                yield frame
+
+        # An empty page (limit=0) would be followed by the same one forever
+        if next_offset is None or not vecs:
+            break
+
+        vecs, next_offset = await dense.vec_list(
+            idx_name=params.index, offset=next_offset, limit=params.limit
+        )
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def _frame(vecs: Sequence[dense.Vector], kind: str, compressor) -> bytes:
+    if kind == "ndjson":
+        buffer = bytearray()
+        for vec in vecs:
+            ndjson_encoder.encode_into(vec, buffer, -1)
+            buffer.extend(b"\n")
+        data = bytes(buffer)
+    else:
+        ids = np.asarray([vec.id for vec in vecs], dtype=np.int64)
+        vectors = np.asarray([vec.vector for vec in vecs], dtype=np.float32)
+
+        stream = io.BytesIO()
+        np.lib.format.write_array(stream, ids, allow_pickle=False)
+        np.lib.format.write_array(stream, vectors, allow_pickle=False)
+        data = stream.getvalue()
+
+    return compressor.compress(data) if compressor is not None else data
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for coding in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, q = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*") and q.strip() not in ("q=0", "q=0.0"):
+            return True
+
+    return False
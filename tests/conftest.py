@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+import pytest
+
+# Settings are read on import, before any test module imports retrievvy
+os.environ.setdefault("DATA", tempfile.mkdtemp(prefix="retrievvy-tests-"))
+os.environ.setdefault("QDRANT_URL", ":memory:")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    from retrievvy import database
+
+    database.init()
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from retrievvy import index
+from retrievvy.index import Bundle
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    # One bundle per group and one group per queue, the queues fill up fast
+    monkeypatch.setattr(index, "BULK_GROUP_BUNDLES", 1)
+    monkeypatch.setattr(index, "BULK_PIPELINE_DEPTH", 1)
+
+    async def passthrough(group, *args):
+        pass
+
+    for name in ("_bulk_indexes", "_bulk_chunk", "_bulk_embed"):
+        monkeypatch.setattr(index, name, passthrough)
+
+    indexed: list[int] = []
+
+    async def bulk_index(group, report):
+        indexed.extend(line for line, _ in group.items)
+
+    monkeypatch.setattr(index, "_bulk_index", bulk_index)
+    return indexed
+
+
+async def _stream(n: int):
+    for line in range(n):
+        yield line, Bundle(str(line), "bulk", "test", f"bundle {line}", ["text"])
+
+
+def test_every_bundle_goes_through(stages):
+    asyncio.run(asyncio.wait_for(index.run_bulk(_stream(50), print), 5))
+
+    assert stages == list(range(50))
+
+
+def test_failing_stage_stops_the_pipeline(stages, monkeypatch):
+    async def bulk_index(group, report):
+        # Upstream stages fill their queues meanwhile
+        await asyncio.sleep(0.05)
+        raise RuntimeError("index down")
+
+    monkeypatch.setattr(index, "_bulk_index", bulk_index)
+
+    with pytest.raises(ExceptionGroup) as exc:
+        asyncio.run(asyncio.wait_for(index.run_bulk(_stream(50), print), 5))
+
+    assert [type(e) for e in exc.value.exceptions] == [RuntimeError]
+
+
+def test_failing_stream_stops_the_pipeline(stages):
+    async def stream():
+        async for item in _stream(20):
+            yield item
+        raise ConnectionResetError("client gone")
+
+    with pytest.raises(ExceptionGroup) as exc:
+        asyncio.run(asyncio.wait_for(index.run_bulk(stream(), print), 5))
+
+    assert [type(e) for e in exc.value.exceptions] == [ConnectionResetError]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from retrievvy import cache
+
+
+def test_lru_serves_the_stored_generation_only():
+    lru = cache.LRU("test-generations", capacity=2)
+    lru.put("q", "result", version=cache.generation("docs"))
+    assert lru.get("q", version=cache.generation("docs")) == "result"
+
+    cache.bump("docs")
+    assert lru.get("q", version=cache.generation("docs")) is None
+    assert len(lru) == 0
+
+
+def test_lru_evicts_least_recently_used():
+    lru = cache.LRU("test-evictions", capacity=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    lru.get("a")
+    lru.put("c", 3)
+
+    assert (lru.get("a"), lru.get("b"), lru.get("c")) == (1, None, 3)
+
+
+def test_semantic_hits_paraphrases_of_the_same_generation():
+    semantic = cache.Semantic("test-semantic", capacity=4, threshold=0.95)
+    semantic.put(np.array([1.0, 0.0]), limit=10, value="result", version=1)
+
+    assert semantic.get(np.array([0.99, 0.05]), limit=5, version=1) == "result"
+    assert semantic.get(np.array([0.99, 0.05]), limit=20, version=1) is None
+    assert semantic.get(np.array([0.99, 0.05]), limit=5, version=2) is None
+    assert semantic.get(np.array([0.0, 1.0]), limit=5, version=1) is None
+
+
+def test_records_drop_discards_fetches_running_meanwhile():
+    records = cache.Records("test-records", 1024, size=len, group=lambda r: r[0])
+    token = records.token()
+    records.put_many({1: "a-chunk"}, token)
+    assert records.get_many([1, 2]) == ({1: "a-chunk"}, [2])
+
+    token = records.token()
+    records.drop(lambda group: group == "a")
+    records.put_many({2: "a-other"}, token)
+    assert records.get_many([1, 2]) == ({}, [1, 2])
+
+
+def test_dropped_caches_are_not_reported():
+    cache.Semantic("semantic:gone", capacity=4, threshold=0.9)
+    assert "semantic:gone" in cache.stats()
+
+    cache.drop("semantic:gone")
+    assert "semantic:gone" not in cache.stats()
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from msgspec.json import encode
+
+from retrievvy import database, jobs
+from retrievvy.index import Bundle
+
+
+@pytest.fixture(autouse=True)
+def no_jobs():
+    asyncio.run(database.write(lambda db: db.execute("DELETE FROM jobs")))
+
+
+def _add(bundle_id: str) -> tuple[str, str]:
+    bundle = Bundle(bundle_id, "jobs", "test", bundle_id, ["text"])
+    return asyncio.run(database.job_add(bundle.id, bundle.index, encode(bundle)))
+
+
+def _expire(job_id: str) -> None:
+    # As if its process stopped renewing the lease a while ago
+    asyncio.run(
+        database.write(
+            lambda db: db.execute(
+                "UPDATE jobs SET updated = datetime('now', '-1 hour') WHERE id = ?",
+                (job_id,),
+            )
+        )
+    )
+
+
+def test_claim_renew_finish():
+    job_id, outcome = _add("a")
+    assert outcome == "queued"
+
+    job = asyncio.run(database.job_claim("owner-1"))
+    assert job["id"] == job_id
+    assert asyncio.run(database.job_claim("owner-2")) is None
+
+    assert asyncio.run(database.job_renew(job_id, "owner-1"))
+    assert not asyncio.run(database.job_renew(job_id, "owner-2"))
+
+    asyncio.run(database.job_finish(job_id, "owner-1", "completed"))
+    job = asyncio.run(database.job_get(job_id))
+    assert (job["state"], job["attempts"]) == ("completed", 1)
+    assert not asyncio.run(database.job_renew(job_id, "owner-1"))
+
+
+def test_jobs_are_claimed_oldest_first():
+    first, _ = _add("a")
+    second, _ = _add("b")
+
+    assert asyncio.run(database.job_claim("owner"))["id"] == first
+    assert asyncio.run(database.job_claim("owner"))["id"] == second
+
+
+def test_payload_of_a_queued_job_is_replaced():
+    job_id, _ = _add("a")
+    assert _add("a") == (job_id, "replaced")
+
+    asyncio.run(database.job_claim("owner"))
+    assert _add("a") == (job_id, "running")
+
+
+def test_expired_lease_is_recovered():
+    job_id, _ = _add("a")
+    asyncio.run(database.job_claim("owner-1"))
+
+    # A live lease is left alone
+    assert asyncio.run(database.jobs_recover(60)) == 0
+
+    _expire(job_id)
+    assert asyncio.run(database.jobs_recover(60)) == 1
+
+    # The old owner lost it, its late outcome is ignored
+    assert not asyncio.run(database.job_renew(job_id, "owner-1"))
+    assert asyncio.run(database.job_claim("owner-2"))["id"] == job_id
+    asyncio.run(database.job_finish(job_id, "owner-1", "failed", error="late"))
+
+    job = asyncio.run(database.job_get(job_id))
+    assert (job["state"], job["attempts"]) == ("running", 2)
+
+    asyncio.run(database.job_finish(job_id, "owner-2", "completed"))
+    assert asyncio.run(database.job_get(job_id))["state"] == "completed"
+
+
+def test_worker_runs_a_job(monkeypatch):
+    ran: list[str] = []
+
+    async def ensure(name):
+        pass
+
+    async def run(bundle):
+        ran.append(bundle.id)
+        return "completed"
+
+    monkeypatch.setattr(jobs, "ensure", ensure)
+    monkeypatch.setattr(jobs, "run", run)
+
+    job_id, _ = _add("a")
+    job = asyncio.run(database.job_claim(jobs.OWNER))
+    asyncio.run(jobs._run(job))
+
+    assert ran == ["a"]
+    assert asyncio.run(database.job_get(job_id))["state"] == "completed"
+
+
+def test_worker_records_a_failed_job(monkeypatch):
+    async def ensure(name):
+        pass
+
+    async def run(bundle):
+        raise RuntimeError("embedding worker gone")
+
+    monkeypatch.setattr(jobs, "ensure", ensure)
+    monkeypatch.setattr(jobs, "run", run)
+
+    job_id, _ = _add("a")
+    job = asyncio.run(database.job_claim(jobs.OWNER))
+    asyncio.run(jobs._run(job))
+
+    job = asyncio.run(database.job_get(job_id))
+    assert (job["state"], job["error"]) == ("failed", "embedding worker gone")
@@ -0,0 +1,66 @@
+import asyncio
+import builtins
+
+import pytest
+
+from retrievvy.indexes.dense import memmap
+from retrievvy.indexes.dense.base import Vector
+
+
+@pytest.fixture
+def index(request):
+    name = f"memmap-{request.node.name}"
+    asyncio.run(memmap.create(name, 2))
+    asyncio.run(memmap.vec_add(name, [Vector(1, [1, 0]), Vector(2, [0, 1])]))
+    yield name
+    asyncio.run(memmap.delete(name))
+
+
+def _points(name: str) -> dict[int, list[float]]:
+    vectors, _ = asyncio.run(memmap.vec_list(name, 0, 100))
+    return {v.id: [round(x, 3) for x in v.vector] for v in vectors}
+
+
+def _hits(name: str) -> list[int]:
+    return sorted(hit.id for hit in asyncio.run(memmap.query(name, [1, 1], 10)))
+
+
+def test_add_replaces_points(index):
+    asyncio.run(memmap.vec_add(index, [Vector(1, [0, 3])]))
+
+    assert _points(index) == {1: [0.0, 1.0], 2: [0.0, 1.0]}
+    assert _hits(index) == [1, 2]
+
+
+def test_failed_add_keeps_replaced_points(index, monkeypatch):
+    def open_(file, mode="r", *args, **kwargs):
+        if mode == "ab" and str(file).endswith(".i64"):
+            raise OSError("No space left on device")
+        return builtins.open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(memmap, "open", open_, raising=False)
+    with pytest.raises(OSError):
+        asyncio.run(memmap.vec_add(index, [Vector(1, [0, 3])]))
+
+    assert _points(index) == {1: [1.0, 0.0], 2: [0.0, 1.0]}
+
+    # The files were cut back, later adds line up with their rows
+    monkeypatch.undo()
+    asyncio.run(memmap.vec_add(index, [Vector(3, [1, 1])]))
+    memmap._stores.pop(index)
+    assert _points(index) == {1: [1.0, 0.0], 2: [0.0, 1.0], 3: [0.707, 0.707]}
+
+
+def test_add_cut_short_before_tombstones(index, monkeypatch):
+    def crash(*args):
+        raise OSError("Killed")
+
+    monkeypatch.setattr(memmap, "_tombstone", crash)
+    with pytest.raises(OSError):
+        asyncio.run(memmap.vec_add(index, [Vector(1, [0, 3])]))
+
+    # Loaded again as after a restart, the new vector wins
+    monkeypatch.undo()
+    memmap._stores.pop(index)
+    assert _points(index) == {1: [0.0, 1.0], 2: [0.0, 1.0]}
+    assert _hits(index) == [1, 2]
@@ -0,0 +1,127 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import retrievvy
+from retrievvy import Query, database
+from retrievvy.indexes import dense, sparse
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """Both engines find chunk 1, the dense one chunk 2 too."""
+    retrievvy.query_cache.clear()
+    retrievvy.result_cache.clear()
+
+    async def embed(texts):
+        return [np.ones(4, dtype=np.float32) for _ in texts]
+
+    async def query_dense(index, vec, limit, params=None):
+        return [dense.Hit(1, None, 0.9), dense.Hit(2, None, 0.5)]
+
+    async def chunks_get(ids):
+        return {
+            id_: database.ChunkRecord(id_, "docs", "b", f"chunk {id_}", "0-1", id_)
+            for id_ in ids
+        }
+
+    monkeypatch.setattr(retrievvy.keywords, "get", lambda text: text.split())
+    monkeypatch.setattr(retrievvy.embeddings, "get_async", embed)
+    monkeypatch.setattr(sparse, "query", lambda index, q, limit: [sparse.Hit(1, 1.0)])
+    monkeypatch.setattr(dense, "query", query_dense)
+    monkeypatch.setattr(database, "chunks_get", chunks_get)
+    return monkeypatch
+
+
+def _query(deadline_ms: int = 0) -> retrievvy.Result:
+    q = Query("what is docker", "docs", 5, deadline_ms=deadline_ms)
+    return asyncio.run(retrievvy.query(q))
+
+
+async def _fail(*args, **kwargs):
+    raise ConnectionError("engine down")
+
+
+def _raise(*args, **kwargs):
+    raise ConnectionError("engine down")
+
+
+def test_fuses_both_engines(engines):
+    result = _query()
+
+    assert not result.degraded
+    assert [hit.id for hit in result.hits] == [1, 2]
+
+
+def test_failing_dense_engine_degrades(engines):
+    engines.setattr(dense, "query", _fail)
+
+    result = _query()
+
+    assert result.degraded
+    assert [hit.id for hit in result.hits] == [1]
+
+
+def test_failing_sparse_engine_degrades(engines):
+    engines.setattr(sparse, "query", _raise)
+
+    result = _query()
+
+    assert result.degraded
+    assert [hit.id for hit in result.hits] == [1, 2]
+
+
+def test_failing_embedding_degrades(engines):
+    engines.setattr(retrievvy.embeddings, "get_async", _fail)
+
+    result = _query()
+
+    assert result.degraded
+    assert [hit.id for hit in result.hits] == [1]
+
+
+def test_late_engine_and_no_hits_is_empty(engines):
+    async def late(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    engines.setattr(sparse, "query", lambda index, q, limit: [])
+    engines.setattr(dense, "query", late)
+
+    result = _query(deadline_ms=50)
+
+    assert result.degraded
+    assert result.hits == []
+
+
+def test_degraded_results_are_not_cached(engines):
+    engines.setattr(dense, "query", _fail)
+
+    assert _query().degraded
+    assert len(retrievvy.result_cache) == 0
+
+
+def test_both_engines_failing_raises(engines):
+    engines.setattr(sparse, "query", _raise)
+    engines.setattr(dense, "query", _fail)
+
+    with pytest.raises(ConnectionError):
+        _query()
+
+
+def test_batch_failing_dense_engine_degrades(engines):
+    async def query_batch(index, vecs, limit, params=None):
+        raise ConnectionError("engine down")
+
+    engines.setattr(
+        sparse,
+        "query_batch",
+        lambda index, qs, limit: [[sparse.Hit(1, 1.0)] for _ in qs],
+    )
+    engines.setattr(dense, "query_batch", query_batch)
+
+    q = retrievvy.BatchQuery("docs", 5, ["what is docker", "what is qdrant"], 0)
+    results = asyncio.run(retrievvy.query_batch(q))
+
+    assert all(result.degraded for result in results)
+    assert [[hit.id for hit in result.hits] for result in results] == [[1], [1]]